@@ -1,5 +1,6 @@
 from pydantic_settings import BaseSettings, SettingsConfigDict
-from typing import List, Dict
+from typing import List, Dict, Any
+import json
 import os
 
 class Settings(BaseSettings):
@@ -18,6 +19,105 @@ class Settings(BaseSettings):
     PPLX_COOKIE: str = ""
     PPLX_USER_AGENT: str = ""
 
+    # 多账号池：JSON 文件，格式 [{"name": "a1", "cookie": "...", "user_agent": "...", "weight": 1}]
+    PPLX_ACCOUNTS_FILE: str = ""
+    SESSION_STRATEGY: str = "least_inflight"  # least_inflight | weighted_rr
+    SESSION_COOLDOWN_SECONDS: float = 60.0     # 403/429 后的基础冷却时间（按连续失败次数指数增长）
+    SESSION_MAX_FAILURES: int = 5              # 连续 403/429 达到该次数后剔除，直到刷新成功
+
+    # 会话存储：多 worker / 多容器共享 Cookie，只有持有租约的 worker 启动浏览器刷新
+    SESSION_STORE: str = "memory"              # memory (单 worker) | file (本机多 worker) | redis (跨主机)
+    SESSION_STORE_DIR: str = "debug/sessions"
+    REDIS_URL: str = "redis://localhost:6379/0"
+    SESSION_LEASE_SECONDS: float = 120.0       # 刷新租约有效期，也是其他 worker 等待刷新结果的上限
+
+    # 后台会话保活：Cookie 过期前主动刷新；没有过期时间时按 403 比例自适应调整间隔
+    KEEPALIVE_ENABLED: bool = True
+    KEEPALIVE_INTERVAL: float = 240.0          # 初始续期间隔
+    KEEPALIVE_MIN_INTERVAL: float = 60.0
+    KEEPALIVE_MAX_INTERVAL: float = 1800.0     # 同时是请求触发的惰性刷新的间隔（兜底）
+    KEEPALIVE_EXPIRY_MARGIN: float = 120.0     # 在关键 Cookie 过期前多久续期
+    KEEPALIVE_FORBIDDEN_RATE: float = 0.05     # 一个周期内 403 比例达到该值时间隔减半
+    KEEPALIVE_JITTER: float = 0.1              # 计划时间 ±10% 随机抖动
+    KEEPALIVE_BACKOFF: float = 30.0            # 续期失败后的退避基数（秒）
+    KEEPALIVE_COOKIES: str = "pplx.visitor-id,__cf_bm,cf_clearance"
+    ENV_PERSIST_DEBOUNCE_SECONDS: float = 5.0  # 刷新后的 Cookie 写回 .env 前的合并窗口
+
+    # 上游连接池 (整个应用共享一个 httpx.AsyncClient)
+    UPSTREAM_HTTP2: bool = True
+    UPSTREAM_MAX_CONNECTIONS: int = 20
+    UPSTREAM_MAX_KEEPALIVE: int = 10
+    UPSTREAM_KEEPALIVE_EXPIRY: float = 120.0
+    UPSTREAM_TIMEOUT: float = 300.0
+    UPSTREAM_CONNECT_TIMEOUT: float = 15.0
+
+    # 首个增量之前的失败（403/429/5xx/网络错误）换会话或刷新后重试
+    UPSTREAM_MAX_ATTEMPTS: int = 3
+    UPSTREAM_RETRY_BACKOFF: float = 0.5      # 退避基数（秒），按 2^n 增长并加抖动
+    UPSTREAM_RETRY_BACKOFF_MAX: float = 8.0
+    # 对冲：首字节超过近期 TTFB 的分位数仍未到达时，再发一个请求，先到者胜出（会多消耗额度，默认关闭）
+    UPSTREAM_HEDGE_ENABLED: bool = False
+    UPSTREAM_HEDGE_PERCENTILE: float = 95.0
+    UPSTREAM_HEDGE_MIN_SAMPLES: int = 20
+    UPSTREAM_HEDGE_MIN_DELAY: float = 1.0
+    # 已经输出内容后上游中断：error = 追加错误提示后结束；truncate = 以 finish_reason=length 结束
+    UPSTREAM_MIDSTREAM_POLICY: str = "error"
+    # 上游读取与客户端写出之间的有界缓冲（按增量个数计）；缓冲持续写满（客户端不读）超过
+    # STREAM_STALL_TIMEOUT 秒或客户端断开时取消上游。断开检测每 STREAM_DISCONNECT_CHECK_INTERVAL 秒一次
+    STREAM_BUFFER_SIZE: int = 64
+    STREAM_STALL_TIMEOUT: float = 30.0
+    STREAM_DISCONNECT_CHECK_INTERVAL: float = 1.0
+    # 熔断器：连续失败达到阈值后打开，期间直接失败（或回放过期缓存），冷却后放行一个试探请求
+    UPSTREAM_BREAKER_THRESHOLD: int = 5       # 上游 5xx / 连接失败 / 超时
+    UPSTREAM_BREAKER_RESET_SECONDS: float = 30.0
+    REFRESH_BREAKER_THRESHOLD: int = 3        # 浏览器刷新 Cookie 失败
+    REFRESH_BREAKER_RESET_SECONDS: float = 120.0
+
+    # 准入控制：/v1/chat/completions 的全局/单 Key 并发上限与等待队列
+    ADMISSION_MAX_INFLIGHT: int = 32
+    ADMISSION_PER_KEY_LIMIT: int = 8        # 0 表示不限制
+    ADMISSION_MAX_QUEUE: int = 64
+    ADMISSION_QUEUE_TIMEOUT: float = 30.0
+
+    # 批处理 (/v1/files + /v1/batches)：后台执行，优先级低于交互请求
+    BATCH_DIR: str = "debug/batches"          # 输入 / 输出文件与进度，重启后从这里恢复
+    BATCH_CONCURRENCY: int = 4                # 所有批处理合计的并发请求数
+    BATCH_ADMISSION_HEADROOM: int = 4         # 批处理至少给交互请求留出的空闲槽位数
+    BATCH_MAX_REQUESTS: int = 50000
+    BATCH_MAX_FILE_BYTES: int = 100 * 1024 * 1024
+
+    # 回答缓存 (默认关闭)：相同 query + 模型 + 搜索参数直接回放缓存的回答
+    CACHE_ENABLED: bool = False
+    CACHE_TTL_SECONDS: float = 600.0
+    CACHE_MAX_ENTRIES: int = 1000
+    CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    CACHE_DIR: str = ""  # 非空时启用磁盘后端，重启后仍然有效
+    CACHE_STALE_SECONDS: float = 86400.0  # 过期后继续保留多久，仅在上游熔断时回放
+
+    # 多轮对话拼装为 query_str 时历史部分的预算，最后一条 user 消息本身不截断（PROMPT_MAX_TOKENS > 0 时按估算 token 计，否则按字符计）
+    PROMPT_MAX_CHARS: int = 8000
+    PROMPT_MAX_TOKENS: int = 0
+    PROMPT_CACHE_SIZE: int = 256  # 缓存已渲染历史的会话数
+
+    # 多轮对话的后续轮次作为上游 thread 的追问发送（记录 backend_uuid 等标识）；
+    # 只对带 conversation_id 的请求生效，按 API Key 隔离，且历史须与上一轮回答后的完全一致
+    THREAD_FOLLOWUP_ENABLED: bool = True
+    THREAD_STORE_MAX_ENTRIES: int = 2000
+    THREAD_TTL_SECONDS: float = 3600.0
+
+    # 相同 query + 模型 + 搜索参数的并发请求合并为一个上游流
+    COALESCE_ENABLED: bool = True
+
+    # 日志：生产环境建议 LOG_LEVEL=INFO，LOG_JSON / LOG_ENQUEUE 按需开启
+    LOG_LEVEL: str = "DEBUG"
+    LOG_JSON: bool = False         # 每行输出一个 JSON 对象
+    LOG_ENQUEUE: bool = False      # 经队列由后台线程写出，不阻塞事件循环
+    LOG_SAMPLE_WINDOW: float = 60.0
+    LOG_SAMPLE_BURST: int = 10     # 同一位置的 WARNING+ 日志每个窗口最多输出条数，0 表示不采样
+
+    # 常驻浏览器健康检查间隔（秒），崩溃后自动重启
+    BROWSER_HEALTH_CHECK_INTERVAL: float = 60.0
+
     MODELS: List[str] = [
         "gemini30pro", 
         "gpt-4o",
@@ -27,10 +127,9 @@ class Settings(BaseSettings):
     ]
     DEFAULT_MODEL: str = "gemini30pro"
 
-    def get_initial_cookies_dict(self) -> List[Dict[str, str]]:
+    def parse_cookie_string(self, raw_cookie: str) -> List[Dict[str, str]]:
         """解析 Cookie 字符串"""
         cookies = []
-        raw_cookie = self.PPLX_COOKIE
         
         if not raw_cookie:
             return cookies
@@ -50,4 +149,34 @@ class Settings(BaseSettings):
                     })
         return cookies
 
+    def get_initial_cookies_dict(self) -> List[Dict[str, str]]:
+        return self.parse_cookie_string(self.PPLX_COOKIE)
+
+    def get_accounts(self) -> List[Dict[str, Any]]:
+        """
+        账号列表：.env 中的 PPLX_COOKIE 作为 "default" 账号，
+        PPLX_ACCOUNTS_FILE 中的账号追加在后面。
+        """
+        accounts = []
+        if self.PPLX_COOKIE:
+            accounts.append({
+                "name": "default",
+                "cookie": self.PPLX_COOKIE,
+                "user_agent": self.PPLX_USER_AGENT,
+                "weight": 1.0,
+                "persist_env": True,
+            })
+
+        if self.PPLX_ACCOUNTS_FILE and os.path.exists(self.PPLX_ACCOUNTS_FILE):
+            with open(self.PPLX_ACCOUNTS_FILE, 'r', encoding='utf-8') as f:
+                for i, item in enumerate(json.load(f)):
+                    accounts.append({
+                        "name": item.get("name") or f"account-{i + 1}",
+                        "cookie": item.get("cookie", ""),
+                        "user_agent": item.get("user_agent") or self.PPLX_USER_AGENT,
+                        "weight": float(item.get("weight", 1.0)),
+                        "persist_env": False,
+                    })
+        return accounts
+
 settings = Settings()
\ No newline at end of file
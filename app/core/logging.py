@@ -0,0 +1,82 @@
+import inspect
+import logging
+import sys
+import time
+from typing import Dict, Tuple
+from loguru import logger
+
+from app.core.config import settings
+
+# 第三方库的 DEBUG/INFO 日志很多（h2/hpack 每帧都有，且会带出完整 Cookie），无论 LOG_LEVEL 如何都只放行 WARNING 及以上
+THIRD_PARTY_LOGGERS = ("httpx", "httpcore", "h2", "hpack", "playwright", "asyncio")
+
+LOG_FORMAT = "<green>{time:HH:mm:ss}</green> | <level>{level: <8}</level> | <cyan>{name}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>"
+
+
+class WarningSampler:
+    """
+    重复日志采样：同一调用点（模块 + 行号）的 WARNING 及以上日志，
+    每个时间窗口内只放行前 burst 条，其余丢弃；窗口结束后放行的第一条附带被抑制的条数。
+    """
+    def __init__(self, window: float, burst: int):
+        self.window = window
+        self.burst = burst
+        self._sites: Dict[Tuple[str, int], list] = {}  # [窗口起点, 本窗口条数, 被抑制条数]
+
+    def __call__(self, record) -> bool:
+        if self.burst <= 0 or record["level"].no < logging.WARNING:
+            return True
+        site = (record["name"], record["line"])
+        now = time.monotonic()
+        state = self._sites.get(site)
+        if state is None or now - state[0] >= self.window:
+            suppressed = state[2] if state else 0
+            self._sites[site] = [now, 1, 0]
+            if suppressed:
+                record["message"] += f" (过去 {self.window:.0f}s 内另有 {suppressed} 条相同位置的日志被抑制)"
+            return True
+        if state[1] < self.burst:
+            state[1] += 1
+            return True
+        state[2] += 1
+        return False
+
+
+class InterceptHandler(logging.Handler):
+    """把标准库 logging（services 模块、第三方库）转发到 loguru，统一级别、格式与采样"""
+    def emit(self, record: logging.LogRecord):
+        try:
+            level = logger.level(record.levelname).name
+        except ValueError:
+            level = record.levelno
+        # 跳过 logging 模块自身的栈帧，让 {name}:{line} 指向真正的调用方
+        frame, depth = inspect.currentframe(), 0
+        while frame is not None and (depth == 0 or frame.f_code.co_filename == logging.__file__):
+            frame = frame.f_back
+            depth += 1
+        logger.opt(depth=depth, exception=record.exc_info).log(level, record.getMessage())
+
+
+def setup_logging():
+    """
+    根据配置安装日志 sink：
+    - LOG_LEVEL 控制级别，低于该级别的 {} 占位日志不会被格式化；
+    - LOG_JSON 输出每行一个 JSON；
+    - LOG_ENQUEUE 通过队列由后台线程写出，写 stdout 慢时不阻塞事件循环。
+    标准库 logging 只有 app.* 按 LOG_LEVEL 转发，其余（第三方库）只转发 WARNING 及以上。
+    """
+    logger.remove()
+    logger.add(
+        sys.stdout,
+        level=settings.LOG_LEVEL.upper(),
+        format=LOG_FORMAT,
+        serialize=settings.LOG_JSON,
+        enqueue=settings.LOG_ENQUEUE,
+        filter=WarningSampler(settings.LOG_SAMPLE_WINDOW, settings.LOG_SAMPLE_BURST),
+        backtrace=False,
+        diagnose=False,
+    )
+    logging.basicConfig(handlers=[InterceptHandler()], level=logging.WARNING, force=True)
+    logging.getLogger("app").setLevel(settings.LOG_LEVEL.upper())
+    for name in THIRD_PARTY_LOGGERS:
+        logging.getLogger(name).setLevel(max(logging.getLogger(name).level, logging.WARNING))
@@ -1,10 +1,12 @@
 from abc import ABC, abstractmethod
-from typing import Dict, Any
+from typing import Dict, Any, Optional, Union
+from fastapi import Request
 from fastapi.responses import StreamingResponse, JSONResponse
 
 class BaseProvider(ABC):
     @abstractmethod
-    async def chat_completion(self, request_data: Dict[str, Any]) -> StreamingResponse:
+    async def chat_completion(self, request_data: Dict[str, Any],
+                              request: Optional[Request] = None) -> Union[StreamingResponse, JSONResponse]:
         pass
 
     @abstractmethod
@@ -1,46 +1,317 @@
+import asyncio
+import hashlib
 import json
+import math
 import time
 import uuid
 import logging
 import httpx
-from typing import Dict, Any, AsyncGenerator
-from fastapi import HTTPException
+from typing import Dict, Any, AsyncGenerator, List, Optional, Union
+from fastapi import HTTPException, Request
 from fastapi.responses import StreamingResponse, JSONResponse
 from loguru import logger
 
 from app.core.config import settings
 from app.providers.base_provider import BaseProvider
-from app.services.browser_service import BrowserService
-from app.utils.sse_utils import create_sse_data, create_chat_completion_chunk, DONE_CHUNK
+from app.services.browser_manager import browser_manager
+from app.services.session_pool import SessionPool
+from app.services.response_cache import ResponseCache
+from app.services.request_coalescer import RequestCoalescer
+from app.services.thread_store import ThreadStore, ThreadState, ThreadTurn, history_digest, add_to_digest
+from app.services.upstream_client import UpstreamClient
+from app.services.retry_policy import HedgePolicy, backoff_delay, is_retryable
+from app.utils.circuit_breaker import CircuitBreaker, CircuitOpenError
+from app.utils.stream_decoder import AnswerStreamDecoder
+from app.utils.sse_parser import SSEEvent, SSEParser
+from app.utils.prompt_packer import PromptPacker, content_text
+from app.utils.sse_utils import ChunkEncoder, create_chat_completion, DONE_CHUNK
+from app.utils.json_utils import JsonTemplate
+from app.utils import metrics
+
+# 会影响回答内容的搜索参数，同时用于构造缓存 key
+SEARCH_OPTIONS = {
+    "language": "zh-CN",
+    "search_focus": "internet",
+    "sources": ["edgar", "social", "web", "scholar"],
+    "mode": "copilot",
+}
+
+# 追问时从 thread 带入请求体的字段
+FOLLOWUP_FIELDS = ("backend_uuid", "read_write_token", "frontend_context_uuid")
+
+class UpstreamError(Exception):
+    """上游返回非 200 状态码，或在流中返回错误事件（status=FAILED，按 502 处理）"""
+    def __init__(self, status_code: int, detail: Optional[str] = None):
+        super().__init__(detail or f"Upstream {status_code}")
+        self.status_code = status_code
+
+class UpstreamInterrupted(Exception):
+    """已经向客户端输出内容后上游失败，无法透明重试"""
+
+class ClientGone(Exception):
+    """客户端断开或长时间不读取，已取消上游"""
+    def __init__(self, reason: str):
+        super().__init__(f"client {reason}")
+        self.reason = reason
+
+_END = object()  # 有界缓冲中的结束标记
+
+def _model_label(model: str) -> str:
+    """指标的 model 标签只取已配置的模型，其余归为 other，客户端随意传值不会让标签基数无限增长"""
+    return model if model in settings.MODELS else "other"
+
+class _UpstreamAttempt:
+    """
+    一次上游请求：占用会话 -> 刷新 Cookie -> 发送 -> 等到首个数据分片。
+    打开失败或被取消时自行关闭并归还会话；成功后由调用方 close()。
+    结果计入上游熔断器：5xx / 连接失败 / 超时算失败，403/429 属于账号问题，交给会话池处理。
+    """
+    def __init__(self, provider: "PerplexityProvider", request_id: str, model: str, query: str,
+                 turn: Optional[ThreadTurn], tried: List[str]):
+        self.provider = provider
+        self.request_id = request_id
+        self.model = model
+        self.query = query
+        self.turn = turn
+        self.tried = tried
+        self.session = None
+        self.session_name = ""
+        self.response: Optional[httpx.Response] = None
+        self.status_code: Optional[int] = None
+        self.sent_at = 0.0
+        self._chunks = None
+        self._first_chunk: Optional[bytes] = None
+        self.finished = False
+
+    async def open(self):
+        p = self.provider
+        p.breaker.before_call()
+        outcome: Optional[bool] = None
+        try:
+            thread = self.turn.thread if self.turn is not None else None
+            # 追问优先回到创建 thread 的账号；重试时避开已经失败过的账号
+            self.session = p.pool.acquire(prefer=thread.session_name if thread else None, avoid=self.tried)
+            self.session_name = self.session.name
+            self.tried.append(self.session_name)
+            if thread is not None and self.session_name != thread.session_name:
+                thread = None  # thread 属于其他账号，只能带完整上下文重新提问
+            payload = p._encode_payload(self.turn.question if thread else self.query, self.model, thread)
+
+            with metrics.REFRESH_WAIT.time():
+                await self.session.service.refresh_context()
+            # 缓存的请求头已包含 Cookie；复制一份再加上本次的 request id
+            headers = {**self.session.service.get_headers(), "x-request-id": self.request_id}
+
+            logger.info("=== 发送请求 [{}] via [{}] ===", self.request_id, self.session_name)
+
+            self.sent_at = time.perf_counter()
+            self.response = await p.http.open("POST", settings.API_URL, content=payload, headers=headers)
+            self.status_code = self.response.status_code
+            metrics.UPSTREAM_STATUS.inc(status=self.status_code)
+
+            if self.status_code != 200:
+                if self.status_code >= 500:
+                    outcome = False
+                if thread is not None:
+                    p.threads.discard(self.turn.key)
+                error_text = await self.response.aread()
+                logger.error("上游错误 {}: {}", self.status_code, error_text.decode('utf-8', errors='ignore'))
+                raise UpstreamError(self.status_code)
+
+            self._chunks = self.response.aiter_bytes()
+            try:
+                self._first_chunk = await self._chunks.__anext__()
+            except StopAsyncIteration:
+                self._first_chunk = None
+            ttfb = time.perf_counter() - self.sent_at
+            metrics.UPSTREAM_TTFB.observe(ttfb)
+            p.hedge.observe(ttfb)
+            outcome = True
+        except httpx.TransportError:
+            outcome = False
+            await self.close()
+            raise
+        except BaseException:
+            await self.close()
+            raise
+        finally:
+            p.breaker.after_call(outcome)
+
+    async def events(self) -> AsyncGenerator[SSEEvent, None]:
+        """按字节分片增量切出完整的 SSE 事件"""
+        if self._first_chunk is not None:
+            parser = SSEParser()
+            for event in parser.feed(self._first_chunk):
+                yield event
+            async for chunk in self._chunks:
+                for event in parser.feed(chunk):
+                    yield event
+            for event in parser.flush():
+                yield event
+        self.finished = True
+
+    async def close(self):
+        if self.session is None:
+            return
+        session, self.session = self.session, None
+        try:
+            if self.response is not None:
+                if self.status_code == 200 and not self.finished:
+                    metrics.UPSTREAM_ABORTED.inc()
+                await self.response.aclose()
+        finally:
+            if self.sent_at:
+                metrics.STREAM_DURATION.observe(time.perf_counter() - self.sent_at, model=_model_label(self.model))
+            self.provider.pool.release(session, self.status_code)
 
 class PerplexityProvider(BaseProvider):
     def __init__(self):
-        self.solver = BrowserService()
+        self.pool = SessionPool()
+        self.http = UpstreamClient()
+        self.cache: Optional[ResponseCache] = None
+        if settings.CACHE_ENABLED:
+            self.cache = ResponseCache(
+                ttl=settings.CACHE_TTL_SECONDS,
+                max_entries=settings.CACHE_MAX_ENTRIES,
+                max_bytes=settings.CACHE_MAX_BYTES,
+                disk_dir=settings.CACHE_DIR,
+                stale_ttl=settings.CACHE_STALE_SECONDS,
+            )
+        self.breaker = CircuitBreaker(
+            "upstream",
+            failure_threshold=settings.UPSTREAM_BREAKER_THRESHOLD,
+            reset_timeout=settings.UPSTREAM_BREAKER_RESET_SECONDS,
+        )
+
+        self.coalescer: Optional[RequestCoalescer] = RequestCoalescer() if settings.COALESCE_ENABLED else None
+        self.packer = PromptPacker(
+            max_chars=settings.PROMPT_MAX_CHARS,
+            max_tokens=settings.PROMPT_MAX_TOKENS,
+            cache_size=settings.PROMPT_CACHE_SIZE,
+        )
+        self.hedge = HedgePolicy(
+            enabled=settings.UPSTREAM_HEDGE_ENABLED,
+            percentile=settings.UPSTREAM_HEDGE_PERCENTILE,
+            min_samples=settings.UPSTREAM_HEDGE_MIN_SAMPLES,
+            min_delay=settings.UPSTREAM_HEDGE_MIN_DELAY,
+        )
+        self.threads: Optional[ThreadStore] = None
+        if settings.THREAD_FOLLOWUP_ENABLED:
+            self.threads = ThreadStore(max_entries=settings.THREAD_STORE_MAX_ENTRIES, ttl=settings.THREAD_TTL_SECONDS)
+        # 请求体的固定部分只编码一次：普通提问 / 追问各一个模板
+        slot = JsonTemplate.slot
+        followup_slots = ThreadState({field: slot(field) for field in FOLLOWUP_FIELDS}, "", 0)
+        self._payload_templates = {
+            False: JsonTemplate(self._build_payload(slot("query_str"), slot("model_preference"), None,
+                                                    frontend_uuid=slot("frontend_uuid"))),
+            True: JsonTemplate(self._build_payload(slot("query_str"), slot("model_preference"), followup_slots,
+                                                   frontend_uuid=slot("frontend_uuid"))),
+        }
+
+    async def startup(self):
+        await self.http.start()
+        if self.cache is not None:
+            await asyncio.to_thread(self.cache.load)
+
+    async def shutdown(self):
+        await self.http.close()
+        await self.pool.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "upstream": self.http.stats(),
+            "browser": browser_manager.stats(),
+            "sessions": self.pool.stats(),
+            "cache": self.cache.stats() if self.cache is not None else None,
+            "coalescer": self.coalescer.stats() if self.coalescer is not None else None,
+            "prompt_packer": self.packer.stats(),
+            "threads": self.threads.stats() if self.threads is not None else None,
+            "breakers": {
+                "upstream": self.breaker.stats(),
+                "refresh": self.pool.refresh_breaker.stats(),
+            },
+        }
+
+    async def chat_completion(self, request_data: Dict[str, Any],
+                              request: Optional[Request] = None) -> Union[StreamingResponse, JSONResponse]:
+        request_id, model, query, turn = self._prepare(request_data, self._thread_scope(request))
+
+        # 只有显式 stream=false 才走非流式，未指定时保持原有的 SSE 行为
+        if request_data.get("stream") is False:
+            return JSONResponse(content=await self._complete(request_id, model, query, turn, request))
+        return StreamingResponse(self._stream_chunks(request_id, model, query, turn, request),
+                                 media_type="text/event-stream")
+
+    async def complete(self, request_data: Dict[str, Any]) -> Dict[str, Any]:
+        """非流式补全，直接返回 chat.completion 字典（批处理使用，各行相互独立，不走 thread 追问）；失败时抛出 HTTPException"""
+        request_id, model, query, turn = self._prepare(request_data)
+        return await self._complete(request_id, model, query, turn)
 
-    async def chat_completion(self, request_data: Dict[str, Any]) -> StreamingResponse:
+    @staticmethod
+    def _thread_scope(request: Optional[Request]) -> Optional[str]:
+        """thread 追问的作用域：按调用方的 API Key 隔离；没有 HTTP 请求（批处理）时返回 None，不追问"""
+        if request is None:
+            return None
+        auth = request.headers.get("authorization", "")
+        return hashlib.sha256(auth.encode("utf-8")).hexdigest()[:16]
+
+    def _prepare(self, request_data: Dict[str, Any], scope: Optional[str] = None):
+        """校验请求并拼出 query，返回 (request_id, model, query, turn)"""
         messages = request_data.get("messages", [])
         if not messages:
             raise HTTPException(status_code=400, detail="Messages cannot be empty")
         
-        last_msg = next((m for m in reversed(messages) if m["role"] == "user"), None)
-        if not last_msg:
+        # system / assistant 轮次按预算拼进 query，超出时丢弃最旧的轮次
+        conversation_key = PromptPacker.conversation_key(request_data)
+        query = self.packer.pack(messages, conversation_key)
+        if query is None:
             raise HTTPException(status_code=400, detail="No user message found")
         
-        query = last_msg["content"]
         model = request_data.get("model", settings.DEFAULT_MODEL)
         request_id = f"req-{uuid.uuid4().hex[:8]}"
+        turn = self._thread_turn(request_data, messages, scope)
+        return request_id, model, query, turn
+
+    def _thread_turn(self, request_data: Dict[str, Any], messages: List[Dict[str, Any]],
+                     scope: Optional[str]) -> Optional[ThreadTurn]:
+        """
+        本次请求在会话中的位置。只有客户端显式给出 conversation_id 时才参与追问，key 按 API Key 隔离；
+        之前的完整历史（含 assistant 轮次）与已记录的 thread 完全一致时作为追问发送，
+        客户端改写 / 重新生成了历史时退回完整上下文的新请求。
+        """
+        conversation_id = request_data.get("conversation_id")
+        if self.threads is None or scope is None or not conversation_id:
+            return None
+        user_indexes = [i for i, m in enumerate(messages) if m.get("role") == "user"]
+        last = user_indexes[-1]
+        turns = len(user_indexes) - 1
+        question = content_text(messages[last].get("content"))
+        key = f"{scope}:{conversation_id}"
+        digest = history_digest(messages[:last])
+        thread = self.threads.get(key, digest.hexdigest()) if turns > 0 else None
+        if thread is not None and thread.turns != turns:
+            thread = None
+        for message in messages[last:]:
+            add_to_digest(digest, message.get("role", ""), content_text(message.get("content")))
+        return ThreadTurn(key, turns, question, thread, digest)
 
-        await self.solver.refresh_context()
+    def _encode_payload(self, query: str, model: str, thread: Optional[ThreadState] = None) -> bytes:
+        """按预编码模板生成请求体字节，与 _build_payload 的 JSON 内容一致"""
+        if thread is None:
+            return self._payload_templates[False].render(
+                query_str=query, model_preference=model, frontend_uuid=str(uuid.uuid4()))
+        return self._payload_templates[True].render(
+            query_str=query, model_preference=model, frontend_uuid=str(uuid.uuid4()),
+            **{field: getattr(thread, field) for field in FOLLOWUP_FIELDS})
 
+    def _build_payload(self, query: str, model: str, thread: Optional[ThreadState] = None,
+                       frontend_uuid: Optional[str] = None) -> Dict[str, Any]:
         payload = {
             "params": {
                 "attachments": [],
-                "language": "zh-CN",
+                **SEARCH_OPTIONS,
                 "timezone": "Asia/Shanghai",
-                "search_focus": "internet",
-                "sources": ["edgar", "social", "web", "scholar"],
-                "frontend_uuid": str(uuid.uuid4()),
-                "mode": "copilot",
+                "frontend_uuid": frontend_uuid or str(uuid.uuid4()),
                 "model_preference": model,
                 "is_related_query": False,
                 "is_sponsored": False,
@@ -72,155 +343,346 @@ class PerplexityProvider(BaseProvider):
             },
             "query_str": query
         }
+        if thread is not None:
+            # 在已有 thread 上追问：上游沿用之前的上下文与搜索结果
+            payload["params"].update({
+                "is_related_query": True,
+                "query_source": "followup",
+                "last_backend_uuid": thread.backend_uuid,
+                "read_write_token": thread.read_write_token,
+                "frontend_context_uuid": thread.frontend_context_uuid,
+            })
+        return payload
+
+    async def _iter_deltas(self, request_id: str, model: str, query: str,
+                           turn: Optional[ThreadTurn] = None) -> AsyncGenerator[str, None]:
+        """
+        请求上游并逐个产出增量文本（纯 str，不构造 chunk）。
+        流式与非流式共用；重试用尽后抛出 UpstreamError。
+        还没有产出任何增量时失败：换会话（或等待刷新）后按退避重试，对客户端透明；
+        已经产出增量后失败：不再重试（无法接续同一份回答），抛出 UpstreamInterrupted。
+        带 turn 时，完整结束后记录上游 thread 标识，供下一轮追问使用。
+        """
+        tried: List[str] = []
+        emitted = False
+        max_attempts = max(settings.UPSTREAM_MAX_ATTEMPTS, 1)
+        for attempt_no in range(max_attempts):
+            try:
+                attempt = await self._open_attempt(request_id, model, query, turn, tried)
+                try:
+                    async for delta_text in self._decode(attempt, turn):
+                        emitted = True
+                        yield delta_text
+                finally:
+                    await attempt.close()
+                return
+            except (UpstreamError, httpx.TransportError) as e:
+                if emitted:
+                    metrics.MIDSTREAM_FAILURES.inc()
+                    logger.error("[{}] 上游在输出过程中中断: {!r}", request_id, e)
+                    raise UpstreamInterrupted(str(e) or type(e).__name__) from e
+                if attempt_no + 1 >= max_attempts or not is_retryable(e):
+                    raise
+                if getattr(e, "status_code", None) == 429 and not self.pool.has_available(exclude=tried):
+                    # 没有别的账号可换：acquire 只会拿回同一个冷却中的账号，重试只会把冷却越推越长
+                    raise
+                await self._before_retry(request_id, e, tried, attempt_no)
+
+    async def _before_retry(self, request_id: str, error: BaseException, tried: List[str], attempt_no: int):
+        status_code = getattr(error, "status_code", None)
+        if status_code == 403 and tried and not self.pool.has_available(exclude=tried):
+            # 没有别的账号可换：等该账号刷新完成（release 时已在后台触发）再重试；
+            # 刷新失败时用同一份 Cookie 重试只会再拿 403，并把冷却越推越长，直接放弃
+            failed = self.pool.get(tried[-1])
+            if failed is None or not await failed.service.refresh_context(force=True, wait=True):
+                raise error
+        metrics.UPSTREAM_RETRIES.inc(reason=str(status_code) if status_code else type(error).__name__)
+        delay = backoff_delay(attempt_no, settings.UPSTREAM_RETRY_BACKOFF, settings.UPSTREAM_RETRY_BACKOFF_MAX)
+        logger.warning("🔁 [{}] 上游失败 ({})，{:.2f}s 后重试 ({}/{})", request_id, status_code or type(error).__name__,
+                       delay, attempt_no + 1, settings.UPSTREAM_MAX_ATTEMPTS - 1)
+        await asyncio.sleep(delay)
+
+    async def _open_attempt(self, request_id: str, model: str, query: str,
+                            turn: Optional[ThreadTurn], tried: List[str]) -> "_UpstreamAttempt":
+        """
+        打开一个上游请求并等到首个数据分片。首字节迟迟不到（超过近期 TTFB 分位数）时
+        再发一个对冲请求，先收到首字节的胜出，另一个立即取消并归还会话。
+        追问不对冲：两个请求会在同一 thread 中各自追加一条记录。
+        """
+        primary = _UpstreamAttempt(self, request_id, model, query, turn, tried)
+        delay = None if (turn is not None and turn.thread is not None) else self.hedge.threshold()
+        if delay is None:
+            await primary.open()
+            return primary
+
+        first = asyncio.create_task(primary.open())
+        done, _ = await asyncio.wait({first}, timeout=delay)
+        if done:
+            first.result()
+            return primary
 
-        headers = self.solver.get_headers()
-        headers["x-request-id"] = request_id
-        cookies = self.solver.get_cookies()
+        hedge = _UpstreamAttempt(self, request_id, model, query, turn, tried)
+        tasks = {first: primary, asyncio.create_task(hedge.open()): hedge}
+        metrics.UPSTREAM_HEDGES.inc(outcome="started")
+        logger.info("🪁 [{}] 首字节超过 {:.2f}s，发起对冲请求", request_id, delay)
+        winner = None
+        error: Optional[BaseException] = None
+        try:
+            pending = set(tasks)
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        winner = winner or tasks[task]
+                    else:
+                        error = error or task.exception()
+        finally:
+            # 输掉的、被取消的请求都要关闭，把会话还回池中
+            for task, attempt in tasks.items():
+                if attempt is not winner:
+                    task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for attempt in tasks.values():
+                if attempt is not winner:
+                    await attempt.close()
+        if winner is None:
+            raise error
+        metrics.UPSTREAM_HEDGES.inc(outcome="hedge_won" if winner is hedge else "primary_won")
+        return winner
 
-        logger.info(f"=== 发送请求 [{request_id}] ===")
+    async def _decode(self, attempt: "_UpstreamAttempt", turn: Optional[ThreadTurn]) -> AsyncGenerator[str, None]:
+        decoder = AnswerStreamDecoder()
+        first_delta = True
+        thread_ids = None
+        answer: List[str] = []
 
-        async def stream_generator() -> AsyncGenerator[bytes, None]:
-            client = httpx.AsyncClient(timeout=300, http2=True)
+        async for event in attempt.events():
+            # end_of_stream 只是结束标记（data 为 {}），不含回答内容
+            if event.event == "end_of_stream" or not event.data or event.data == b"[DONE]":
+                continue
+
+            parse_start = time.perf_counter()
             try:
-                async with client.stream(
-                    "POST", 
-                    settings.API_URL, 
-                    json=payload, 
-                    headers=headers, 
-                    cookies=cookies
-                ) as response:
-                    
-                    if response.status_code != 200:
-                        error_text = await response.aread()
-                        logger.error(f"上游错误 {response.status_code}: {error_text.decode('utf-8', errors='ignore')}")
-                        if response.status_code == 403:
-                            await self.solver.refresh_context(force=True)
-                        yield create_sse_data(create_chat_completion_chunk(request_id, model, f"[Error: Upstream {response.status_code}]", "stop"))
-                        yield DONE_CHUNK
-                        return
-
-                    last_full_text = ""
-                    has_content = False
-                    
-                    async for line in response.aiter_lines():
-                        line_str = line.strip()
-                        if not line_str or not line_str.startswith("data: "): 
-                            continue
-                        
-                        json_str = line_str[6:].strip()
-                        if json_str == "[DONE]": continue
-                        
-                        try:
-                            data = json.loads(json_str)
-                            
-                            # --- 核心解析逻辑 ---
-                            current_full_text = ""
-
-                            # 1. 尝试从 answer 字段获取 (可能是嵌套 JSON)
-                            if "answer" in data:
-                                raw_answer = data["answer"]
-                                try:
-                                    # 检查是否是 JSON 数组字符串 (如你日志所示)
-                                    if isinstance(raw_answer, str) and raw_answer.strip().startswith("["):
-                                        steps = json.loads(raw_answer)
-                                        for step in steps:
-                                            step_type = step.get("step_type")
-                                            content = step.get("content", {})
-                                            
-                                            if step_type == "SEARCH_WEB":
-                                                queries = content.get("queries", [])
-                                                q_str = ", ".join([q["query"] for q in queries])
-                                                current_full_text += f"> 🔍 正在搜索: {q_str}\n\n"
-                                            
-                                            elif step_type == "SEARCH_RESULTS":
-                                                results = content.get("web_results", [])
-                                                if results:
-                                                    current_full_text += f"> 📚 找到 {len(results)} 个来源\n\n"
-
-                                            elif step_type == "FINAL":
-                                                # FINAL 里的 answer 可能又是 JSON 字符串
-                                                final_answer_raw = content.get("answer")
-                                                if isinstance(final_answer_raw, str):
-                                                    try:
-                                                        final_obj = json.loads(final_answer_raw)
-                                                        if "answer" in final_obj:
-                                                            current_full_text += final_obj["answer"]
-                                                    except:
-                                                        current_full_text += final_answer_raw
-                                                else:
-                                                    current_full_text += str(final_answer_raw)
-
-                                    # 检查是否是普通 JSON 对象字符串
-                                    elif isinstance(raw_answer, str) and raw_answer.strip().startswith("{"):
-                                        inner_data = json.loads(raw_answer)
-                                        if "answer" in inner_data:
-                                            current_full_text = inner_data["answer"]
-                                    else:
-                                        current_full_text = raw_answer
-                                except Exception as e:
-                                    # 解析失败，回退到原始值
-                                    current_full_text = raw_answer
-
-                            # 2. 尝试从 text 字段获取 (逻辑同上)
-                            elif "text" in data:
-                                raw_text = data["text"]
-                                try:
-                                    if isinstance(raw_text, str) and raw_text.strip().startswith("["):
-                                        # 处理数组情况 (同上)
-                                        steps = json.loads(raw_text)
-                                        for step in steps:
-                                            step_type = step.get("step_type")
-                                            content = step.get("content", {})
-                                            if step_type == "FINAL":
-                                                final_answer_raw = content.get("answer")
-                                                if isinstance(final_answer_raw, str):
-                                                    try:
-                                                        final_obj = json.loads(final_answer_raw)
-                                                        if "answer" in final_obj:
-                                                            current_full_text += final_obj["answer"]
-                                                    except:
-                                                        current_full_text += final_answer_raw
-                                    elif isinstance(raw_text, str) and raw_text.strip().startswith("{"):
-                                        inner_data = json.loads(raw_text)
-                                        if "answer" in inner_data:
-                                            current_full_text = inner_data["answer"]
-                                        elif "chunks" in inner_data:
-                                            current_full_text = "".join(inner_data["chunks"])
-                                    else:
-                                        current_full_text = raw_text
-                                except:
-                                    current_full_text = raw_text
-
-                            # --- 增量发送 ---
-                            if current_full_text:
-                                # 只有当新文本比旧文本长时才发送增量
-                                # 注意：Perplexity 有时会重写前面的文本，这里简化处理，只追加
-                                if len(current_full_text) > len(last_full_text):
-                                    delta_text = current_full_text[len(last_full_text):]
-                                    last_full_text = current_full_text
-                                    has_content = True
-                                    
-                                    chunk = create_chat_completion_chunk(request_id, model, delta_text)
-                                    yield create_sse_data(chunk)
-
-                        except Exception as e:
-                            logger.warning(f"解析失败: {e}")
-                            pass
-                    
-                    if not has_content:
-                        yield create_sse_data(create_chat_completion_chunk(request_id, model, "[Warning: No content returned]", "stop"))
-
-                    yield create_sse_data(create_chat_completion_chunk(request_id, model, "", "stop"))
-                    yield DONE_CHUNK
+                data = json.loads(event.data)
+                failed = event.event == "error" or data.get("status") == "FAILED"
+                if not failed:
+                    if thread_ids is None:
+                        thread_ids = ThreadStore.capture(data)
+                    # 增量解码：只返回本事件新增的文本
+                    delta_text = decoder.feed(data)
+            except Exception as e:
+                metrics.PARSE_FAILURES.inc()
+                logger.warning("解析失败: {}", e)
+                continue
+            finally:
+                metrics.PARSE_TIME.observe(time.perf_counter() - parse_start)
+
+            if failed:
+                # 上游在流中报错：还没输出时由 _iter_deltas 重试，已输出时按 UPSTREAM_MIDSTREAM_POLICY 结束
+                code = (data.get("error_code") or "FAILED") if isinstance(data, dict) else "FAILED"
+                raise UpstreamError(502, f"Upstream failed mid-stream: {code}")
+
+            if delta_text:
+                if first_delta:
+                    metrics.FIRST_DELTA.observe(time.perf_counter() - attempt.sent_at)
+                    first_delta = False
+                if turn is not None:
+                    answer.append(delta_text)
+                yield delta_text
+
+        if turn is not None and thread_ids is not None:
+            history = turn.next_history("".join(answer))
+            self.threads.put(turn.key, ThreadState(thread_ids, attempt.session_name, turn.turns + 1, history))
+
+    def _request_key(self, query: str, model: str, turn: Optional[ThreadTurn] = None) -> str:
+        # 追问的回答取决于所在 thread，key 中带上 thread 标识
+        if turn is not None and turn.thread is not None:
+            options = {**SEARCH_OPTIONS, "thread": turn.thread.backend_uuid}
+            return ResponseCache.make_key(turn.question, model, options)
+        return ResponseCache.make_key(query, model, SEARCH_OPTIONS)
 
+    async def _iter_answer(self, request_id: str, model: str, query: str,
+                           turn: Optional[ThreadTurn] = None) -> AsyncGenerator[str, None]:
+        """
+        回答来源依次为：回答缓存 -> 合并到同 key 的进行中请求 -> 新的上游请求。
+        上游熔断期间不再排队等待必然失败的请求：有过期缓存就回放，否则抛出 CircuitOpenError。
+        """
+        key = self._request_key(query, model, turn)
+        if self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                logger.info("⚡ [{}] 命中回答缓存", request_id)
+                for delta_text in cached:
+                    yield delta_text
+                return
+
+        if not self.breaker.allows():
+            stale = self.cache.get_stale(key) if self.cache is not None else None
+            if stale is None:
+                self.breaker.before_call()  # 熔断中，必然抛出 CircuitOpenError
+            logger.warning("🧯 [{}] 上游熔断中，回放过期缓存", request_id)
+            for delta_text in stale:
+                yield delta_text
+            return
+
+        def source_factory():
+            return self._iter_and_cache(key, request_id, model, query, turn)
+
+        source = self.coalescer.subscribe(key, source_factory) if self.coalescer is not None else source_factory()
+        async for delta_text in source:
+            yield delta_text
+
+    async def _iter_and_cache(self, key: str, request_id: str, model: str, query: str,
+                              turn: Optional[ThreadTurn] = None) -> AsyncGenerator[str, None]:
+        """
+        请求上游；只有上游流正常结束（没有 status=FAILED / error 事件、没有被中断）且有内容时才写入缓存。
+        上游报错、传输中断、客户端断开都会以异常离开循环，不会走到写入。
+        """
+        parts: List[str] = []
+        clean = False
+        async for delta_text in self._iter_deltas(request_id, model, query, turn):
+            if self.cache is not None:
+                parts.append(delta_text)
+            yield delta_text
+        else:
+            clean = True
+        if clean and parts:
+            self.cache.put(key, parts)
+
+    async def _buffered(self, request_id: str, source: AsyncGenerator[str, None],
+                        request: Optional[Request]) -> AsyncGenerator[str, None]:
+        """
+        上游读取与客户端写出之间的有界缓冲：
+        - 读取任务把增量放进容量为 STREAM_BUFFER_SIZE 的队列，队列满时暂停读取上游（背压）；
+        - 队列持续写满超过 STREAM_STALL_TIMEOUT（客户端不读）时放弃，上游连接随即关闭、会话归还；
+        - 每隔 STREAM_DISCONNECT_CHECK_INTERVAL 检查一次客户端是否已断开，断开则取消上游。
+        两种情况都抛出 ClientGone。
+        """
+        queue: asyncio.Queue = asyncio.Queue(maxsize=max(settings.STREAM_BUFFER_SIZE, 1))
+        state: Dict[str, Any] = {"error": None, "stalled": False}
+
+        async def pump():
+            try:
+                async for delta_text in source:
+                    try:
+                        await asyncio.wait_for(queue.put(delta_text), settings.STREAM_STALL_TIMEOUT)
+                    except asyncio.TimeoutError:
+                        state["stalled"] = True
+                        metrics.STREAMS_CANCELLED.inc(reason="stall")
+                        logger.warning("🐢 [{}] 客户端 {}s 未读取，取消上游", request_id, settings.STREAM_STALL_TIMEOUT)
+                        break
             except Exception as e:
-                logger.error(f"流式请求异常: {e}")
-                yield create_sse_data(create_chat_completion_chunk(request_id, model, f"[Error: {str(e)}]", "stop"))
-                yield DONE_CHUNK
+                state["error"] = e
             finally:
-                await client.aclose()
+                await source.aclose()
+            await queue.put(_END)
+
+        task = asyncio.create_task(pump())
+        interval = settings.STREAM_DISCONNECT_CHECK_INTERVAL
+        next_check = time.monotonic() + interval
+        try:
+            while True:
+                if not queue.empty():
+                    item = queue.get_nowait()
+                else:
+                    try:
+                        item = await asyncio.wait_for(queue.get(), interval)
+                    except asyncio.TimeoutError:
+                        item = None
+                if request is not None and time.monotonic() >= next_check:
+                    next_check = time.monotonic() + interval
+                    if await request.is_disconnected():
+                        metrics.STREAMS_CANCELLED.inc(reason="disconnect")
+                        logger.info("🔌 [{}] 客户端已断开，取消上游", request_id)
+                        raise ClientGone("disconnected")
+                if item is None:
+                    continue
+                if item is _END:
+                    break
+                yield item
+        except (GeneratorExit, asyncio.CancelledError):
+            # Starlette 监听到断开后直接取消了响应生成器
+            metrics.STREAMS_CANCELLED.inc(reason="disconnect")
+            raise
+        finally:
+            if not task.done():
+                task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        if state["error"] is not None:
+            raise state["error"]
+        if state["stalled"]:
+            raise ClientGone("stalled")
+
+    async def _stream_chunks(self, request_id: str, model: str, query: str,
+                             turn: Optional[ThreadTurn] = None,
+                             request: Optional[Request] = None) -> AsyncGenerator[bytes, None]:
+        encoder = ChunkEncoder(request_id, model)
+        has_content = False
+        metrics.ACTIVE_STREAMS.inc(model=_model_label(model))
+        try:
+            async for delta_text in self._buffered(request_id, self._iter_answer(request_id, model, query, turn), request):
+                has_content = True
+                yield encoder.encode(delta_text)
+
+            if not has_content:
+                yield encoder.encode("[Warning: No content returned]", "stop")
+
+            yield encoder.encode("", "stop")
+            yield DONE_CHUNK
+
+        except ClientGone:
+            return
+        except UpstreamError as e:
+            yield encoder.encode(f"[Error: Upstream {e.status_code}]", "stop")
+            yield DONE_CHUNK
+        except CircuitOpenError as e:
+            yield encoder.encode(f"[Error: Upstream unavailable, retry in {math.ceil(e.retry_after)}s]", "stop")
+            yield DONE_CHUNK
+        except UpstreamInterrupted as e:
+            if settings.UPSTREAM_MIDSTREAM_POLICY == "truncate":
+                yield encoder.encode("", "length")
+            else:
+                yield encoder.encode(f"\n\n[Error: Upstream interrupted: {e}]", "stop")
+            yield DONE_CHUNK
+        except Exception as e:
+            logger.error("流式请求异常: {}", e)
+            yield encoder.encode(f"[Error: {str(e)}]", "stop")
+            yield DONE_CHUNK
+        finally:
+            metrics.ACTIVE_STREAMS.dec(model=_model_label(model))
+
+    async def _complete(self, request_id: str, model: str, query: str,
+                        turn: Optional[ThreadTurn] = None, request: Optional[Request] = None) -> Dict[str, Any]:
+        """非流式：在服务端消费完整个上游流，一次性返回 chat.completion"""
+        parts: List[str] = []
+        finish_reason = "stop"
+        metrics.ACTIVE_STREAMS.inc(model=_model_label(model))
+        try:
+            async for delta_text in self._buffered(request_id, self._iter_answer(request_id, model, query, turn), request):
+                parts.append(delta_text)
+        except ClientGone as e:
+            raise HTTPException(status_code=499, detail=str(e))
+        except UpstreamError as e:
+            raise HTTPException(status_code=502, detail=f"Upstream {e.status_code}")
+        except CircuitOpenError as e:
+            raise HTTPException(status_code=503, detail="Upstream unavailable (circuit open)",
+                                headers={"Retry-After": str(math.ceil(e.retry_after))})
+        except UpstreamInterrupted as e:
+            if settings.UPSTREAM_MIDSTREAM_POLICY != "truncate":
+                raise HTTPException(status_code=502, detail=f"Upstream interrupted: {e}")
+            finish_reason = "length"
+        except HTTPException:
+            raise  # 如账号池的 503，保留原状态码（批处理据此等待重试）
+        except Exception as e:
+            logger.error("非流式请求异常: {}", e)
+            raise HTTPException(status_code=502, detail=str(e))
+        finally:
+            metrics.ACTIVE_STREAMS.dec(model=_model_label(model))
 
-        return StreamingResponse(stream_generator(), media_type="text/event-stream")
+        content = "".join(parts)
+        if not content:
+            logger.warning("[{}] 上游未返回内容", request_id)
+        return create_chat_completion(request_id, model, content, query, finish_reason)
 
     async def get_models(self) -> JSONResponse:
         return JSONResponse(content={
@@ -0,0 +1,200 @@
+import asyncio
+import math
+import time
+from collections import deque, defaultdict
+from typing import Any, Deque, Dict, Tuple
+from fastapi.responses import JSONResponse
+from loguru import logger
+
+from app.utils import metrics
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    准入控制：全局并发上限 + 每个 API Key 的并发上限。
+    超出上限的请求进入有界 FIFO 队列等待，队列满或等待超时直接拒绝（429）。
+    某个 Key 达到自己的上限时不会阻塞队列中其他 Key 的请求。
+    后台任务（批处理）走 acquire_background：优先级低于所有交互请求，且至少留出
+    background_headroom 个空闲槽位给交互请求。
+    """
+    def __init__(self, max_inflight: int, per_key_limit: int, max_queue: int, queue_timeout: float,
+                 background_headroom: int = 0):
+        self.max_inflight = max_inflight
+        self.per_key_limit = per_key_limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.background_headroom = background_headroom
+        self.active = 0
+        self.active_by_key: Dict[str, int] = defaultdict(int)
+        self._waiters: Deque[Tuple[str, asyncio.Future]] = deque()
+        self._background: Deque[Tuple[str, asyncio.Future]] = deque()
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+        self.waited = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    def _can_admit(self, key: str) -> bool:
+        if self.active >= self.max_inflight:
+            return False
+        return self.per_key_limit <= 0 or self.active_by_key.get(key, 0) < self.per_key_limit
+
+    def _can_admit_background(self) -> bool:
+        return self.active + self.background_headroom < self.max_inflight
+
+    def _admit(self, key: str):
+        self.active += 1
+        self.active_by_key[key] += 1
+        self.admitted += 1
+
+    def _wake(self):
+        """按 FIFO 顺序放行可以放行的等待者（跳过已达到 Key 上限的）；交互请求都放行后才轮到后台任务"""
+        if self._waiters:
+            remaining: Deque[Tuple[str, asyncio.Future]] = deque()
+            while self._waiters:
+                key, fut = self._waiters.popleft()
+                if fut.done():
+                    continue
+                if self._can_admit(key):
+                    self._admit(key)
+                    fut.set_result(None)
+                else:
+                    remaining.append((key, fut))
+            self._waiters = remaining
+        while self._background and not self._waiters and self._can_admit_background():
+            key, fut = self._background.popleft()
+            if not fut.done():
+                self._admit(key)
+                fut.set_result(None)
+
+    def _queued(self, key: str) -> bool:
+        return any(k == key and not fut.done() for k, fut in self._waiters)
+
+    def _discard(self, queue: Deque[Tuple[str, asyncio.Future]], key: str, fut: asyncio.Future):
+        """超时 / 取消的等待者立即出队，不再占用 max_queue 名额"""
+        try:
+            queue.remove((key, fut))
+        except ValueError:
+            pass
+
+    def _retry_after(self) -> int:
+        return max(1, math.ceil(self.queue_timeout))
+
+    async def acquire(self, key: str) -> float:
+        """获取一个执行槽位，返回排队耗时（秒）；无法获取时抛出 AdmissionRejected"""
+        # 只要有空闲槽位、且同一 Key 没有更早的等待者就直接放行：
+        # 队列里其他 Key 的请求可能只是卡在各自的 Key 上限上，不应挡住本请求
+        if self._can_admit(key) and not (self._waiters and self._queued(key)):
+            self._admit(key)
+            metrics.ADMISSION_WAIT.observe(0.0)
+            return 0.0
+
+        if len(self._waiters) >= self.max_queue:
+            self.rejected_queue_full += 1
+            raise AdmissionRejected("queue full", self._retry_after())
+
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append((key, fut))
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(fut, timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._discard(self._waiters, key, fut)
+            self.rejected_timeout += 1
+            raise AdmissionRejected("queue timeout", self._retry_after())
+        except asyncio.CancelledError:
+            self._discard(self._waiters, key, fut)
+            # 放行与取消同时发生：槽位已经记到我们头上，必须还回去
+            if fut.done() and not fut.cancelled():
+                self.release(key)
+            raise
+
+        waited = time.monotonic() - start
+        self.waited += 1
+        self.wait_time_total += waited
+        self.wait_time_max = max(self.wait_time_max, waited)
+        metrics.ADMISSION_WAIT.observe(waited)
+        return waited
+
+    async def acquire_background(self, key: str):
+        """获取一个低优先级槽位：不设超时，一直等到没有交互请求排队且有富余槽位"""
+        if not self._waiters and not self._background and self._can_admit_background():
+            self._admit(key)
+            return
+        fut = asyncio.get_running_loop().create_future()
+        self._background.append((key, fut))
+        try:
+            await fut
+        except asyncio.CancelledError:
+            self._discard(self._background, key, fut)
+            if fut.done() and not fut.cancelled():
+                self.release(key)
+            raise
+
+    def release(self, key: str):
+        self.active = max(self.active - 1, 0)
+        self.active_by_key[key] -= 1
+        if self.active_by_key[key] <= 0:
+            del self.active_by_key[key]
+        self._wake()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active": self.active,
+            "queue_depth": sum(1 for _, fut in self._waiters if not fut.done()),
+            "background_queue_depth": sum(1 for _, fut in self._background if not fut.done()),
+            "admitted": self.admitted,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_timeout": self.rejected_timeout,
+            "wait_time_avg": round(self.wait_time_total / self.waited, 4) if self.waited else 0.0,
+            "wait_time_max": round(self.wait_time_max, 4),
+        }
+
+
+class AdmissionMiddleware:
+    """
+    ASGI 中间件：对指定路径做准入控制。
+    槽位在整个 ASGI 调用结束后才释放，因此覆盖流式响应的完整生命周期。
+    """
+    def __init__(self, app, controller: AdmissionController, paths=("/v1/chat/completions",)):
+        self.app = app
+        self.controller = controller
+        self.paths = set(paths)
+
+    @staticmethod
+    def _client_key(scope) -> str:
+        for name, value in scope.get("headers", []):
+            if name == b"authorization":
+                return value.decode("latin-1").split(" ")[-1] or "anonymous"
+        return "anonymous"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        key = self._client_key(scope)
+        try:
+            await self.controller.acquire(key)
+        except AdmissionRejected as e:
+            logger.warning("🚦 请求被拒绝 ({})，当前并发 {}", e.reason, self.controller.active)
+            response = JSONResponse(
+                status_code=429,
+                content={"error": {"message": f"Server busy: {e.reason}", "type": "rate_limit_exceeded"}},
+                headers={"Retry-After": str(e.retry_after)},
+            )
+            await response(scope, receive, send)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(key)
@@ -0,0 +1,391 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Set, Tuple
+from fastapi import HTTPException
+from loguru import logger
+
+from app.core.config import settings
+from app.services.admission import AdmissionController
+from app.utils.atomic_file import atomic_write_text
+from app.utils.json_utils import dumps_bytes
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+ACTIVE_STATUSES = ("validating", "in_progress", "finalizing", "cancelling")
+ADMISSION_KEY = "batch"  # 批处理共用一个准入 key
+
+
+class BatchValidationError(Exception):
+    def __init__(self, errors: List[Dict[str, Any]]):
+        super().__init__(f"{len(errors)} invalid line(s)")
+        self.errors = errors
+
+
+class BatchFiles:
+    """
+    批处理文件存储（OpenAI Files 接口的子集）：
+    files/{id}.jsonl 为内容，files/{id}.json 为元数据。
+    """
+    def __init__(self, root: str):
+        self.dir = os.path.join(root, "files")
+
+    def content_path(self, file_id: str) -> str:
+        return os.path.join(self.dir, f"{file_id}.jsonl")
+
+    def _meta_path(self, file_id: str) -> str:
+        return os.path.join(self.dir, f"{file_id}.json")
+
+    def create(self, filename: str, purpose: str, data: bytes = b"") -> Dict[str, Any]:
+        os.makedirs(self.dir, exist_ok=True)
+        meta = {
+            "id": f"file-{uuid.uuid4().hex[:24]}",
+            "object": "file",
+            "bytes": len(data),
+            "created_at": int(time.time()),
+            "filename": filename,
+            "purpose": purpose,
+        }
+        with open(self.content_path(meta["id"]), "wb") as f:
+            f.write(data)
+        atomic_write_text(self._meta_path(meta["id"]), json.dumps(meta, ensure_ascii=False))
+        return meta
+
+    def get(self, file_id: str) -> Optional[Dict[str, Any]]:
+        if not file_id.startswith("file-") or os.sep in file_id:
+            return None
+        try:
+            with open(self._meta_path(file_id), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            return None
+        # 输出文件在批处理进行中持续增长，大小以磁盘为准
+        meta["bytes"] = os.path.getsize(self.content_path(file_id))
+        return meta
+
+
+class _BatchJob:
+    """一个运行中的批处理：状态字典 + 输出文件句柄"""
+    def __init__(self, state: Dict[str, Any]):
+        self.state = state
+        self.task: Optional[asyncio.Task] = None
+        self.lock = asyncio.Lock()
+        self.output = None
+        self.errors = None
+        self.saved_at = 0.0
+        self.expired = False  # 有请求因超出 completion_window 被记为 batch_expired
+
+
+class BatchRunner:
+    """
+    OpenAI 风格的批处理：上传 JSONL（每行 {"custom_id", "method", "url", "body"}），
+    后台以 BATCH_CONCURRENCY 的并发逐条执行非流式补全，结果逐行追加到输出 JSONL，
+    处理过程中即可轮询 / 下载已完成的部分。
+    - 每条请求通过 AdmissionController.acquire_background 获取槽位，优先级低于交互请求；
+    - 进度以输出文件为准：重启后跳过输出 / 错误文件中已有的 custom_id，从中断处继续；
+    - 上游熔断（503）时按 Retry-After 等待后重试该条，而不是把剩余请求全部记为失败。
+    """
+    def __init__(self, provider, admission: AdmissionController, root: str, concurrency: int):
+        self.provider = provider
+        self.admission = admission
+        self.root = root
+        self.files = BatchFiles(root)
+        self.batch_dir = os.path.join(root, "batches")
+        self.concurrency = max(concurrency, 1)
+        self._slots = asyncio.Semaphore(self.concurrency)  # 所有批处理共享的并发上限
+        self._jobs: Dict[str, _BatchJob] = {}
+
+    # --- 状态持久化 ---
+
+    def _state_path(self, batch_id: str) -> str:
+        return os.path.join(self.batch_dir, f"{batch_id}.json")
+
+    def _save(self, state: Dict[str, Any]):
+        os.makedirs(self.batch_dir, exist_ok=True)
+        atomic_write_text(self._state_path(state["id"]), json.dumps(state, ensure_ascii=False))
+
+    async def _persist(self, job: _BatchJob, force: bool = False):
+        # 进度以输出文件为准，计数最多每秒落盘一次
+        now = time.monotonic()
+        if force or now - job.saved_at >= 1.0:
+            job.saved_at = now
+            await asyncio.to_thread(self._save, dict(job.state))
+
+    def _load_all(self) -> List[Dict[str, Any]]:
+        if not os.path.isdir(self.batch_dir):
+            return []
+        states = []
+        for name in sorted(os.listdir(self.batch_dir)):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.batch_dir, name), "r", encoding="utf-8") as f:
+                    states.append(json.load(f))
+            except Exception as e:
+                logger.warning("跳过损坏的批处理状态 {}: {}", name, e)
+        return states
+
+    async def start(self):
+        """加载已有批处理，未完成的从中断处继续"""
+        for state in await asyncio.to_thread(self._load_all):
+            job = _BatchJob(state)
+            self._jobs[state["id"]] = job
+            if state["status"] == "cancelling":
+                self._finish(job, "cancelled")
+                await self._persist(job, force=True)
+            elif state["status"] in ACTIVE_STATUSES:
+                logger.info("📦 恢复批处理 {} ({}/{})", state["id"],
+                            state["request_counts"]["completed"] + state["request_counts"]["failed"],
+                            state["request_counts"]["total"])
+                job.task = asyncio.create_task(self._run(job))
+
+    async def close(self):
+        tasks = [job.task for job in self._jobs.values() if job.task is not None and not job.task.done()]
+        for task in tasks:
+            task.cancel()
+        # 状态保持为 in_progress，下次启动时继续
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    # --- 接口 ---
+
+    async def create(self, input_file_id: str, endpoint: str, completion_window: str,
+                     metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        if endpoint != BATCH_ENDPOINT:
+            raise HTTPException(status_code=400, detail=f"Only {BATCH_ENDPOINT} is supported")
+        if await asyncio.to_thread(self.files.get, input_file_id) is None:
+            raise HTTPException(status_code=404, detail=f"File {input_file_id} not found")
+        batch_id = f"batch_{uuid.uuid4().hex[:24]}"
+        output = await asyncio.to_thread(self.files.create, f"{batch_id}_output.jsonl", "batch_output")
+        errors = await asyncio.to_thread(self.files.create, f"{batch_id}_errors.jsonl", "batch_output")
+        now = int(time.time())
+        state = {
+            "id": batch_id,
+            "object": "batch",
+            "endpoint": endpoint,
+            "errors": None,
+            "input_file_id": input_file_id,
+            "completion_window": completion_window,
+            "status": "validating",
+            "output_file_id": output["id"],
+            "error_file_id": errors["id"],
+            "created_at": now,
+            "in_progress_at": None,
+            "expires_at": now + self._window_seconds(completion_window),
+            "finalizing_at": None,
+            "completed_at": None,
+            "failed_at": None,
+            "expired_at": None,
+            "cancelling_at": None,
+            "cancelled_at": None,
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+            "metadata": metadata,
+        }
+        job = _BatchJob(state)
+        self._jobs[batch_id] = job
+        await self._persist(job, force=True)
+        job.task = asyncio.create_task(self._run(job))
+        logger.info("📦 创建批处理 {} (输入 {})", batch_id, input_file_id)
+        return dict(state)
+
+    def get(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        job = self._jobs.get(batch_id)
+        return dict(job.state) if job is not None else None
+
+    def list(self, limit: int = 20) -> List[Dict[str, Any]]:
+        states = sorted((job.state for job in self._jobs.values()), key=lambda s: s["created_at"], reverse=True)
+        return [dict(s) for s in states[:limit]]
+
+    async def cancel(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        job = self._jobs.get(batch_id)
+        if job is None:
+            return None
+        if job.state["status"] in ACTIVE_STATUSES:
+            job.state["status"] = "cancelling"
+            job.state["cancelling_at"] = int(time.time())
+            await self._persist(job, force=True)
+            if job.task is not None:
+                job.task.cancel()
+        return dict(job.state)
+
+    def stats(self) -> Dict[str, Any]:
+        by_status: Dict[str, int] = {}
+        for job in self._jobs.values():
+            by_status[job.state["status"]] = by_status.get(job.state["status"], 0) + 1
+        return {"batches": by_status, "concurrency": self.concurrency}
+
+    # --- 执行 ---
+
+    @staticmethod
+    def _window_seconds(window: str) -> int:
+        try:
+            return int(window[:-1]) * {"h": 3600, "d": 86400}[window[-1]]
+        except (KeyError, ValueError, IndexError):
+            return 86400
+
+    def _read_input(self, input_file_id: str) -> List[Dict[str, Any]]:
+        items, errors, seen = [], [], set()
+        with open(self.files.content_path(input_file_id), "r", encoding="utf-8") as f:
+            for line_no, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    item = json.loads(line)
+                except json.JSONDecodeError as e:
+                    errors.append({"code": "invalid_json", "message": str(e), "line": line_no})
+                    continue
+                custom_id = item.get("custom_id") if isinstance(item, dict) else None
+                body = item.get("body") if isinstance(item, dict) else None
+                if not custom_id:
+                    errors.append({"code": "missing_custom_id", "message": "custom_id is required", "line": line_no})
+                elif custom_id in seen:
+                    errors.append({"code": "duplicate_custom_id", "message": custom_id, "line": line_no})
+                elif item.get("url", BATCH_ENDPOINT) != BATCH_ENDPOINT or item.get("method", "POST") != "POST":
+                    errors.append({"code": "invalid_url", "message": f"Only POST {BATCH_ENDPOINT}", "line": line_no})
+                elif not isinstance(body, dict) or not body.get("messages"):
+                    errors.append({"code": "invalid_body", "message": "body.messages is required", "line": line_no})
+                else:
+                    seen.add(custom_id)
+                    items.append(item)
+                if len(items) > settings.BATCH_MAX_REQUESTS:
+                    errors.append({"code": "too_many_requests", "message": f"limit {settings.BATCH_MAX_REQUESTS}",
+                                   "line": line_no})
+                    break
+        if errors:
+            raise BatchValidationError(errors[:100])
+        return items
+
+    def _finished_ids(self, job: _BatchJob) -> Tuple[Set[str], int, int]:
+        """从输出 / 错误文件恢复已完成的 custom_id；截掉崩溃时写了一半的最后一行"""
+        done: Set[str] = set()
+        counts = []
+        for file_id in (job.state["output_file_id"], job.state["error_file_id"]):
+            path = self.files.content_path(file_id)
+            with open(path, "rb+") as f:
+                data = f.read()
+                complete = data.rfind(b"\n") + 1
+                if complete < len(data):
+                    f.truncate(complete)
+            n = 0
+            for line in data[:complete].splitlines():
+                try:
+                    done.add(json.loads(line)["custom_id"])
+                    n += 1
+                except Exception:
+                    continue
+            counts.append(n)
+        return done, counts[0], counts[1]
+
+    async def _run(self, job: _BatchJob):
+        state = job.state
+        try:
+            try:
+                items = await asyncio.to_thread(self._read_input, state["input_file_id"])
+            except BatchValidationError as e:
+                state["errors"] = {"object": "list", "data": e.errors}
+                self._finish(job, "failed")
+                logger.warning("📦 批处理 {} 校验失败: {}", state["id"], e)
+                return
+            done, completed, failed = await asyncio.to_thread(self._finished_ids, job)
+            state["request_counts"] = {"total": len(items), "completed": completed, "failed": failed}
+            if state["status"] == "validating":
+                state["status"] = "in_progress"
+                state["in_progress_at"] = int(time.time())
+            await self._persist(job, force=True)
+
+            job.output = open(self.files.content_path(state["output_file_id"]), "ab")
+            job.errors = open(self.files.content_path(state["error_file_id"]), "ab")
+            pending = iter([item for item in items if item["custom_id"] not in done])
+            workers = [asyncio.create_task(self._worker(job, pending)) for _ in range(self.concurrency)]
+            try:
+                await asyncio.gather(*workers)
+            finally:
+                for w in workers:
+                    w.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+
+            if job.expired or (time.time() > state["expires_at"] and self._remaining(state)):
+                self._finish(job, "expired")
+            else:
+                state["status"] = "finalizing"
+                state["finalizing_at"] = int(time.time())
+                self._finish(job, "completed")
+            counts = state["request_counts"]
+            logger.info("📦 批处理 {} {}: 成功 {} / 失败 {} / 共 {}", state["id"], state["status"],
+                        counts["completed"], counts["failed"], counts["total"])
+        except asyncio.CancelledError:
+            if state["status"] == "cancelling":
+                self._finish(job, "cancelled")
+                logger.info("📦 批处理 {} 已取消", state["id"])
+            raise
+        except Exception as e:
+            logger.error("📦 批处理 {} 异常: {}", state["id"], e)
+            state["errors"] = {"object": "list", "data": [{"code": "internal_error", "message": str(e)}]}
+            self._finish(job, "failed")
+        finally:
+            for f in (job.output, job.errors):
+                if f is not None:
+                    f.close()
+            job.output = job.errors = None
+            await asyncio.shield(self._persist(job, force=True))
+
+    @staticmethod
+    def _remaining(state: Dict[str, Any]) -> int:
+        counts = state["request_counts"]
+        return counts["total"] - counts["completed"] - counts["failed"]
+
+    @staticmethod
+    def _finish(job: _BatchJob, status: str):
+        job.state["status"] = status
+        job.state[f"{status}_at"] = int(time.time())
+
+    async def _worker(self, job: _BatchJob, pending):
+        for item in pending:
+            if time.time() > job.state["expires_at"]:
+                return
+            async with self._slots:
+                status_code, body = await self._execute(job, item)
+            await self._record(job, item, status_code, body)
+
+    async def _execute(self, job: _BatchJob, item: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        request_data = {**item["body"], "stream": False}
+        while True:
+            await self.admission.acquire_background(ADMISSION_KEY)
+            try:
+                return 200, await self.provider.complete(request_data)
+            except HTTPException as e:
+                if e.status_code != 503:
+                    return e.status_code, {"error": {"message": str(e.detail), "type": "upstream_error"}}
+                retry_after = float((e.headers or {}).get("Retry-After", 5))
+            except Exception as e:
+                return 500, {"error": {"message": str(e), "type": "internal_error"}}
+            finally:
+                self.admission.release(ADMISSION_KEY)
+            # 上游暂时不可用（熔断 / 没有可用会话）：在 completion_window 内等待后重试这一条
+            if time.time() + retry_after > job.state["expires_at"]:
+                job.expired = True
+                return 503, {"error": {"message": "Batch completion window expired while upstream was unavailable",
+                                       "type": "upstream_error", "code": "batch_expired"}}
+            logger.warning("📦 批处理 {} 上游不可用，{:.0f}s 后重试 {}", job.state["id"], retry_after, item["custom_id"])
+            await asyncio.sleep(retry_after)
+
+    async def _record(self, job: _BatchJob, item: Dict[str, Any], status_code: int, body: Dict[str, Any]):
+        ok = status_code == 200
+        line = {
+            "id": f"batch_req_{uuid.uuid4().hex[:24]}",
+            "custom_id": item["custom_id"],
+            "response": {"status_code": status_code, "request_id": body.get("id", ""), "body": body},
+            "error": None if ok else {"code": body["error"].get("code") or str(status_code),
+                                      "message": body["error"]["message"]},
+        }
+        data = dumps_bytes(line) + b"\n"
+        async with job.lock:
+            target = job.output if ok else job.errors
+            await asyncio.to_thread(self._append, target, data)
+            job.state["request_counts"]["completed" if ok else "failed"] += 1
+        await self._persist(job)
+
+    @staticmethod
+    def _append(f, data: bytes):
+        f.write(data)
+        f.flush()
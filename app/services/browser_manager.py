@@ -0,0 +1,168 @@
+import logging
+import asyncio
+from typing import TYPE_CHECKING, Dict, Any, Optional
+from app.core.config import settings
+
+if TYPE_CHECKING:
+    from playwright.async_api import Playwright, Browser, BrowserContext, Page
+
+logger = logging.getLogger(__name__)
+
+LAUNCH_ARGS = [
+    "--no-sandbox",
+    "--disable-setuid-sandbox",
+    "--disable-blink-features=AutomationControlled",
+]
+
+
+class BrowserManager:
+    """
+    常驻 Chromium：整个应用生命周期只启动一个浏览器进程，
+    每个会话持有一个持久 BrowserContext + 一个可复用的 Page。
+    浏览器崩溃/断开后，下一次取用或健康检查时自动重启。
+    Playwright 在第一次启动浏览器时才导入，只转发请求的进程不必加载它。
+    """
+    def __init__(self):
+        self._playwright: Optional["Playwright"] = None
+        self._browser: Optional["Browser"] = None
+        self._contexts: Dict[str, "BrowserContext"] = {}
+        self._context_options: Dict[str, Dict[str, Any]] = {}
+        self._pages: Dict[str, "Page"] = {}
+        self._lock = asyncio.Lock()
+        self._monitor_task: Optional[asyncio.Task] = None
+        self.launch_count = 0
+        self.relaunch_count = 0
+
+    def is_healthy(self) -> bool:
+        return self._browser is not None and self._browser.is_connected()
+
+    def _on_disconnected(self, browser: "Browser"):
+        if browser is self._browser:
+            logger.warning("💥 常驻浏览器已断开，下次使用时将自动重启。")
+
+    async def _reset(self):
+        """丢弃当前浏览器及其全部上下文（不抛异常）"""
+        for ctx in list(self._contexts.values()):
+            try:
+                await ctx.close()
+            except Exception:
+                pass
+        self._contexts.clear()
+        self._context_options.clear()
+        self._pages.clear()
+        if self._browser is not None:
+            try:
+                await self._browser.close()
+            except Exception:
+                pass
+            self._browser = None
+
+    async def get_browser(self) -> "Browser":
+        async with self._lock:
+            if self.is_healthy():
+                return self._browser
+
+            if self._browser is not None:
+                logger.warning("♻️ 常驻浏览器不可用，正在重启...")
+                self.relaunch_count += 1
+                await self._reset()
+
+            if self._playwright is None:
+                from playwright.async_api import async_playwright
+                self._playwright = await async_playwright().start()
+
+            self._browser = await self._playwright.chromium.launch(headless=True, args=LAUNCH_ARGS)
+            self._browser.on("disconnected", self._on_disconnected)
+            self.launch_count += 1
+            logger.info(f"🌐 常驻浏览器已启动 (第 {self.launch_count} 次)")
+            return self._browser
+
+    async def get_context(self, key: str, **options) -> "BrowserContext":
+        """获取（必要时创建）名为 key 的持久上下文；参数变化（如 UA）时重建"""
+        browser = await self.get_browser()
+        ctx = self._contexts.get(key)
+        if ctx is not None and self._context_options.get(key) == options:
+            return ctx
+        if ctx is not None:
+            await self.close_context(key)
+        ctx = await browser.new_context(**options)
+        self._contexts[key] = ctx
+        self._context_options[key] = options
+        return ctx
+
+    async def get_page(self, key: str, **options) -> "Page":
+        """复用上下文内的同一个 Page，已关闭时重新创建"""
+        ctx = await self.get_context(key, **options)
+        page = self._pages.get(key)
+        if page is None or page.is_closed():
+            page = await ctx.new_page()
+            self._pages[key] = page
+        return page
+
+    async def discard_page(self, key: str):
+        """页面状态异常时丢弃，下次 get_page 会重建"""
+        page = self._pages.pop(key, None)
+        if page is not None:
+            try:
+                await page.close()
+            except Exception:
+                pass
+
+    async def close_context(self, key: str):
+        self._pages.pop(key, None)
+        self._context_options.pop(key, None)
+        ctx = self._contexts.pop(key, None)
+        if ctx is not None:
+            try:
+                await ctx.close()
+            except Exception:
+                pass
+
+    async def new_context(self, **options) -> "BrowserContext":
+        """一次性上下文（如需要录屏的 Turnstile 流程），由调用方负责关闭"""
+        browser = await self.get_browser()
+        return await browser.new_context(**options)
+
+    async def health_check(self) -> bool:
+        """浏览器曾经启动过但已断开时立即重启"""
+        if self._browser is None or self.is_healthy():
+            return True
+        try:
+            await self.get_browser()
+            return True
+        except Exception as e:
+            logger.error(f"❌ 常驻浏览器重启失败: {e}")
+            return False
+
+    async def _monitor_loop(self):
+        while True:
+            await asyncio.sleep(settings.BROWSER_HEALTH_CHECK_INTERVAL)
+            await self.health_check()
+
+    def start_monitor(self):
+        if self._monitor_task is None:
+            self._monitor_task = asyncio.create_task(self._monitor_loop())
+
+    async def close(self):
+        if self._monitor_task is not None:
+            self._monitor_task.cancel()
+            self._monitor_task = None
+        async with self._lock:
+            await self._reset()
+            if self._playwright is not None:
+                try:
+                    await self._playwright.stop()
+                except Exception:
+                    pass
+                self._playwright = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "healthy": self.is_healthy(),
+            "launch_count": self.launch_count,
+            "relaunch_count": self.relaunch_count,
+            "contexts": len(self._contexts),
+        }
+
+
+browser_manager = BrowserManager()
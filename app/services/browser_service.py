@@ -4,32 +4,69 @@ import os
 import time
 import random
 import re
-from typing import Dict
-from playwright.async_api import async_playwright, Page
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
 from app.core.config import settings
+from app.services.browser_manager import browser_manager
+from app.services.session_store import SessionStore, MemorySessionStore, WORKER_ID
+from app.utils import metrics
+from app.utils.circuit_breaker import CircuitBreaker, CircuitOpenError
+from app.utils.atomic_file import atomic_write_text
+
+if TYPE_CHECKING:
+    from playwright.async_api import Page
 
 logger = logging.getLogger(__name__)
 
 class BrowserService:
-    def __init__(self):
+    def __init__(self, name: str = "default", cookie_str: Optional[str] = None,
+                 user_agent: Optional[str] = None, persist_env: bool = True,
+                 store: Optional[SessionStore] = None, breaker: Optional[CircuitBreaker] = None):
+        self.name = name
+        self.cookie_str = cookie_str
+        self.persist_env = persist_env # 只有 .env 中的账号才写回 .env
         self.cached_cookies: Dict[str, str] = {}
-        self.cached_user_agent: str = settings.PPLX_USER_AGENT
+        self.cached_user_agent: str = user_agent or settings.PPLX_USER_AGENT
         self.last_refresh_time = 0
+        self.cookie_expires: Optional[float] = None # 关键 Cookie 中最早的过期时间，保活任务据此提前续期
         self.refresh_interval = 300 # 5分钟内不重复刷新
+        # 单飞刷新：同一时刻只允许一个刷新任务，并发调用方共享其结果
+        self._refresh_task: Optional[asyncio.Task] = None
+        self.last_attempt_time = 0
+        self.retry_interval = 30 # 刷新失败后，至少间隔这么久才在后台重试
+        self.context_key = name # 在常驻浏览器中对应的持久上下文
+        self.store = store or MemorySessionStore() # 多 worker 共享的 Cookie 与刷新租约
+        # 浏览器刷新熔断器：连续失败后暂停启动浏览器，避免每次都耗满 page.goto 超时
+        self.breaker = breaker or CircuitBreaker(
+            f"refresh:{name}",
+            failure_threshold=settings.REFRESH_BREAKER_THRESHOLD,
+            reset_timeout=settings.REFRESH_BREAKER_RESET_SECONDS,
+        )
+        # .env 写回：防抖合并，Cookie 没变就不写
+        self._persisted_cookies: Dict[str, str] = {}
+        self._pending_cookies: Optional[Dict[str, str]] = None
+        self._persist_task: Optional[asyncio.Task] = None
+        # 请求头（含 Cookie）缓存，UA 或 Cookie 变化时重新生成；保留生成时的 Cookie 字典引用用于比较
+        self._headers: Optional[Dict[str, str]] = None
+        self._headers_ua: Optional[str] = None
+        self._headers_cookies: Optional[Dict[str, str]] = None
 
-    async def initialize_session(self):
-        """初始化：解析 .env 中的 Cookie"""
-        logger.info("🚀 正在初始化浏览器服务...")
-        initial_cookies_list = settings.get_initial_cookies_dict()
+    def load_cookies(self):
+        """初始化：解析 .env 中的 Cookie（不启动浏览器）"""
+        logger.info(f"🚀 正在初始化浏览器服务 [{self.name}]...")
+        raw_cookie = self.cookie_str if self.cookie_str is not None else settings.PPLX_COOKIE
+        initial_cookies_list = settings.parse_cookie_string(raw_cookie)
         self.cached_cookies = {c["name"]: c["value"] for c in initial_cookies_list}
-        
-        # 启动时尝试预热
+        self._persisted_cookies = dict(self.cached_cookies)
+
+    async def warmup(self) -> bool:
+        """预热：强制刷新一次 Cookie（或采用其他 worker 的结果），失败不抛异常"""
         try:
-            await self.refresh_context(force=True)
+            return await self.refresh_context(force=True, wait=True)
         except Exception as e:
             logger.error(f"❌ 初始预热失败: {e}")
+            return False
 
-    async def _handle_cf_challenge(self, page: Page):
+    async def _handle_cf_challenge(self, page: "Page"):
         """
         [核心逻辑] 专门处理 Cloudflare 盾牌 (无截图版)
         """
@@ -38,6 +75,7 @@ class BrowserService:
             if "Just a moment" not in title and "Cloudflare" not in title:
                 return
 
+            metrics.CF_CHALLENGES.inc()
             logger.warning(f"🛡️ 检测到 Cloudflare 盾牌 (标题: {title})，正在尝试自动突破...")
             
             for i in range(10):
@@ -74,9 +112,35 @@ class BrowserService:
         except Exception as e:
             logger.error(f"❌ 处理盾牌时出错: {e}")
 
-    def _update_env_file(self, new_cookies: Dict[str, str]):
+    def _schedule_env_persist(self, new_cookies: Dict[str, str]):
+        """
+        登记一次待写回的 Cookie：防抖窗口内的多次刷新只会写一次，
+        实际写盘在线程池中进行，不阻塞事件循环上的流式响应。
+        """
+        if new_cookies == self._persisted_cookies:
+            self._pending_cookies = None
+            return
+        self._pending_cookies = dict(new_cookies)
+        if self._persist_task is None or self._persist_task.done():
+            self._persist_task = asyncio.create_task(self._persist_later())
+
+    async def _persist_later(self):
+        # 写盘期间又有新的 Cookie 登记时，再等一个窗口继续写
+        while self._pending_cookies is not None:
+            await asyncio.sleep(settings.ENV_PERSIST_DEBOUNCE_SECONDS)
+            await self.flush_env()
+
+    async def flush_env(self):
+        """立即写回尚未落盘的 Cookie（关闭服务时调用）"""
+        cookies, self._pending_cookies = self._pending_cookies, None
+        if cookies is None or cookies == self._persisted_cookies:
+            return
+        if await asyncio.to_thread(self._update_env_file, cookies):
+            self._persisted_cookies = cookies
+
+    def _update_env_file(self, new_cookies: Dict[str, str]) -> bool:
         """
-        [持久化] 将最新的 Cookie 写回 .env 文件
+        [持久化] 将最新的 Cookie 写回 .env 文件（原子替换）
         """
         try:
             # 构造 Cookie 字符串
@@ -84,106 +148,212 @@ class BrowserService:
             env_path = ".env" # 容器内路径，映射到宿主机
             
             if not os.path.exists(env_path):
-                return
+                return False
 
-            with open(env_path, 'r', encoding='utf-8') as f:
+            with open(env_path, 'r', encoding='utf-8', newline='') as f:
                 lines = f.readlines()
             
             new_lines = []
             updated = False
             for line in lines:
                 if line.startswith("PPLX_COOKIE="):
-                    new_lines.append(f'PPLX_COOKIE="{cookie_str}"\n')
+                    ending = "\r\n" if line.endswith("\r\n") else "\n"
+                    new_lines.append(f'PPLX_COOKIE="{cookie_str}"{ending}')
                     updated = True
                 else:
                     new_lines.append(line)
             
             if not updated:
+                if new_lines and not new_lines[-1].endswith("\n"):
+                    new_lines[-1] += "\n"
                 new_lines.append(f'PPLX_COOKIE="{cookie_str}"\n')
 
-            with open(env_path, 'w', encoding='utf-8') as f:
-                f.writelines(new_lines)
+            atomic_write_text(env_path, "".join(new_lines))
             
             logger.info("💾 最新 Cookie 已自动保存到 .env 文件 (持久化成功)")
+            return True
             
         except Exception as e:
             logger.error(f"❌ 保存 Cookie 到文件失败: {e}")
+            return False
+
+    def is_refreshing(self) -> bool:
+        return self._refresh_task is not None and not self._refresh_task.done()
 
-    async def refresh_context(self, force=False):
+    async def refresh_context(self, force=False, wait=False) -> bool:
         """
-        启动浏览器，访问页面，过盾，更新 Cookie
+        单飞刷新入口：
+        - Cookie 未过期且非强制时直接返回；
+        - 已有刷新在进行时复用同一个任务，不会重复启动浏览器；
+        - 手上还有可用 Cookie 时刷新放到后台，请求继续用旧 Cookie，
+          只有完全没有 Cookie（或 wait=True）时才阻塞等待刷新结果。
         """
-        if not force and (time.time() - self.last_refresh_time < self.refresh_interval) and self.cached_cookies:
+        now = time.time()
+        if not force and (now - self.last_refresh_time < self.refresh_interval) and self.cached_cookies:
+            return True
+        # 上一次刷新刚失败过：有旧 Cookie 就先凑合用，避免每个请求都拉起一次浏览器
+        if not force and not wait and self.cached_cookies and now - self.last_attempt_time < self.retry_interval:
             return True
 
-        logger.info("🔄 启动浏览器进行会话保活/续期...")
-        
-        async with async_playwright() as p:
-            # 移除 record_video_dir，不录屏
-            browser = await p.chromium.launch(
-                headless=True,
-                args=[
-                    "--no-sandbox",
-                    "--disable-setuid-sandbox",
-                    "--disable-blink-features=AutomationControlled"
-                ]
-            )
-            
-            context = await browser.new_context(
-                user_agent=self.cached_user_agent,
-                viewport={"width": 1280, "height": 720}
-            )
-
-            if self.cached_cookies:
-                cookie_list = [
-                    {"name": k, "value": v, "url": "https://www.perplexity.ai"}
-                    for k, v in self.cached_cookies.items()
-                ]
-                try:
-                    await context.add_cookies(cookie_list)
-                except Exception:
-                    pass
-
-            page = await context.new_page()
+        if not self.is_refreshing():
+            self.last_attempt_time = now
+            self._refresh_task = asyncio.create_task(self._do_refresh())
+
+        if wait or not self.cached_cookies:
+            # shield: 某个等待方被取消时不影响其他共享该刷新的请求
+            return await asyncio.shield(self._refresh_task)
+        return True
 
+    async def _do_refresh(self) -> bool:
+        """
+        优先采用其他 worker 刚写入存储的 Cookie；否则竞选刷新租约，
+        只有拿到租约的 worker 才启动浏览器，其余 worker 等待其结果。
+        """
+        try:
+            if await self._adopt_from_store():
+                return True
+            if not await self.store.acquire_lease(self.name, WORKER_ID, settings.SESSION_LEASE_SECONDS):
+                logger.info(f"⏳ [{self.name}] 其他 worker 正在刷新会话，等待其结果...")
+                return await self._wait_for_store()
             try:
-                await page.goto(settings.TARGET_URL, wait_until="domcontentloaded", timeout=60000)
-                
-                # 处理盾牌
-                await self._handle_cf_challenge(page)
-
-                # 检查结果
-                title = await page.title()
-                if "Just a moment" in title or "Cloudflare" in title:
-                    logger.error("❌ 过盾失败，仍在盾牌页面。")
-                    return False
-
-                # 提取并更新 Cookie
-                cookies = await context.cookies()
-                new_cookies = {c["name"]: c["value"] for c in cookies}
-                
-                if "pplx.visitor-id" in new_cookies:
-                    self.cached_cookies = new_cookies
-                    self.last_refresh_time = time.time()
-                    logger.info(f"✅ Cookie 刷新成功! 数量: {len(self.cached_cookies)}")
-                    
-                    # [关键] 自动写回文件
-                    self._update_env_file(new_cookies)
-                    
-                    return True
-                else:
-                    logger.error("❌ 未找到关键 Cookie，可能验证未通过。")
-                    return False
+                return await self._refresh_as_leader()
+            finally:
+                await self.store.release_lease(self.name, WORKER_ID)
+        except Exception as e:
+            logger.error(f"❌ 会话刷新失败: {e}")
+            return False
+
+    async def _refresh_as_leader(self) -> bool:
+        try:
+            self.breaker.before_call()
+        except CircuitOpenError as e:
+            logger.warning(f"🧯 [{self.name}] 浏览器刷新熔断中，{e.retry_after:.0f}s 后再试，继续使用现有 Cookie")
+            metrics.REFRESHES.inc(result="rejected")
+            return False
+        ok = False
+        try:
+            with metrics.REFRESH_DURATION.time():
+                ok = await self._refresh_with_browser()
+        finally:
+            self.breaker.after_call(ok)
+            metrics.REFRESHES.inc(result="success" if ok else "failure")
+        if ok:
+            await self.store.save(self.name, {
+                "cookies": self.cached_cookies,
+                "user_agent": self.cached_user_agent,
+                "updated_at": self.last_refresh_time,
+                "expires": self.cookie_expires,
+            })
+        return ok
+
+    async def _adopt_from_store(self) -> bool:
+        """存储中有比本地更新且未过期的 Cookie 时直接采用"""
+        record = await self.store.load(self.name)
+        if not record or record.get("updated_at", 0) <= self.last_refresh_time:
+            return False
+        if time.time() - record["updated_at"] >= self.refresh_interval:
+            return False
+        self.cached_cookies = record["cookies"]
+        self.cached_user_agent = record.get("user_agent") or self.cached_user_agent
+        self.last_refresh_time = record["updated_at"]
+        self.cookie_expires = record.get("expires")
+        logger.info(f"📥 [{self.name}] 已采用其他 worker 刷新的 Cookie")
+        return True
+
+    async def _wait_for_store(self) -> bool:
+        deadline = time.time() + settings.SESSION_LEASE_SECONDS
+        while time.time() < deadline:
+            await asyncio.sleep(1)
+            if await self._adopt_from_store():
+                return True
+        logger.warning(f"⚠️ [{self.name}] 等待其他 worker 刷新超时")
+        return False
+
+    async def _refresh_with_browser(self) -> bool:
+        logger.info("🔄 使用常驻浏览器进行会话保活/续期...")
+
+        context = await browser_manager.get_context(
+            self.context_key,
+            user_agent=self.cached_user_agent,
+            viewport={"width": 1280, "height": 720}
+        )
+
+        if self.cached_cookies:
+            cookie_list = [
+                {"name": k, "value": v, "url": "https://www.perplexity.ai"}
+                for k, v in self.cached_cookies.items()
+            ]
+            try:
+                await context.add_cookies(cookie_list)
+            except Exception:
+                pass
+
+        page = await browser_manager.get_page(
+            self.context_key,
+            user_agent=self.cached_user_agent,
+            viewport={"width": 1280, "height": 720}
+        )
+
+        try:
+            await page.goto(settings.TARGET_URL, wait_until="domcontentloaded", timeout=60000)
+
+            # 处理盾牌
+            await self._handle_cf_challenge(page)
+
+            # 检查结果
+            title = await page.title()
+            if "Just a moment" in title or "Cloudflare" in title:
+                logger.error("❌ 过盾失败，仍在盾牌页面。")
+                return False
+
+            # 提取并更新 Cookie
+            cookies = await context.cookies()
+            new_cookies = {c["name"]: c["value"] for c in cookies}
 
-            except Exception as e:
-                logger.error(f"❌ 浏览器操作异常: {e}")
+            if "pplx.visitor-id" in new_cookies:
+                self.cached_cookies = new_cookies
+                self.cookie_expires = self._earliest_expiry(cookies)
+                self.last_refresh_time = time.time()
+                logger.info(f"✅ [{self.name}] Cookie 刷新成功! 数量: {len(self.cached_cookies)}")
+
+                # [关键] 自动写回文件
+                if self.persist_env:
+                    self._schedule_env_persist(new_cookies)
+
+                return True
+            else:
+                logger.error("❌ 未找到关键 Cookie，可能验证未通过。")
                 return False
-            finally:
-                await context.close()
-                await browser.close()
+
+        except Exception as e:
+            logger.error(f"❌ 浏览器操作异常: {e}")
+            # 页面可能卡在异常状态，丢弃后下次重建
+            await browser_manager.discard_page(self.context_key)
+            return False
+
+    @staticmethod
+    def _earliest_expiry(cookies: List[Dict[str, Any]]) -> Optional[float]:
+        """KEEPALIVE_COOKIES 中最早的过期时间；会话 Cookie 的 expires 为 -1，不计入"""
+        watched = {n.strip() for n in settings.KEEPALIVE_COOKIES.split(",") if n.strip()}
+        expiries = [c["expires"] for c in cookies
+                    if c.get("name") in watched and (c.get("expires") or -1) > 0]
+        return min(expiries) if expiries else None
 
     def get_headers(self) -> Dict[str, str]:
-        return {
+        """
+        发给上游的请求头（含 Cookie），调用方不要修改返回的字典。
+        Cookie 字典只会被整体替换，不会原地修改，所以按对象身份（is）判断是否需要重建；
+        持有旧字典的引用，它不会被回收，新字典也就不可能复用同一个地址。
+        """
+        if (self._headers is None or self._headers_cookies is not self.cached_cookies
+                or self._headers_ua != self.cached_user_agent):
+            self._headers = self._build_headers()
+            self._headers_cookies = self.cached_cookies
+            self._headers_ua = self.cached_user_agent
+        return self._headers
+
+    def _build_headers(self) -> Dict[str, str]:
+        headers = {
             "Host": "www.perplexity.ai",
             "User-Agent": self.cached_user_agent,
             "Accept": "text/event-stream",
@@ -201,6 +371,9 @@ class BrowserService:
             "sec-fetch-site": "same-origin",
             "x-perplexity-request-reason": "perplexity-query-state-provider"
         }
+        if self.cached_cookies:
+            headers["Cookie"] = "; ".join(f"{k}={v}" for k, v in self.cached_cookies.items())
+        return headers
 
     def get_cookies(self) -> Dict[str, str]:
         return self.cached_cookies
\ No newline at end of file
@@ -0,0 +1,133 @@
+import asyncio
+import random
+import time
+from typing import Any, Dict, List, Optional
+from loguru import logger
+
+from app.core.config import settings
+from app.services.retry_policy import backoff_delay
+from app.services.session_pool import PooledSession, SessionPool
+
+
+class _KeepaliveState:
+    """单个会话的续期计划"""
+    __slots__ = ("interval", "next_due", "planned_for", "failures", "requests_seen", "forbidden_seen", "last_result")
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.next_due = 0.0
+        self.planned_for = 0.0  # 制定计划时会话的 last_refresh_time
+        self.failures = 0
+        self.requests_seen = 0
+        self.forbidden_seen = 0
+        self.last_result = ""
+
+
+class SessionKeepalive:
+    """
+    后台会话保活：在 Cookie 过期之前主动刷新，请求不必再等待浏览器过盾。
+    - 有 expires 的关键 Cookie：在最早过期时间前 KEEPALIVE_EXPIRY_MARGIN 秒续期；
+    - 否则按自适应间隔续期：上一周期 403 比例偏高时间隔减半，没有 403 时逐步放宽；
+    - 每次计划时间加随机抖动，多个账号 / 多个 worker 不会同时启动浏览器；
+    - 刷新失败按指数退避重试。
+    多 worker 时刷新经过会话存储的租约，只有一个 worker 真正启动浏览器，其余直接采用结果。
+    """
+    def __init__(self, pool: SessionPool):
+        self.pool = pool
+        self._states: Dict[str, _KeepaliveState] = {
+            s.name: _KeepaliveState(settings.KEEPALIVE_INTERVAL) for s in pool.sessions
+        }
+        self._task: Optional[asyncio.Task] = None
+        self.refreshes = 0
+        self.failures = 0
+
+    def start(self):
+        if self._task is not None:
+            return
+        for s in self.pool.sessions:
+            # 请求触发的惰性刷新只作为兜底，续期节奏交给保活任务
+            s.service.refresh_interval = max(s.service.refresh_interval, settings.KEEPALIVE_MAX_INTERVAL)
+            self._schedule(s, self._states[s.name])
+        self._task = asyncio.create_task(self._loop())
+        logger.info("💓 会话保活已启动，初始间隔 {:.0f}s", settings.KEEPALIVE_INTERVAL)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def _jitter(self, delay: float) -> float:
+        spread = delay * settings.KEEPALIVE_JITTER
+        return max(delay + random.uniform(-spread, spread), 0.0)
+
+    def _adapt(self, session: PooledSession, state: _KeepaliveState):
+        """按上一周期观察到的 403 比例调整续期间隔"""
+        requests = session.requests_total - state.requests_seen
+        forbidden = session.forbidden_total - state.forbidden_seen
+        state.requests_seen = session.requests_total
+        state.forbidden_seen = session.forbidden_total
+        if forbidden and forbidden / max(requests, 1) >= settings.KEEPALIVE_FORBIDDEN_RATE:
+            state.interval = max(state.interval / 2, settings.KEEPALIVE_MIN_INTERVAL)
+        elif not forbidden:
+            state.interval = min(state.interval * 1.5, settings.KEEPALIVE_MAX_INTERVAL)
+
+    def _schedule(self, session: PooledSession, state: _KeepaliveState):
+        now = time.time()
+        service = session.service
+        state.planned_for = service.last_refresh_time
+        due = service.last_refresh_time + state.interval if service.cached_cookies else now
+        if service.cookie_expires:
+            due = min(due, service.cookie_expires - settings.KEEPALIVE_EXPIRY_MARGIN)
+        state.next_due = now + self._jitter(max(due - now, settings.KEEPALIVE_MIN_INTERVAL / 2))
+
+    async def _loop(self):
+        while True:
+            now = time.time()
+            next_due = min((st.next_due for st in self._states.values()), default=now + 60)
+            # 最多睡 60s：期间 403 触发的刷新 / 采用其他 worker 的结果会改变计划
+            await asyncio.sleep(min(max(next_due - now, 1.0), 60.0))
+            for session in self.pool.sessions:
+                state = self._states[session.name]
+                if session.service.last_refresh_time > state.planned_for:
+                    self._schedule(session, state)  # 已经通过其他途径刷新过
+                elif time.time() >= state.next_due:
+                    await self._renew(session, state)
+
+    async def _renew(self, session: PooledSession, state: _KeepaliveState):
+        logger.info("💓 会话 [{}] 到期续期 (间隔 {:.0f}s)", session.name, state.interval)
+        # 403 已经触发了刷新时，单飞刷新会直接复用那个任务
+        ok = await session.service.refresh_context(force=True, wait=True)
+        self.refreshes += 1
+        if ok:
+            state.failures = 0
+            state.last_result = "success"
+            self._adapt(session, state)
+            self._schedule(session, state)
+            return
+        self.failures += 1
+        state.failures += 1
+        state.last_result = "failure"
+        delay = backoff_delay(state.failures - 1, settings.KEEPALIVE_BACKOFF, settings.KEEPALIVE_MAX_INTERVAL)
+        state.next_due = time.time() + delay
+        logger.warning("💔 会话 [{}] 续期失败 (第 {} 次)，{:.0f}s 后重试", session.name, state.failures, delay)
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.time()
+        sessions: List[Dict[str, Any]] = []
+        for s in self.pool.sessions:
+            state = self._states[s.name]
+            sessions.append({
+                "name": s.name,
+                "interval": round(state.interval, 1),
+                "next_in": round(max(state.next_due - now, 0), 1),
+                "cookie_expires_in": round(s.service.cookie_expires - now, 1) if s.service.cookie_expires else None,
+                "failures": state.failures,
+                "last_result": state.last_result,
+            })
+        return {
+            "running": self._task is not None,
+            "refreshes": self.refreshes,
+            "failures": self.failures,
+            "sessions": sessions,
+        }
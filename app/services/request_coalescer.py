@@ -0,0 +1,90 @@
+import asyncio
+from typing import AsyncGenerator, AsyncIterator, Callable, Dict, List, Optional, Any
+
+
+class _InflightStream:
+    """一个正在进行的上游流：已解码的增量 + 完成/异常状态"""
+    def __init__(self):
+        self.deltas: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.cond = asyncio.Condition()
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+
+
+class RequestCoalescer:
+    """
+    相同 key 的并发请求合并为一个上游流：
+    第一个请求启动上游（后台任务读取），之后的请求订阅同一份增量；
+    晚到的订阅者先回放已产出的部分，再继续跟随实时增量。
+    所有订阅者都离开后，上游流会被取消。
+    """
+    def __init__(self):
+        self._inflight: Dict[str, _InflightStream] = {}
+        self.leaders = 0
+        self.joiners = 0
+
+    async def subscribe(self, key: str, source_factory: Callable[[], AsyncIterator[str]]) -> AsyncGenerator[str, None]:
+        stream = self._inflight.get(key)
+        if stream is None:
+            stream = _InflightStream()
+            self._inflight[key] = stream
+            stream.task = asyncio.create_task(self._pump(key, stream, source_factory()))
+            self.leaders += 1
+        else:
+            self.joiners += 1
+
+        stream.subscribers += 1
+        index = 0
+        try:
+            while True:
+                if index < len(stream.deltas):
+                    delta = stream.deltas[index]
+                    index += 1
+                    yield delta
+                    continue
+                if stream.done:
+                    if stream.error is not None:
+                        raise stream.error
+                    return
+                async with stream.cond:
+                    await stream.cond.wait_for(lambda: index < len(stream.deltas) or stream.done)
+        finally:
+            stream.subscribers -= 1
+            if stream.subscribers == 0 and not stream.done:
+                # 没人再听了：立即摘除并取消上游，后来的同 key 请求会重新发起
+                if self._inflight.get(key) is stream:
+                    del self._inflight[key]
+                stream.task.cancel()
+
+    async def _pump(self, key: str, stream: _InflightStream, source: AsyncIterator[str]):
+        try:
+            async for delta in source:
+                stream.deltas.append(delta)
+                async with stream.cond:
+                    stream.cond.notify_all()
+        except asyncio.CancelledError:
+            stream.error = asyncio.CancelledError()
+        except Exception as e:
+            stream.error = e
+        finally:
+            # 显式关闭上游生成器，让其中的 finally（归还会话等）立即执行
+            aclose = getattr(source, "aclose", None)
+            if aclose is not None:
+                try:
+                    await aclose()
+                except Exception:
+                    pass
+            stream.done = True
+            if self._inflight.get(key) is stream:
+                del self._inflight[key]
+            async with stream.cond:
+                stream.cond.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "inflight": len(self._inflight),
+            "leaders": self.leaders,
+            "joiners": self.joiners,
+        }
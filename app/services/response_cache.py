@@ -0,0 +1,159 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+from loguru import logger
+
+
+class _CacheEntry:
+    __slots__ = ("deltas", "size", "created")
+
+    def __init__(self, deltas: List[str], size: int, created: float):
+        self.deltas = deltas
+        self.size = size
+        self.created = created
+
+
+class ResponseCache:
+    """
+    回答缓存：key = 规范化后的 query + 模型 + 搜索参数，value = 增量文本列表。
+    TTL 过期 + 按条数/字节数的 LRU 淘汰；配置 disk_dir 时每条写一个 JSON 文件，
+    重启后从磁盘加载。命中时按原有分片原样回放。
+    过期后再保留 stale_ttl 秒，只供 get_stale() 在上游熔断时兜底使用。
+    """
+    def __init__(self, ttl: float, max_entries: int, max_bytes: int, disk_dir: str = "", stale_ttl: float = 0.0):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self._entries: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(query: str, model: str, options: Dict[str, Any]) -> str:
+        normalized = " ".join(query.split())
+        raw = json.dumps([normalized, model, options], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _expired(self, entry: _CacheEntry, now: float, grace: float = 0.0) -> bool:
+        return now - entry.created > self.ttl + grace
+
+    def get(self, key: str) -> Optional[List[str]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        now = time.time()
+        if self._expired(entry, now):
+            if self._expired(entry, now, self.stale_ttl):
+                self._remove(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry.deltas
+
+    def get_stale(self, key: str) -> Optional[List[str]]:
+        """忽略 TTL，返回仍在 stale_ttl 保留期内的条目"""
+        entry = self._entries.get(key)
+        if entry is None or self._expired(entry, time.time(), self.stale_ttl):
+            return None
+        self.stale_hits += 1
+        return entry.deltas
+
+    def put(self, key: str, deltas: List[str], created: Optional[float] = None, persist: bool = True):
+        size = sum(len(d.encode("utf-8")) for d in deltas)
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key, delete_file=False)
+
+        entry = _CacheEntry(deltas, size, created or time.time())
+        self._entries[key] = entry
+        self._bytes += size
+
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+        if persist and self.disk_dir and key in self._entries:
+            self._run_in_background(self._write_file, key, entry)
+
+    def _remove(self, key: str, delete_file: bool = True):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._bytes -= entry.size
+        if delete_file and self.disk_dir:
+            self._run_in_background(self._delete_file, key)
+
+    # --- 磁盘后端 ---
+
+    def _run_in_background(self, fn, *args):
+        try:
+            asyncio.get_running_loop().run_in_executor(None, fn, *args)
+        except RuntimeError:
+            fn(*args)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def _write_file(self, key: str, entry: _CacheEntry):
+        try:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            tmp_path = self._path(key) + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"created": entry.created, "deltas": entry.deltas}, f, ensure_ascii=False)
+            os.replace(tmp_path, self._path(key))
+        except Exception as e:
+            logger.warning(f"写入回答缓存失败: {e}")
+
+    def _delete_file(self, key: str):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"删除回答缓存失败: {e}")
+
+    def load(self):
+        """启动时从磁盘加载保留期内的条目（按写入时间从旧到新，保持 LRU 顺序）"""
+        if not self.disk_dir or not os.path.isdir(self.disk_dir):
+            return
+        now = time.time()
+        items = []
+        for name in os.listdir(self.disk_dir):
+            if not name.endswith(".json"):
+                continue
+            key = name[:-5]
+            try:
+                with open(self._path(key), "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if now - data["created"] > self.ttl + self.stale_ttl:
+                    os.remove(self._path(key))
+                    continue
+                items.append((data["created"], key, data["deltas"]))
+            except Exception as e:
+                logger.warning(f"跳过损坏的缓存文件 {name}: {e}")
+        for created, key, deltas in sorted(items):
+            self.put(key, deltas, created=created, persist=False)
+        logger.info(f"💾 已从磁盘加载 {len(self._entries)} 条回答缓存")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale_hits": self.stale_hits,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,43 @@
+import random
+from collections import deque
+from typing import Deque, Optional
+
+import httpx
+
+# 首字节前遇到这些状态码可以换会话 / 刷新后重试
+RETRYABLE_STATUS = {403, 429, 500, 502, 503, 504}
+
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, httpx.TransportError):
+        return True
+    return getattr(error, "status_code", None) in RETRYABLE_STATUS
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """指数退避 + 抖动（equal jitter）：第 attempt 次重试等待 [d/2, d]，d = min(cap, base * 2^attempt)"""
+    delay = min(cap, base * (2 ** attempt))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class HedgePolicy:
+    """
+    对冲请求的触发阈值：最近 window 个请求首字节耗时的 percentile 分位数。
+    样本不足时不对冲；阈值不低于 min_delay，避免在上游很快时也重复请求。
+    """
+    def __init__(self, enabled: bool, percentile: float, min_samples: int, min_delay: float, window: int = 200):
+        self.enabled = enabled
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self._samples: Deque[float] = deque(maxlen=window)
+
+    def observe(self, ttfb: float):
+        self._samples.append(ttfb)
+
+    def threshold(self) -> Optional[float]:
+        if not self.enabled or len(self._samples) < self.min_samples:
+            return None
+        ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))
+        return max(ordered[index], self.min_delay)
@@ -0,0 +1,240 @@
+import asyncio
+import time
+from typing import Iterable, List, Optional, Dict, Any
+from fastapi import HTTPException
+from loguru import logger
+
+from app.core.config import settings
+from app.services.browser_service import BrowserService
+from app.services.session_store import create_session_store
+from app.utils.circuit_breaker import CircuitBreaker
+
+
+class PooledSession:
+    """账号池中的一个会话：BrowserService + 负载/健康状态"""
+    def __init__(self, service: BrowserService, weight: float = 1.0):
+        self.service = service
+        self.name = service.name
+        self.weight = weight
+        self.in_flight = 0
+        self.health = 1.0              # 0~1，失败时衰减，成功时恢复
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+        self.evicted_at = 0.0          # 非 0 表示已剔除
+        self.current_weight = 0.0      # 平滑加权轮询用
+        self.requests_total = 0
+        self.failures_total = 0
+        self.forbidden_total = 0       # 403 次数，保活任务据此调整续期间隔
+
+    @property
+    def effective_weight(self) -> float:
+        return max(self.weight * self.health, 0.01)
+
+    def is_available(self, now: float) -> bool:
+        return not self.evicted_at and now >= self.cooldown_until
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.time()
+        return {
+            "name": self.name,
+            "in_flight": self.in_flight,
+            "health": round(self.health, 3),
+            "weight": self.weight,
+            "cooldown_remaining": max(round(self.cooldown_until - now, 1), 0),
+            "evicted": bool(self.evicted_at),
+            "consecutive_failures": self.consecutive_failures,
+            "requests_total": self.requests_total,
+            "failures_total": self.failures_total,
+            "forbidden_total": self.forbidden_total,
+        }
+
+
+class SessionPool:
+    """
+    多账号会话池：每个请求按 least_inflight 或 weighted_rr 选一个会话，
+    403/429 的会话进入冷却，连续失败过多则剔除，刷新成功后自动恢复。
+    """
+    def __init__(self):
+        self.sessions: List[PooledSession] = []
+        self.store = create_session_store()
+        # 所有账号共用一个浏览器刷新熔断器：刷新失败多半是浏览器 / Cloudflare 的问题，与账号无关
+        self.refresh_breaker = CircuitBreaker(
+            "refresh",
+            failure_threshold=settings.REFRESH_BREAKER_THRESHOLD,
+            reset_timeout=settings.REFRESH_BREAKER_RESET_SECONDS,
+        )
+        for acct in settings.get_accounts():
+            service = BrowserService(
+                name=acct["name"],
+                cookie_str=acct["cookie"],
+                user_agent=acct["user_agent"],
+                persist_env=acct["persist_env"],
+                store=self.store,
+                breaker=self.refresh_breaker,
+            )
+            self.sessions.append(PooledSession(service, acct["weight"]))
+
+        if not self.sessions:
+            # 未配置任何账号时保留原先的单会话行为
+            self.sessions.append(PooledSession(BrowserService(store=self.store, breaker=self.refresh_breaker)))
+
+        # 启动预热在后台进行，服务先开始监听；进度供 /readyz 使用
+        self._warmup_task: Optional[asyncio.Task] = None
+        self.warmup_started_at = 0.0
+        self.warmup_finished_at = 0.0
+        self.warmup_results: Dict[str, bool] = {}
+
+    async def initialize(self):
+        """只解析各账号的 Cookie，不启动浏览器；预热由 start_warmup() 在后台完成"""
+        logger.info(f"👥 账号池共 {len(self.sessions)} 个会话，策略: {settings.SESSION_STRATEGY}")
+        for s in self.sessions:
+            s.service.load_cookies()
+
+    def start_warmup(self):
+        if self._warmup_task is None:
+            self.warmup_started_at = time.time()
+            self._warmup_task = asyncio.create_task(self._warmup())
+
+    async def _warmup(self):
+        async def one(s: PooledSession):
+            self.warmup_results[s.name] = await s.service.warmup()
+
+        await asyncio.gather(*(one(s) for s in self.sessions))
+        self.warmup_finished_at = time.time()
+        ok = sum(self.warmup_results.values())
+        logger.info(f"🔥 预热完成：{ok}/{len(self.sessions)} 个会话成功，"
+                    f"耗时 {self.warmup_finished_at - self.warmup_started_at:.1f}s")
+
+    def usable_sessions(self) -> int:
+        """已有 Cookie（.env / 存储 / 刷新得到）且尚未确认失效（未剔除、最近没有 403/429）的会话数"""
+        return sum(1 for s in self.sessions
+                   if s.service.cached_cookies and not s.evicted_at and not s.consecutive_failures)
+
+    def is_ready(self) -> bool:
+        """
+        请求路径直接使用已加载的 Cookie，所以任一会话有可用 Cookie 就可以接流量，不必等浏览器预热；
+        没有 Cookie 时等预热：任一会话成功即就绪，全部结束但都失败时也就绪（与预热前的行为一致）。
+        """
+        return (self.usable_sessions() > 0 or any(self.warmup_results.values())
+                or bool(self.warmup_finished_at))
+
+    def warmup_stats(self) -> Dict[str, Any]:
+        if not self.warmup_started_at:
+            state = "pending"
+        elif self.warmup_finished_at:
+            state = "done"
+        else:
+            state = "running"
+        end = self.warmup_finished_at or time.time()
+        return {
+            "state": state,
+            "total": len(self.sessions),
+            "usable": self.usable_sessions(),
+            "finished": len(self.warmup_results),
+            "succeeded": sum(self.warmup_results.values()),
+            "elapsed": round(end - self.warmup_started_at, 1) if self.warmup_started_at else 0.0,
+            "sessions": {s.name: self.warmup_results.get(s.name) for s in self.sessions},
+        }
+
+    async def close(self):
+        if self._warmup_task is not None and not self._warmup_task.done():
+            self._warmup_task.cancel()
+            await asyncio.gather(self._warmup_task, return_exceptions=True)
+        await asyncio.gather(*(s.service.flush_env() for s in self.sessions), return_exceptions=True)
+        await self.store.close()
+
+    def get(self, name: str) -> Optional[PooledSession]:
+        return next((s for s in self.sessions if s.name == name), None)
+
+    def _reinstate(self):
+        """被剔除的会话在之后刷新成功过，就恢复上线"""
+        for s in self.sessions:
+            if s.evicted_at and s.service.last_refresh_time > s.evicted_at:
+                logger.info(f"✅ 会话 [{s.name}] 刷新成功，重新加入账号池")
+                s.evicted_at = 0.0
+                s.consecutive_failures = 0
+                s.health = 0.5
+
+    def _pick(self, candidates: List[PooledSession]) -> PooledSession:
+        if settings.SESSION_STRATEGY == "weighted_rr":
+            # 平滑加权轮询 (nginx 算法)，权重 = 配置权重 * 健康分
+            total = 0.0
+            best = None
+            for s in candidates:
+                s.current_weight += s.effective_weight
+                total += s.effective_weight
+                if best is None or s.current_weight > best.current_weight:
+                    best = s
+            best.current_weight -= total
+            return best
+        # least_inflight：并发最少者优先，持平时选健康分高的
+        return min(candidates, key=lambda s: (s.in_flight / s.effective_weight, -s.health))
+
+    def has_available(self, exclude: Iterable[str] = ()) -> bool:
+        now = time.time()
+        return any(s.is_available(now) and s.name not in exclude for s in self.sessions)
+
+    def acquire(self, prefer: Optional[str] = None, avoid: Iterable[str] = ()) -> PooledSession:
+        """avoid: 尽量避开的会话（重试时换号），没有其他可用会话时仍可能选中"""
+        now = time.time()
+        self._reinstate()
+
+        session = None
+        if prefer:
+            preferred = self.get(prefer)
+            if preferred and preferred.is_available(now):
+                session = preferred
+
+        if session is None:
+            candidates = [s for s in self.sessions if s.is_available(now)]
+            if avoid:
+                candidates = [s for s in candidates if s.name not in avoid] or candidates
+            if candidates:
+                session = self._pick(candidates)
+            else:
+                # 全部在冷却：退而求其次，选最早结束冷却的未剔除会话
+                cooling = [s for s in self.sessions if not s.evicted_at]
+                if not cooling:
+                    raise HTTPException(status_code=503, detail="No upstream session available")
+                session = min(cooling, key=lambda s: s.cooldown_until)
+
+        session.in_flight += 1
+        session.requests_total += 1
+        return session
+
+    def release(self, session: PooledSession, status_code: Optional[int] = None):
+        """
+        归还会话；status_code 为 None 表示请求在拿到状态码前就结束了（传输错误 / 被取消），不计入会话失败。
+        只有 403/429 说明账号本身有问题，才计入冷却与剔除；5xx 等上游故障交给上游熔断器处理。
+        """
+        session.in_flight = max(session.in_flight - 1, 0)
+
+        if status_code is None:
+            return
+        if status_code == 200:
+            session.consecutive_failures = 0
+            session.health = min(session.health + 0.1, 1.0)
+            return
+
+        session.failures_total += 1
+        if status_code not in (403, 429):
+            session.health *= 0.8
+            return
+
+        session.consecutive_failures += 1
+        session.health *= 0.5
+        cooldown = settings.SESSION_COOLDOWN_SECONDS * (2 ** min(session.consecutive_failures - 1, 5))
+        session.cooldown_until = time.time() + cooldown
+        logger.warning("🧊 会话 [{}] 返回 {}，冷却 {:.0f}s", session.name, status_code, cooldown)
+        if status_code == 403:
+            session.forbidden_total += 1
+            # 403 通常是 Cookie/盾牌失效，后台触发该会话的刷新
+            asyncio.ensure_future(session.service.refresh_context(force=True))
+
+        if session.consecutive_failures >= settings.SESSION_MAX_FAILURES and not session.evicted_at:
+            session.evicted_at = time.time()
+            logger.error(f"🚫 会话 [{session.name}] 连续失败 {session.consecutive_failures} 次，已剔除出账号池")
+            asyncio.ensure_future(session.service.refresh_context(force=True))
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [s.stats() for s in self.sessions]
@@ -0,0 +1,177 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# 本进程在租约中的身份，多容器时用主机名区分
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+
+class SessionStore(ABC):
+    """
+    会话状态存储：多个 worker / 容器之间共享每个账号的 Cookie，
+    并通过带 TTL 的租约选出唯一一个执行浏览器刷新的 worker。
+    记录格式: {"cookies": {...}, "user_agent": "...", "updated_at": 时间戳}
+    """
+    @abstractmethod
+    async def load(self, name: str) -> Optional[Dict[str, Any]]:
+        pass
+
+    @abstractmethod
+    async def save(self, name: str, record: Dict[str, Any]):
+        pass
+
+    @abstractmethod
+    async def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        """租约空闲、已过期或本来就属于 owner 时获得（并续期），否则返回 False"""
+        pass
+
+    @abstractmethod
+    async def release_lease(self, name: str, owner: str):
+        pass
+
+    async def close(self):
+        pass
+
+
+class MemorySessionStore(SessionStore):
+    """单进程默认实现，行为与原先一致（只有自己一个 worker）"""
+    def __init__(self):
+        self._records: Dict[str, Dict[str, Any]] = {}
+        self._leases: Dict[str, tuple] = {}
+
+    async def load(self, name: str) -> Optional[Dict[str, Any]]:
+        return self._records.get(name)
+
+    async def save(self, name: str, record: Dict[str, Any]):
+        self._records[name] = record
+
+    async def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        holder, expires = self._leases.get(name, (None, 0.0))
+        now = time.time()
+        if holder not in (None, owner) and expires > now:
+            return False
+        self._leases[name] = (owner, now + ttl)
+        return True
+
+    async def release_lease(self, name: str, owner: str):
+        if self._leases.get(name, (None,))[0] == owner:
+            del self._leases[name]
+
+
+class FileSessionStore(SessionStore):
+    """
+    本机多 worker 共享：每个账号一个 JSON 文件，读写都在 fcntl 文件锁内完成，
+    写入走临时文件 + os.replace。文件操作放到线程池，不阻塞事件循环。
+    """
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, name: str, suffix: str) -> str:
+        return os.path.join(self.directory, f"{name}.{suffix}")
+
+    def _locked(self, name: str, fn):
+        import fcntl
+        with open(self._path(name, "lock"), "a+") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                return fn()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read(self, path: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"读取会话存储失败 {path}: {e}")
+            return None
+
+    def _write(self, path: str, data: Dict[str, Any]):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    async def load(self, name: str) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self._locked, name, lambda: self._read(self._path(name, "json")))
+
+    async def save(self, name: str, record: Dict[str, Any]):
+        await asyncio.to_thread(self._locked, name, lambda: self._write(self._path(name, "json"), record))
+
+    async def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        def _acquire():
+            path = self._path(name, "lease")
+            lease = self._read(path) or {}
+            now = time.time()
+            if lease.get("owner") not in (None, owner) and lease.get("expires", 0) > now:
+                return False
+            self._write(path, {"owner": owner, "expires": now + ttl})
+            return True
+        return await asyncio.to_thread(self._locked, name, _acquire)
+
+    async def release_lease(self, name: str, owner: str):
+        def _release():
+            path = self._path(name, "lease")
+            if (self._read(path) or {}).get("owner") == owner:
+                os.remove(path)
+        await asyncio.to_thread(self._locked, name, _release)
+
+
+class RedisSessionStore(SessionStore):
+    """跨主机共享：记录存为 JSON 字符串，租约用 SET NX PX + 校验 owner 的脚本释放"""
+    _RELEASE_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+    _RENEW_SCRIPT = (
+        "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('pexpire', KEYS[1], ARGV[2]) end "
+        "return redis.call('set', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) and 1 or 0"
+    )
+
+    def __init__(self, url: str, prefix: str = "pplx2api"):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("SESSION_STORE=redis 需要安装 redis 包: pip install redis")
+        self._redis = redis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+
+    def _key(self, name: str, kind: str) -> str:
+        return f"{self.prefix}:{kind}:{name}"
+
+    async def load(self, name: str) -> Optional[Dict[str, Any]]:
+        raw = await self._redis.get(self._key(name, "session"))
+        return json.loads(raw) if raw else None
+
+    async def save(self, name: str, record: Dict[str, Any]):
+        await self._redis.set(self._key(name, "session"), json.dumps(record, ensure_ascii=False))
+
+    async def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        result = await self._redis.eval(self._RENEW_SCRIPT, 1, self._key(name, "lease"), owner, int(ttl * 1000))
+        return bool(result)
+
+    async def release_lease(self, name: str, owner: str):
+        await self._redis.eval(self._RELEASE_SCRIPT, 1, self._key(name, "lease"), owner)
+
+    async def close(self):
+        await self._redis.aclose()
+
+
+def create_session_store() -> SessionStore:
+    kind = settings.SESSION_STORE.lower()
+    if kind == "file":
+        logger.info(f"🗄️ 会话存储: 文件 ({settings.SESSION_STORE_DIR})")
+        return FileSessionStore(settings.SESSION_STORE_DIR)
+    if kind == "redis":
+        logger.info("🗄️ 会话存储: Redis")
+        return RedisSessionStore(settings.REDIS_URL)
+    return MemorySessionStore()
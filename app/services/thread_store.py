@@ -0,0 +1,108 @@
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from app.utils.prompt_packer import content_text
+
+# 上游 SSE 事件中标识一个 thread / entry 的字段
+THREAD_FIELDS = ("backend_uuid", "read_write_token", "frontend_context_uuid", "context_uuid", "thread_url_slug")
+
+
+def history_digest(messages: List[Dict[str, Any]]) -> "hashlib._Hash":
+    """消息历史（含 assistant 轮次）的摘要，可继续 add_to_digest 追加"""
+    digest = hashlib.sha256()
+    for message in messages:
+        add_to_digest(digest, message.get("role", ""), content_text(message.get("content")))
+    return digest
+
+
+def add_to_digest(digest: "hashlib._Hash", role: str, text: str):
+    data = f"{role}:{text.strip()}".encode("utf-8")
+    digest.update(len(data).to_bytes(8, "big"))  # 带长度前缀，消息边界不会产生歧义
+    digest.update(data)
+
+
+class ThreadState:
+    """
+    一个客户端会话在上游对应的 thread：最后一条 entry 的标识 + 所属账号，
+    以及下一轮请求应当带来的完整历史摘要（到本轮回答为止），只有完全一致时才作为追问发送。
+    """
+    __slots__ = THREAD_FIELDS + ("session_name", "turns", "history", "updated_at")
+
+    def __init__(self, ids: Dict[str, str], session_name: str, turns: int, history: str = ""):
+        for field in THREAD_FIELDS:
+            setattr(self, field, ids.get(field))
+        self.session_name = session_name
+        self.turns = turns  # 该 thread 已回答的 user 轮数
+        self.history = history
+        self.updated_at = time.time()
+
+
+class ThreadTurn:
+    """一次请求在会话中的位置：用来发送追问，并在回答完成后记录新的 thread 标识"""
+    __slots__ = ("key", "turns", "question", "thread", "digest")
+
+    def __init__(self, key: str, turns: int, question: str, thread: Optional[ThreadState] = None,
+                 digest: Optional["hashlib._Hash"] = None):
+        self.key = key
+        self.turns = turns  # 本次问题之前已有的 user 轮数
+        self.question = question
+        self.thread = thread
+        self.digest = digest  # 本次请求全部 messages 的摘要，回答完成后追加回答得到下一轮的历史摘要
+
+    def next_history(self, answer: str) -> str:
+        digest = self.digest.copy() if self.digest is not None else hashlib.sha256()
+        add_to_digest(digest, "assistant", answer)
+        return digest.hexdigest()
+
+
+class ThreadStore:
+    """
+    会话 key -> 上游 thread 的有界 LRU（带 TTL）。
+    后续轮次作为追问发送（is_related_query + last_backend_uuid），上游已有上下文，
+    不必再把历史拼进 query，也不会重新做一轮完整搜索。
+    key 由调用方按 API Key + 客户端显式给出的 conversation_id 组成；
+    取出时还要求客户端发来的历史摘要与记录的完全一致，否则视为未命中。
+    """
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._threads: "OrderedDict[str, ThreadState]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def capture(event: Dict[str, Any]) -> Optional[Dict[str, str]]:
+        """从 SSE 事件中提取 thread 标识，事件不带 backend_uuid 时返回 None"""
+        if "backend_uuid" not in event:
+            return None
+        return {field: event.get(field) for field in THREAD_FIELDS}
+
+    def get(self, key: str, history: str) -> Optional[ThreadState]:
+        state = self._threads.get(key)
+        if state is not None and time.time() - state.updated_at > self.ttl:
+            del self._threads[key]
+            state = None
+        if state is None or state.history != history:
+            self.misses += 1
+            return None
+        self._threads.move_to_end(key)
+        self.hits += 1
+        return state
+
+    def put(self, key: str, state: ThreadState):
+        self._threads[key] = state
+        self._threads.move_to_end(key)
+        while len(self._threads) > self.max_entries:
+            self._threads.popitem(last=False)
+
+    def discard(self, key: str):
+        self._threads.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "threads": len(self._threads),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,88 @@
+import time
+import httpx
+from typing import Optional, Dict, Any
+from loguru import logger
+
+from app.core.config import settings
+from app.utils import metrics
+
+
+class UpstreamClient:
+    """
+    长连接上游客户端：整个应用生命周期内共享同一个 httpx.AsyncClient，
+    依靠连接池 + HTTP/2 多路复用，避免每个请求都重新做 TCP/TLS 握手。
+    """
+    def __init__(self):
+        self._client: Optional[httpx.AsyncClient] = None
+        self.requests_total = 0
+        self.connections_opened = 0
+
+    def _build_client(self) -> httpx.AsyncClient:
+        limits = httpx.Limits(
+            max_connections=settings.UPSTREAM_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.UPSTREAM_MAX_KEEPALIVE,
+            keepalive_expiry=settings.UPSTREAM_KEEPALIVE_EXPIRY,
+        )
+        timeout = httpx.Timeout(settings.UPSTREAM_TIMEOUT, connect=settings.UPSTREAM_CONNECT_TIMEOUT)
+        return httpx.AsyncClient(http2=settings.UPSTREAM_HTTP2, limits=limits, timeout=timeout)
+
+    async def start(self):
+        if self._client is None:
+            self._client = self._build_client()
+            logger.info(
+                f"🔌 上游连接池已启动 (http2={settings.UPSTREAM_HTTP2}, "
+                f"max_connections={settings.UPSTREAM_MAX_CONNECTIONS}, "
+                f"keepalive_expiry={settings.UPSTREAM_KEEPALIVE_EXPIRY}s)"
+            )
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            logger.info("🔌 上游连接池已关闭。")
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # 未经过 lifespan 启动时（如脚本直接调用）懒加载一个
+        if self._client is None:
+            self._client = self._build_client()
+        return self._client
+
+    async def open(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """
+        发送请求并返回已收到响应头的流式响应，由调用方负责 aclose()；
+        额外挂上 trace 钩子统计新建连接数与握手耗时。
+        响应对象可以跨任务移交（对冲请求中先到者胜出）。
+        """
+        self.requests_total += 1
+        extensions = dict(kwargs.pop("extensions", None) or {})
+        extensions["trace"] = self._make_trace()
+        request = self.client.build_request(method, url, extensions=extensions, **kwargs)
+        return await self.client.send(request, stream=True)
+
+    def _make_trace(self):
+        # 每个请求一个闭包，started/complete 事件成对计时
+        started: Dict[str, float] = {}
+
+        async def trace(event_name: str, info: Dict[str, Any]):
+            # httpcore 只有在池中没有可复用连接时才会走 connect_tcp / start_tls
+            if event_name.endswith(".started"):
+                started[event_name[:-8]] = time.perf_counter()
+            elif event_name.endswith(".complete"):
+                phase = event_name[:-9]
+                if phase == "connection.connect_tcp":
+                    self.connections_opened += 1
+                if phase in ("connection.connect_tcp", "connection.start_tls") and phase in started:
+                    metrics.UPSTREAM_CONNECT.observe(
+                        time.perf_counter() - started.pop(phase), phase=phase.rsplit("_", 1)[-1]
+                    )
+
+        return trace
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests_total": self.requests_total,
+            "connections_opened": self.connections_opened,
+            "connections_reused": max(self.requests_total - self.connections_opened, 0),
+            "http2": settings.UPSTREAM_HTTP2,
+        }
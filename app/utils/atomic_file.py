@@ -0,0 +1,35 @@
+import errno
+import os
+import tempfile
+
+
+def atomic_write_text(path: str, text: str, encoding: str = "utf-8"):
+    """
+    原子写文件：先写同目录下的临时文件并 fsync，再 os.replace 覆盖目标，
+    中途崩溃只会留下旧文件或新文件，不会出现截断的半个文件。
+
+    目标是 Docker 单文件挂载（如 ./.env:/app/.env）时无法 rename 覆盖（EBUSY），
+    此时退化为原地覆盖写入并 fsync。
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "w", encoding=encoding, newline="") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            if os.path.exists(path):
+                os.chmod(tmp_path, os.stat(path).st_mode & 0o777)
+            os.replace(tmp_path, path)
+            return
+        except OSError as e:
+            if e.errno not in (errno.EBUSY, errno.EXDEV, errno.EPERM):
+                raise
+        with open(path, "w", encoding=encoding, newline="") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
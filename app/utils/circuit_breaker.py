@@ -0,0 +1,90 @@
+import math
+import time
+from typing import Any, Dict, Optional
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """熔断器处于打开状态，调用被直接拒绝"""
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"circuit '{name}' is open")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    三态熔断器：
+    - closed：正常放行，连续失败达到 failure_threshold 次后打开；
+    - open：直接拒绝，reset_timeout 秒后进入半开；
+    - half_open：只放行 half_open_max 个试探调用，成功则关闭，失败则重新打开。
+    调用方式：before_call() -> 执行 -> after_call(True/False/None)，None 表示不计入成败（如被取消）。
+    """
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float, half_open_max: int = 1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max = half_open_max
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._trials = 0
+        self.consecutive_failures = 0
+        self.opened_total = 0
+        self.rejected_total = 0
+
+    @property
+    def state(self) -> str:
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._state = HALF_OPEN
+            self._trials = 0
+        return self._state
+
+    def retry_after(self) -> float:
+        return max(self.reset_timeout - (time.monotonic() - self._opened_at), 0.0)
+
+    def allows(self) -> bool:
+        """只读检查：当前是否会放行（不占用半开试探名额）"""
+        state = self.state
+        return state == CLOSED or (state == HALF_OPEN and self._trials < self.half_open_max)
+
+    def before_call(self):
+        state = self.state
+        if state == CLOSED:
+            return
+        if state == HALF_OPEN and self._trials < self.half_open_max:
+            self._trials += 1
+            return
+        self.rejected_total += 1
+        raise CircuitOpenError(self.name, self.retry_after())
+
+    def after_call(self, success: Optional[bool]):
+        if self._state == HALF_OPEN:
+            self._trials = max(self._trials - 1, 0)
+        if success is None:
+            return
+        if success:
+            self.consecutive_failures = 0
+            self._state = CLOSED
+            return
+        self.consecutive_failures += 1
+        if self._state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            self._open()
+
+    def _open(self):
+        if self._state != OPEN:
+            self.opened_total += 1
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+
+    def stats(self) -> Dict[str, Any]:
+        state = self.state
+        return {
+            "state": state,
+            "consecutive_failures": self.consecutive_failures,
+            "opened_total": self.opened_total,
+            "rejected_total": self.rejected_total,
+            "retry_after": math.ceil(self.retry_after()) if state == OPEN else 0,
+        }
@@ -0,0 +1,57 @@
+import json
+import re
+from typing import Any, List
+
+# 可选依赖：安装 orjson 后编码走 orjson，缺失时回退到标准库。
+# 只用于编码：上游事件是很长的中文文本，实测标准库 json.loads 解析这类 str
+# 反而比 orjson 快（orjson 需要先把 str 转成 UTF-8），所以解码仍用标准库。
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps_bytes(data: Any) -> bytes:
+    """紧凑 JSON，直接返回 UTF-8 字节（不转义非 ASCII 字符）"""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def backend_name() -> str:
+    return "orjson" if orjson is not None else "json"
+
+
+class JsonTemplate:
+    """
+    预编码的 JSON 模板：文档中用 JsonTemplate.slot(name) 占位的字符串值，
+    渲染时才编码并拼接，其余固定部分只在构造时编码一次。
+    """
+    _SLOT_RE = re.compile(rb'"\{\{(\w+)\}\}"')
+
+    def __init__(self, document: Any):
+        raw = dumps_bytes(document)
+        self._parts: List[bytes] = []
+        self._slots: List[str] = []
+        start = 0
+        for match in self._SLOT_RE.finditer(raw):
+            self._parts.append(raw[start:match.start()])
+            self._slots.append(match.group(1).decode("ascii"))
+            start = match.end()
+        self._parts.append(raw[start:])
+
+    @staticmethod
+    def slot(name: str) -> str:
+        return "{{" + name + "}}"
+
+    @property
+    def slots(self) -> List[str]:
+        return list(self._slots)
+
+    def render(self, **values: Any) -> bytes:
+        parts = self._parts
+        out = [parts[0]]
+        for i, name in enumerate(self._slots, 1):
+            out.append(dumps_bytes(values[name]))
+            out.append(parts[i])
+        return b"".join(out)
@@ -0,0 +1,194 @@
+"""
+极简 Prometheus 指标注册表（文本格式 0.0.4），不依赖 prometheus_client。
+指标对象在本模块底部集中定义，各模块直接 import 使用。
+"""
+import bisect
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+PARSE_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1)
+
+# 收集器返回的指标族: (name, type, help, [(labels, value), ...])
+Family = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric(ABC):
+    type = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def _labels(self, key: Tuple[str, ...]) -> Dict[str, str]:
+        return dict(zip(self.labelnames, key))
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self._samples())
+        return lines
+
+    @abstractmethod
+    def _samples(self) -> List[str]:
+        pass
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self._labels(k))} {_format_value(v)}" for k, v in self._values.items()]
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[Tuple[str, ...], List[float]] = {}  # [各桶计数..., sum, count]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                row[index] += 1
+            row[-2] += value
+            row[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self) -> List[str]:
+        lines = []
+        for key, row in self._values.items():
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets, row):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': _format_value(float(bound))})} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': '+Inf'})} {int(row[-1])}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(float(row[-2]))}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {int(row[-1])}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], Iterable[Family]]] = []
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, help, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        metric = Gauge(name, help, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Optional[Sequence[float]] = None) -> Histogram:
+        metric = Histogram(name, help, labelnames, buckets or LATENCY_BUCKETS)
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector: Callable[[], Iterable[Family]]):
+        """抓取时才计算的指标（如队列深度、会话健康分），直接读取各组件的当前状态"""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            for name, type_, help, samples in collector():
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {type_}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# --- 请求各阶段耗时 ---
+REFRESH_WAIT = REGISTRY.histogram("pplx_refresh_wait_seconds", "Time a request spent awaiting refresh_context")
+UPSTREAM_CONNECT = REGISTRY.histogram("pplx_upstream_connect_seconds", "New upstream connection setup time", ["phase"])
+UPSTREAM_TTFB = REGISTRY.histogram("pplx_upstream_first_byte_seconds", "Time from sending the upstream request to the first body line")
+FIRST_DELTA = REGISTRY.histogram("pplx_first_delta_seconds", "Time from sending the upstream request to the first emitted delta")
+PARSE_TIME = REGISTRY.histogram("pplx_event_parse_seconds", "Parse and decode time per upstream SSE event", buckets=PARSE_BUCKETS)
+STREAM_DURATION = REGISTRY.histogram("pplx_stream_duration_seconds", "Total upstream stream duration", ["model"])
+ADMISSION_WAIT = REGISTRY.histogram("pplx_admission_wait_seconds", "Time a request waited in the admission queue")
+REFRESH_DURATION = REGISTRY.histogram("pplx_session_refresh_duration_seconds", "Browser session refresh duration")
+
+# --- 计数器 ---
+UPSTREAM_STATUS = REGISTRY.counter("pplx_upstream_responses_total", "Upstream responses by status code", ["status"])
+REFRESHES = REGISTRY.counter("pplx_session_refresh_total", "Browser session refreshes by result", ["result"])
+CF_CHALLENGES = REGISTRY.counter("pplx_cloudflare_challenges_total", "Cloudflare challenge pages encountered")
+PARSE_FAILURES = REGISTRY.counter("pplx_parse_failures_total", "Upstream SSE events that failed to parse")
+UPSTREAM_RETRIES = REGISTRY.counter("pplx_upstream_retries_total", "Upstream retries before the first delta by cause", ["reason"])
+UPSTREAM_HEDGES = REGISTRY.counter("pplx_upstream_hedges_total", "Hedged upstream requests by outcome", ["outcome"])
+MIDSTREAM_FAILURES = REGISTRY.counter("pplx_midstream_failures_total", "Upstream failures after content was already sent")
+STREAMS_CANCELLED = REGISTRY.counter("pplx_stream_cancelled_total",
+                                     "Client responses cancelled before completion", ["reason"])
+UPSTREAM_ABORTED = REGISTRY.counter("pplx_upstream_aborted_total", "Upstream streams closed before they finished")
+
+# --- 当前状态 ---
+ACTIVE_STREAMS = REGISTRY.gauge("pplx_active_streams", "Client responses currently being served", ["model"])
@@ -0,0 +1,154 @@
+import hashlib
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from app.utils.sse_utils import estimate_tokens
+
+ROLE_LABELS = {"system": "System", "user": "User", "assistant": "Assistant", "tool": "Tool"}
+SEPARATOR = "\n\n"
+
+
+def content_text(content: Any) -> str:
+    """OpenAI 消息的 content 可能是字符串或 [{"type": "text", "text": ...}, ...] 分段"""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        parts = []
+        for part in content:
+            if isinstance(part, dict) and part.get("type") == "text":
+                parts.append(part.get("text", ""))
+            elif isinstance(part, str):
+                parts.append(part)
+        return "\n".join(parts)
+    return "" if content is None else str(content)
+
+
+class _PackedHistory:
+    """一个会话已渲染好的历史轮次，fingerprints 用于确认客户端发来的历史仍是同一段"""
+    __slots__ = ("rendered", "sizes", "system", "fingerprints")
+
+    def __init__(self):
+        self.rendered: List[str] = []
+        self.sizes: List[int] = []
+        self.system: List[bool] = []
+        self.fingerprints: List[int] = []
+
+
+class PromptPacker:
+    """
+    把 messages（system / user / assistant 多轮）拼成单个 query_str：
+    - 最后一条 user 消息是问题本身，总是原样保留，从不截断；预算只约束装入多少历史；
+    - system 轮次优先保留，其余历史从最新往最旧装入，超出预算时丢弃最旧的轮次；
+    - 问题本身已经超出预算时不带任何历史，只发送问题；
+    - 只有一条 user 消息时 query 与原先完全一致。
+    每个会话缓存已渲染的历史，长会话的每一轮只需渲染新增的消息。
+    """
+    def __init__(self, max_chars: int, max_tokens: int = 0, cache_size: int = 256):
+        self.budget = max_tokens or max_chars
+        self._measure = estimate_tokens if max_tokens else len
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, _PackedHistory]" = OrderedDict()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    @staticmethod
+    def conversation_key(request_data: Dict[str, Any]) -> str:
+        """
+        优先用客户端给的 conversation_id；否则用开头到第一条 user 消息为止的摘要，
+        这部分在同一会话的后续轮次中保持不变。user 字段会被不相关的会话共用，不作为会话标识。
+        """
+        explicit = request_data.get("conversation_id")
+        if explicit:
+            return f"id:{explicit}"
+        messages = request_data.get("messages", [])
+        first_user = next((i for i, m in enumerate(messages) if m.get("role") == "user"), len(messages) - 1)
+        head = messages[:first_user + 1]
+        raw = "\x00".join(f"{m.get('role')}:{content_text(m.get('content'))}" for m in head)
+        return "h:" + hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _fingerprint(message: Dict[str, Any]) -> int:
+        return hash((message.get("role"), content_text(message.get("content"))))
+
+    def _render(self, message: Dict[str, Any]) -> str:
+        role = message.get("role", "user")
+        return f"{ROLE_LABELS.get(role, role.title())}: {content_text(message.get('content')).strip()}"
+
+    def _history(self, history: List[Dict[str, Any]], key: Optional[str]) -> _PackedHistory:
+        packed = self._cache.get(key) if key else None
+        n = len(packed.fingerprints) if packed else 0
+        # 只核对首尾两条：历史被截断或换了会话时重建；中间轮次在装入时再逐条核对
+        if packed and not (0 < n <= len(history) and
+                           packed.fingerprints[0] == self._fingerprint(history[0]) and
+                           packed.fingerprints[n - 1] == self._fingerprint(history[n - 1])):
+            packed, n = None, 0
+        if packed is None:
+            packed = _PackedHistory()
+            self.cache_misses += 1
+        else:
+            self.cache_hits += 1
+
+        for message in history[n:]:
+            text = self._render(message)
+            packed.rendered.append(text)
+            packed.sizes.append(self._measure(text) + len(SEPARATOR))
+            packed.system.append(message.get("role") == "system")
+            packed.fingerprints.append(self._fingerprint(message))
+
+        if key:
+            self._cache[key] = packed
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return packed
+
+    def pack(self, messages: List[Dict[str, Any]], conversation_key: Optional[str] = None) -> Optional[str]:
+        """返回拼好的 query；没有 user 消息时返回 None"""
+        last = next((i for i in range(len(messages) - 1, -1, -1) if messages[i].get("role") == "user"), None)
+        if last is None:
+            return None
+        question = content_text(messages[last].get("content"))
+        history = messages[:last]
+        if not history:
+            return question
+
+        question_block = f"{ROLE_LABELS['user']}: {question.strip()}"
+        remaining = self.budget - self._measure(question_block)
+        if remaining <= 0:
+            return question
+
+        packed = self._history(history, conversation_key)
+        keep = self._select(packed, remaining)
+        if any(packed.fingerprints[i] != self._fingerprint(history[i]) for i in keep):
+            # 客户端改写了中间的某一轮：丢弃缓存重新渲染
+            self._cache.pop(conversation_key, None)
+            packed = self._history(history, conversation_key)
+            keep = self._select(packed, remaining)
+
+        parts = [packed.rendered[i] for i in keep]
+        parts.append(question_block)
+        return SEPARATOR.join(parts)
+
+    @staticmethod
+    def _select(packed: _PackedHistory, remaining: int) -> List[int]:
+        """system 轮次优先，其余从最新往最旧装入，返回按原顺序排列的下标"""
+        keep = set()
+        for i, is_system in enumerate(packed.system):
+            if is_system and packed.sizes[i] <= remaining:
+                keep.add(i)
+                remaining -= packed.sizes[i]
+        for i in range(len(packed.rendered) - 1, -1, -1):
+            if packed.system[i]:
+                continue
+            if packed.sizes[i] > remaining:
+                break  # 更早的轮次一律丢弃，保证保留的是连续的最近历史
+            keep.add(i)
+            remaining -= packed.sizes[i]
+        return sorted(keep)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "conversations": len(self._cache),
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+        }
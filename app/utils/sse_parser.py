@@ -0,0 +1,143 @@
+from typing import List, Optional
+
+_CR = 0x0D
+_COLON = 0x3A
+_SPACE = 0x20
+_BOM = b"\xef\xbb\xbf"
+
+
+class SSEEvent:
+    """一个完整的 SSE 事件；data 为原始字节，可直接交给 json.loads"""
+    __slots__ = ("event", "data", "id")
+
+    def __init__(self, event: str, data: bytes, id: Optional[str]):
+        self.event = event
+        self.data = data
+        self.id = id
+
+    def __repr__(self) -> str:
+        return f"SSEEvent(event={self.event!r}, data={self.data[:60]!r}, id={self.id!r})"
+
+
+class SSEParser:
+    """
+    增量 SSE 解析器（按 WHATWG EventSource 规范），直接处理 aiter_bytes 的原始分片：
+    - 行结束符支持 LF / CRLF / 单独的 CR，分片边界可以落在任意位置；
+    - 支持多行 data（按 \\n 拼接）、event、id 字段，忽略注释行与 retry；
+    - 只在空行处交付事件，单行 data 的事件只切片一次，不解码为 str。
+    与规范的差异：流结束时若最后一个事件缺少结尾空行，flush() 仍会交付它（旧实现按行处理，同样会解析）。
+    """
+    __slots__ = ("_tail", "_pending_cr", "_started", "_head", "_data", "_event", "_last_id")
+
+    def __init__(self):
+        self._tail: List[bytes] = []  # 尚未遇到换行的行片段，攒齐一行再拼接，避免反复复制
+        self._pending_cr = False  # 上一个分片以 CR 结尾，要看下一个分片是不是 LF
+        self._started = False
+        self._head = b""  # 流开头不足 3 字节时先攒着，BOM 可能被拆在多个分片里
+        self._data: List[bytes] = []
+        self._event = ""
+        self._last_id: Optional[str] = None
+
+    def feed(self, chunk: bytes) -> List[SSEEvent]:
+        if not self._started:
+            head = self._head + chunk
+            if len(head) < len(_BOM) and _BOM.startswith(head):
+                self._head = head
+                return []
+            self._started = True
+            self._head = b""
+            chunk = head[len(_BOM):] if head.startswith(_BOM) else head
+        if self._pending_cr:
+            chunk = b"\r" + chunk
+            self._pending_cr = False
+        if b"\r" in chunk:
+            if chunk.endswith(b"\r"):
+                chunk = chunk[:-1]
+                self._pending_cr = True
+            if chunk.count(b"\r") != chunk.count(b"\r\n"):
+                # 出现单独的 CR 作为行结束符（少见）：统一换成 LF
+                chunk = chunk.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+
+        if b"\n" not in chunk:
+            if chunk:
+                self._tail.append(chunk)
+            return []
+        if self._tail:
+            self._tail.append(chunk)
+            buf = b"".join(self._tail)
+        else:
+            buf = chunk
+        events: List[SSEEvent] = []
+        start = 0
+        find = buf.find
+        while True:
+            end = find(b"\n", start)
+            if end < 0:
+                break
+            line_end = end - 1 if end > start and buf[end - 1] == _CR else end
+            if line_end == start:
+                event = self._dispatch()
+                if event is not None:
+                    events.append(event)
+            else:
+                self._field(buf, start, line_end)
+            start = end + 1
+        self._tail = [buf[start:]] if start < len(buf) else []
+        return events
+
+    def flush(self) -> List[SSEEvent]:
+        """流结束：处理没有换行的最后一行，并交付尚未遇到空行的事件"""
+        if self._head:
+            # 整个流不足 3 字节且是 BOM 的前缀：按普通内容处理
+            self._started = True
+            self._tail.append(self._head)
+            self._head = b""
+        if self._pending_cr:
+            self._pending_cr = False
+            events = self.feed(b"\n")
+        else:
+            events = []
+        if self._tail:
+            tail = b"".join(self._tail)
+            self._tail = []
+            self._field(tail, 0, len(tail))
+        event = self._dispatch()
+        if event is not None:
+            events.append(event)
+        return events
+
+    def _field(self, buf: bytes, start: int, end: int):
+        if buf.startswith(b"data:", start, end):
+            value = start + 5
+            if value < end and buf[value] == _SPACE:
+                value += 1
+            self._data.append(buf[value:end])
+            return
+        if buf[start] == _COLON:
+            return  # 注释行（常用作心跳）
+        colon = buf.find(b":", start, end)
+        if colon < 0:
+            name, value = buf[start:end], b""
+        else:
+            name = buf[start:colon]
+            value_start = colon + 1
+            if value_start < end and buf[value_start] == _SPACE:
+                value_start += 1
+            value = buf[value_start:end]
+        if name == b"event":
+            self._event = value.decode("utf-8", errors="replace")
+        elif name == b"data":
+            self._data.append(value)
+        elif name == b"id" and b"\x00" not in value:
+            self._last_id = value.decode("utf-8", errors="replace")
+        # retry 与未知字段按规范忽略
+
+    def _dispatch(self) -> Optional[SSEEvent]:
+        data = self._data
+        event_type = self._event or "message"
+        self._event = ""
+        if not data:
+            return None
+        self._data = []
+        payload = data[0] if len(data) == 1 else b"\n".join(data)
+        return SSEEvent(event_type, payload, self._last_id)
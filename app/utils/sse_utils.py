@@ -1,11 +1,13 @@
-import json
+import re
 import time
 from typing import Dict, Any, Optional
 
+from app.utils.json_utils import dumps_bytes
+
 DONE_CHUNK = b"data: [DONE]\n\n"
 
 def create_sse_data(data: Dict[str, Any]) -> bytes:
-    return f"data: {json.dumps(data, ensure_ascii=False)}\n\n".encode('utf-8')
+    return b"data: " + dumps_bytes(data) + b"\n\n"
 
 def create_chat_completion_chunk(request_id: str, model: str, content: str, finish_reason: Optional[str] = None) -> Dict[str, Any]:
     return {
@@ -14,4 +16,58 @@ def create_chat_completion_chunk(request_id: str, model: str, content: str, fini
         "created": int(time.time()),
         "model": model,
         "choices": [{"index": 0, "delta": {"content": content}, "finish_reason": finish_reason}]
-    }
\ No newline at end of file
+    }
+
+_CJK_RE = re.compile(r"[\u3000-\u9fff\uac00-\ud7af\uff00-\uffef]")
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：CJK 字符按 1 个 token，其余按 4 个字符 1 个 token"""
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+def create_chat_completion(request_id: str, model: str, content: str, prompt: str = "", finish_reason: str = "stop") -> Dict[str, Any]:
+    prompt_tokens = estimate_tokens(prompt)
+    completion_tokens = estimate_tokens(content)
+    return {
+        "id": request_id,
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": finish_reason
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
+        }
+    }
+
+class ChunkEncoder:
+    """
+    单个流的 chunk 编码器：id/object/created/model 等固定部分在构造时序列化一次，
+    之后每个增量只转义 content 字符串，再与预先渲染好的前后缀字节拼接。
+    输出与 create_sse_data(create_chat_completion_chunk(...)) 等价。
+    """
+    def __init__(self, request_id: str, model: str):
+        self.request_id = request_id
+        self.model = model
+        self.created = int(time.time())
+        head = dumps_bytes({
+            "id": request_id,
+            "object": "chat.completion.chunk",
+            "created": self.created,
+            "model": model,
+        })
+        self._prefix = b"data: " + head[:-1] + b',"choices":[{"index":0,"delta":{"content":'
+        self._suffix = b'},"finish_reason":null}]}\n\n'
+
+    def encode(self, content: str, finish_reason: Optional[str] = None) -> bytes:
+        if finish_reason is None:
+            return self._prefix + dumps_bytes(content) + self._suffix
+        return (self._prefix + dumps_bytes(content) + b'},"finish_reason":'
+                + dumps_bytes(finish_reason) + b'}]}\n\n')
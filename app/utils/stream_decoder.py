@@ -0,0 +1,265 @@
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+# 判断是否被上游改写时，只比较已输出文本的最后这么多个字符（O(1)，不做整段比较）
+_TAIL_CHECK = 32
+# 原始字符串末尾只允许出现的收尾字符（答案字符串之后的括号和空白）
+_CLOSERS = frozenset("}] \t\r\n")
+
+
+class AnswerStreamDecoder:
+    """
+    Perplexity SSE 增量解码器（每个流一个实例）。
+
+    上游每个事件都会把到目前为止的完整答案重新发一遍，旧实现每次都把所有
+    step 重新拼成完整文本再按长度求差，答案越长越慢（平方级）。这里按 step
+    维护状态：
+    - 与上一个事件完全相同的 answer/text 直接跳过；
+    - 每个 step 只记录已输出的长度和末尾片段，只输出新增部分，不再拼接全文；
+    - 追加快路径：上游通常只是在答案末尾追加文字，原始字符串除末尾的收尾
+      括号外与上一个事件逐字相同。此时只解码新增的那一小段（step 数组里的
+      FINAL 答案是两层转义，解两次），前面的 step 和已有文本都不再解析；
+    - 不满足追加条件时才完整解析，FINAL step 内嵌的 answer JSON 字符串未变化
+      时不重复解析，chunks 模式只拼接新增的 chunk。
+
+    上游改写前文时（末尾片段对不上），无法撤回已发给客户端的内容，
+    因此与旧实现一致：只继续输出超出已输出长度的部分，并计入 rewrites。
+    后面的 step 一旦开始输出，前面的 step 即视为定型，不再渲染和比较。
+    """
+    def __init__(self):
+        self._last_raw: Optional[str] = None
+        self._tail_slot = 0                    # 当前正在增长的 step 序号
+        self._emitted: List[int] = []          # 每个 step 已输出的字符数
+        self._tails: List[str] = []            # 每个 step 已输出文本的末尾片段
+        self._final_cache: Dict[int, Any] = {} # step 序号 -> (原始 answer 字符串, 渲染结果)
+        self._chunks: List[str] = []
+        self._chunks_text = ""
+        # 追加快路径：(类型, 是否 text 字段, 收尾长度, step 序号)，None 表示下个事件需完整解析
+        self._append: Optional[Tuple[str, bool, int, int]] = None
+        self.rewrites = 0
+        self.has_content = False
+
+    # --- 渲染 ---
+
+    def _render_final(self, index: int, final_answer_raw: Any) -> str:
+        cached = self._final_cache.get(index)
+        if cached is not None and cached[0] == final_answer_raw:
+            return cached[1]
+
+        if isinstance(final_answer_raw, str):
+            try:
+                final_obj = json.loads(final_answer_raw)
+                text = final_obj["answer"] if isinstance(final_obj, dict) and "answer" in final_obj else ""
+            except Exception:
+                text = final_answer_raw
+        else:
+            text = str(final_answer_raw)
+
+        self._final_cache[index] = (final_answer_raw, text)
+        return text
+
+    def _render_steps(self, steps: List[Dict[str, Any]], final_only: bool) -> List[Optional[str]]:
+        slots: List[Optional[str]] = []
+        for index, step in enumerate(steps):
+            if index < self._tail_slot:
+                # 后面的 step 已经开始输出，前面的 step 已定型，不再渲染
+                slots.append(None)
+                continue
+
+            step_type = step.get("step_type")
+            content = step.get("content", {})
+
+            if step_type == "SEARCH_WEB" and not final_only:
+                queries = content.get("queries", [])
+                q_str = ", ".join([q["query"] for q in queries])
+                slots.append(f"> 🔍 正在搜索: {q_str}\n\n")
+
+            elif step_type == "SEARCH_RESULTS" and not final_only:
+                results = content.get("web_results", [])
+                slots.append(f"> 📚 找到 {len(results)} 个来源\n\n" if results else "")
+
+            elif step_type == "FINAL":
+                final_answer_raw = content.get("answer")
+                if final_only and not isinstance(final_answer_raw, str):
+                    slots.append("")
+                else:
+                    slots.append(self._render_final(index, final_answer_raw))
+
+            else:
+                slots.append("")
+        return slots
+
+    def _render_chunks(self, chunks: List[str]) -> str:
+        seen = len(self._chunks)
+        if len(chunks) >= seen and chunks[seen - 1:seen] == self._chunks[seen - 1:seen]:
+            # 追加模式：只拼接新增的 chunk
+            new_chunks = chunks[seen:]
+            if new_chunks:
+                self._chunks_text += "".join(new_chunks)
+                self._chunks.extend(new_chunks)
+        else:
+            self._chunks = list(chunks)
+            self._chunks_text = "".join(chunks)
+        return self._chunks_text
+
+    def _render(self, raw: Any, is_text: bool) -> Optional[List[str]]:
+        if not isinstance(raw, str):
+            return None
+        stripped = raw.lstrip()
+        try:
+            if stripped.startswith("["):
+                steps = json.loads(raw)
+                slots = self._render_steps(steps, final_only=is_text)
+                self._plan_steps(raw, steps, is_text)
+                return slots
+            if stripped.startswith("{"):
+                inner = json.loads(raw)
+                if "answer" in inner:
+                    if isinstance(inner["answer"], str) and list(inner)[-1] == "answer":
+                        self._plan(raw, "answer", is_text, raw.rfind('"'), 0)
+                    return [inner["answer"]]
+                if is_text and "chunks" in inner:
+                    if inner["chunks"] and list(inner)[-1] == "chunks":
+                        self._plan(raw, "chunks", is_text, raw.rfind("]"), 0)
+                    return [self._render_chunks(inner["chunks"])]
+                return None
+        except Exception:
+            pass
+        if not stripped.startswith(("[", "{")):
+            # 纯文本答案：追加即新增内容本身，无需解码
+            self._plan(raw, "plain", is_text, len(raw), 0)
+        return [raw]
+
+    # --- 追加快路径 ---
+
+    def _plan(self, raw: str, kind: str, is_text: bool, close: int, index: int, back: int = 0):
+        """记录下个事件可以走快路径的位置：close 之后只能是收尾字符，追加点在 close 之前 back 个字符"""
+        cut = close - back
+        if cut > 0 and _CLOSERS.issuperset(raw[close + 1:]):
+            self._append = (kind, is_text, len(raw) - cut, index)
+
+    def _plan_steps(self, raw: str, steps: Any, is_text: bool):
+        # 只有最后一个 step 是 FINAL、且 answer 是它最后一个字符串时，追加才一定落在答案里
+        if not isinstance(steps, list) or not steps:
+            return
+        index = len(steps) - 1
+        step = steps[index]
+        if not isinstance(step, dict) or step.get("step_type") != "FINAL" or list(step)[-1] != "content":
+            return
+        content = step["content"]
+        if not isinstance(content, dict) or not content or list(content)[-1] != "answer":
+            return
+        answer = content["answer"]
+        if not isinstance(answer, str):
+            return
+        try:
+            final_obj = json.loads(answer)
+        except Exception:
+            return
+        if not isinstance(final_obj, dict) or not final_obj or list(final_obj)[-1] != "answer":
+            return
+        quote = raw.rfind('"')
+        # 内层 JSON 以 "} 结尾，在外层字符串里转义成 \"}，追加点在它之前
+        if raw[quote - 3:quote] == '\\"}':
+            self._plan(raw, "steps", is_text, quote, index, back=3)
+
+    def _feed_append(self, prev: str, raw: str, is_text: bool) -> Optional[str]:
+        """raw 只是在 prev 的追加点插入了新内容时，只解码新增片段；否则返回 None"""
+        kind, plan_is_text, tail_len, index = self._append
+        cut = len(prev) - tail_len
+        end = len(raw) - tail_len
+        if plan_is_text != is_text or end <= cut or raw[end:] != prev[cut:] or raw[:cut] != prev[:cut]:
+            return None
+
+        fragment = raw[cut:end]
+        try:
+            if kind == "plain":
+                text = fragment
+            elif kind == "chunks":
+                # 片段形如 , "a", "b"，借一个占位元素拼成合法数组
+                new_chunks = json.loads("[0" + fragment + "]")[1:]
+                if not all(isinstance(chunk, str) for chunk in new_chunks):
+                    return None
+                text = "".join(new_chunks)
+            else:
+                # 片段里出现未转义的引号（结构变化）会解析失败，从而回退到完整解析
+                text = json.loads('"' + fragment + '"')
+                if kind == "steps":
+                    text = json.loads('"' + text + '"')
+        except Exception:
+            return None
+
+        if kind == "chunks":
+            # chunk 缓存已过期，下次完整解析时重建
+            self._chunks = []
+            self._chunks_text = ""
+        if text:
+            self._emitted[index] += len(text)
+            self._tails[index] = (self._tails[index] + text)[-_TAIL_CHECK:]
+            self._tail_slot = index
+        return text
+
+    # --- 增量 ---
+
+    def _diff(self, slots: List[Optional[str]]) -> str:
+        while len(self._emitted) < len(slots):
+            self._emitted.append(0)
+            self._tails.append("")
+
+        parts = []
+        for index in range(self._tail_slot, len(slots)):
+            text = slots[index]
+            if text is None:
+                continue
+            emitted = self._emitted[index]
+            if emitted and text[max(emitted - _TAIL_CHECK, 0):emitted] != self._tails[index]:
+                self.rewrites += 1
+                self._tails[index] = text[max(emitted - _TAIL_CHECK, 0):emitted]
+
+            if len(text) <= emitted:
+                continue
+
+            parts.append(text[emitted:])
+            self._emitted[index] = len(text)
+            self._tails[index] = text[max(len(text) - _TAIL_CHECK, 0):]
+            self._tail_slot = index
+
+        return "".join(parts)
+
+    def feed(self, data: Dict[str, Any]) -> str:
+        """喂入一个已解析的上游事件，返回需要发给客户端的增量文本（可能为空）"""
+        if "answer" in data:
+            raw, is_text = data["answer"], False
+        elif "text" in data:
+            raw, is_text = data["text"], True
+        else:
+            return ""
+
+        if raw == self._last_raw:
+            return ""
+        prev = self._last_raw
+        self._last_raw = raw if isinstance(raw, str) else None
+
+        if self._append is not None:
+            if prev is not None and self._last_raw is not None:
+                delta = self._feed_append(prev, raw, is_text)
+                if delta is not None:
+                    if delta:
+                        self.has_content = True
+                    return delta
+            self._append = None
+
+        slots = self._render(raw, is_text)
+        if not slots:
+            self._append = None
+            return ""
+
+        delta = self._diff(slots)
+        if self._append is not None:
+            index = self._append[3]
+            # 快路径假定该 step 之前的内容都已输出完毕
+            if index >= len(slots) or slots[index] is None or self._emitted[index] != len(slots[index]):
+                self._append = None
+        if delta:
+            self.has_content = True
+        return delta
@@ -0,0 +1,89 @@
+"""
+上游请求构造开销基准 (µs / 请求)：对比
+- legacy：每次 _build_payload 生成 dict，build_request(json=...) 整体编码，另行组装请求头并传入 cookies；
+- template：预编码的 JSON 模板只编码变化的字段，请求头（含 Cookie）复用缓存，build_request(content=...)。
+两种方式生成的请求体按 JSON 比较必须一致。
+
+用法（在项目根目录）:
+    python -m benchmarks.bench_request_build
+"""
+import json
+import time
+from typing import Callable, Dict
+
+import httpx
+
+from app.core.config import settings
+from app.providers.perplexity_provider import PerplexityProvider
+from app.services.browser_service import BrowserService
+from app.services.thread_store import ThreadState
+
+ROUNDS = 20_000
+COOKIES = {
+    "pplx.visitor-id": "0b5c3f8e-1d2a-4c4e-9a77-6f0e2b1d9c11",
+    "__cf_bm": "x" * 160,
+    "cf_clearance": "y" * 300,
+    "pplx.session-id": "3f1c2b7a-9e8d-4f6a-b5c4-2d1e0f9a8b7c",
+}
+QUERY = "用三句话解释一下 HTTP/2 的多路复用，以及它和 HTTP/1.1 管线化的区别。" * 4
+
+
+def _provider() -> PerplexityProvider:
+    provider = PerplexityProvider.__new__(PerplexityProvider)
+    PerplexityProvider.__init__(provider)
+    return provider
+
+
+def _service() -> BrowserService:
+    service = BrowserService.__new__(BrowserService)
+    BrowserService.__init__(service)
+    service.cached_cookies = dict(COOKIES)
+    service.cached_user_agent = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 Chrome/131.0 Safari/537.36"
+    return service
+
+
+def _time(fn: Callable[[], httpx.Request]) -> float:
+    best = float("inf")
+    for _ in range(3):
+        start = time.perf_counter()
+        for _ in range(ROUNDS):
+            fn()
+        best = min(best, time.perf_counter() - start)
+    return best / ROUNDS * 1e6
+
+
+def main():
+    provider, service = _provider(), _service()
+    client = httpx.Client()
+    thread = ThreadState({"backend_uuid": "be-1", "read_write_token": "rw-1", "frontend_context_uuid": "fc-1"},
+                         "default", 1)
+    # 旧版每次都重新组装的请求头（不含 Cookie，Cookie 通过 cookies= 传入）
+    legacy_headers: Callable[[], Dict[str, str]] = lambda: {
+        k: v for k, v in service._build_headers().items() if k != "Cookie"
+    }
+
+    print(f"{'scenario':<10}{'legacy µs':>11}{'template µs':>13}{'speedup':>9}")
+    for name, th in (("fresh", None), ("followup", thread)):
+        def legacy() -> httpx.Request:
+            headers = legacy_headers()
+            headers["x-request-id"] = "req-1"
+            return client.build_request("POST", settings.API_URL, json=provider._build_payload(QUERY, "pplx_pro", th),
+                                        headers=headers, cookies=service.cached_cookies)
+
+        def template() -> httpx.Request:
+            headers = {**service.get_headers(), "x-request-id": "req-1"}
+            return client.build_request("POST", settings.API_URL,
+                                        content=provider._encode_payload(QUERY, "pplx_pro", th), headers=headers)
+
+        old, new = json.loads(legacy().content), json.loads(template().content)
+        new["params"]["frontend_uuid"] = old["params"]["frontend_uuid"]
+        assert old == new, f"{name}: 请求体不一致"
+        assert template().headers["cookie"] == legacy().headers["cookie"], f"{name}: Cookie 不一致"
+
+        legacy_us, template_us = _time(legacy), _time(template)
+        print(f"{name:<10}{legacy_us:>11.1f}{template_us:>13.1f}{legacy_us / template_us:>8.2f}x")
+    client.close()
+
+
+if __name__ == "__main__":
+    main()
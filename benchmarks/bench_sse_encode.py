@@ -0,0 +1,63 @@
+"""
+下行 SSE 编码基准：对比旧路径（每个增量新建 dict + json.dumps）与 ChunkEncoder
+（预渲染前后缀，只转义 content），分别在 orjson 与标准库后端下测量。
+
+用法（在项目根目录）:
+    python -m benchmarks.bench_sse_encode
+"""
+import json
+import time
+from typing import Callable, List
+
+from app.utils import json_utils
+from app.utils.sse_utils import ChunkEncoder, create_chat_completion_chunk
+
+N_CHUNKS = 200_000
+DELTAS = ["Perplexity ", "会先联网搜索，", "then answers ", "with \"citations\"", "[1]。\n"]
+
+
+def legacy_encode(deltas: List[str]) -> int:
+    """基线实现：改动前 create_sse_data 的写法"""
+    total = 0
+    for delta in deltas:
+        chunk = create_chat_completion_chunk("req-bench", "sonar-pro", delta)
+        total += len(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+    return total
+
+
+def encoder_encode(deltas: List[str]) -> int:
+    encoder = ChunkEncoder("req-bench", "sonar-pro")
+    total = 0
+    for delta in deltas:
+        total += len(encoder.encode(delta))
+    return total
+
+
+def _rate(fn: Callable, deltas: List[str]) -> float:
+    start = time.perf_counter()
+    fn(deltas)
+    return len(deltas) / (time.perf_counter() - start)
+
+
+def main():
+    deltas = (DELTAS * (N_CHUNKS // len(DELTAS) + 1))[:N_CHUNKS]
+    baseline = _rate(legacy_encode, deltas)
+    print(f"{'path':<28}{'chunks/s':>14}{'speedup':>10}")
+    print(f"{'dict + json.dumps (old)':<28}{baseline:>14,.0f}{1.0:>9.1f}x")
+
+    backends = [("ChunkEncoder + orjson", json_utils.orjson), ("ChunkEncoder + json", None)]
+    saved = json_utils.orjson
+    try:
+        for label, backend in backends:
+            if label.endswith("orjson") and backend is None:
+                print(f"{label:<28}{'(orjson 未安装)':>14}")
+                continue
+            json_utils.orjson = backend
+            rate = _rate(encoder_encode, deltas)
+            print(f"{label:<28}{rate:>14,.0f}{rate / baseline:>9.1f}x")
+    finally:
+        json_utils.orjson = saved
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+SSE 解析吞吐基准 (MB/s)：把录制流切成不同大小的字节分片，对比
+- legacy：httpx aiter_lines 的解码 + 分行，再 strip / startswith / 切片 / strip 后 json.loads(str)；
+- parser：SSEParser 直接处理字节分片，json.loads(bytes)。
+framing 列只计分帧（不含 json.loads），full 列包含 JSON 解析，与线上路径一致。
+
+用法（在项目根目录）:
+    python -m benchmarks.bench_sse_parser
+"""
+import json
+import time
+from typing import Callable, List
+
+from httpx._decoders import LineDecoder, TextDecoder
+
+from app.utils.sse_parser import SSEParser
+from benchmarks import recorded_streams as rs
+
+CHUNK_SIZES = [256, 4096, 65536]
+CHARS = 20_000
+
+
+def _split(raw: bytes, size: int) -> List[bytes]:
+    return [raw[i:i + size] for i in range(0, len(raw), size)]
+
+
+def legacy_frames(chunks: List[bytes], parse: bool) -> int:
+    """与旧版 stream_generator 一致：aiter_lines 产出的 str 行逐行处理"""
+    text_decoder, line_decoder = TextDecoder(), LineDecoder()
+    count = 0
+
+    def handle(line: str):
+        nonlocal count
+        line_str = line.strip()
+        if not line_str or not line_str.startswith("data: "):
+            return
+        json_str = line_str[6:].strip()
+        if json_str == "[DONE]":
+            return
+        if parse:
+            json.loads(json_str)
+        count += 1
+
+    for chunk in chunks:
+        for line in line_decoder.decode(text_decoder.decode(chunk)):
+            handle(line)
+    for line in line_decoder.decode(text_decoder.flush()):
+        handle(line)
+    for line in line_decoder.flush():
+        handle(line)
+    return count
+
+
+def parser_frames(chunks: List[bytes], parse: bool) -> int:
+    parser = SSEParser()
+    count = 0
+    for chunk in chunks:
+        for event in parser.feed(chunk):
+            if parse:
+                json.loads(event.data)
+            count += 1
+    for event in parser.flush():
+        if parse:
+            json.loads(event.data)
+        count += 1
+    return count
+
+
+def _mb_per_s(fn: Callable, chunks: List[bytes], parse: bool, total: int, repeat: int = 5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(chunks, parse)
+        best = min(best, time.perf_counter() - start)
+    return total / best / 1e6
+
+
+def main():
+    scenarios = {
+        "answer_steps": rs.answer_steps_events,
+        "text_chunks": rs.text_chunks_events,
+    }
+    print(f"{'scenario':<14}{'chunk':>7}{'MB':>7}"
+          f"{'framing legacy':>16}{'parser':>9}{'full legacy':>13}{'parser':>9}{'speedup':>9}")
+    for name, factory in scenarios.items():
+        raw = rs.to_sse_bytes(factory(CHARS))
+        for size in CHUNK_SIZES:
+            chunks = _split(raw, size)
+            assert legacy_frames(chunks, True) == parser_frames(chunks, True), f"{name}/{size}: 事件数不一致"
+            frame_legacy = _mb_per_s(legacy_frames, chunks, False, len(raw))
+            frame_new = _mb_per_s(parser_frames, chunks, False, len(raw))
+            full_legacy = _mb_per_s(legacy_frames, chunks, True, len(raw))
+            full_new = _mb_per_s(parser_frames, chunks, True, len(raw))
+            print(f"{name:<14}{size:>7}{len(raw) / 1e6:>7.1f}{frame_legacy:>16.0f}{frame_new:>9.0f}"
+                  f"{full_legacy:>13.0f}{full_new:>9.0f}{full_new / full_legacy:>8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+增量解码基准：回放不同长度的录制流，对比旧的“每个事件重建全文 + 按长度求差”
+实现与 AnswerStreamDecoder。
+
+用法（在项目根目录）:
+    python -m benchmarks.bench_stream_decoder
+"""
+import json
+import time
+from typing import Any, Dict, List, Callable, Iterator
+
+from app.utils.stream_decoder import AnswerStreamDecoder
+from benchmarks import recorded_streams as rs
+
+LENGTHS = [1_000, 5_000, 20_000, 50_000]
+
+
+def _iter_events(lines: List[str]) -> Iterator[Dict[str, Any]]:
+    """与 stream_generator 相同的 data 行处理，两种实现共用"""
+    for line in lines:
+        line_str = line.strip()
+        if not line_str or not line_str.startswith("data: "):
+            continue
+        yield json.loads(line_str[6:].strip())
+
+
+def legacy_decode(lines: List[str]) -> str:
+    """旧版 stream_generator 中的解析逻辑（原样保留，仅用于对比）"""
+    out = []
+    last_full_text = ""
+    for data in _iter_events(lines):
+        current_full_text = ""
+        if "answer" in data:
+            raw_answer = data["answer"]
+            try:
+                if isinstance(raw_answer, str) and raw_answer.strip().startswith("["):
+                    steps = json.loads(raw_answer)
+                    for step in steps:
+                        step_type = step.get("step_type")
+                        content = step.get("content", {})
+                        if step_type == "SEARCH_WEB":
+                            queries = content.get("queries", [])
+                            q_str = ", ".join([q["query"] for q in queries])
+                            current_full_text += f"> 🔍 正在搜索: {q_str}\n\n"
+                        elif step_type == "SEARCH_RESULTS":
+                            results = content.get("web_results", [])
+                            if results:
+                                current_full_text += f"> 📚 找到 {len(results)} 个来源\n\n"
+                        elif step_type == "FINAL":
+                            final_answer_raw = content.get("answer")
+                            if isinstance(final_answer_raw, str):
+                                try:
+                                    final_obj = json.loads(final_answer_raw)
+                                    if "answer" in final_obj:
+                                        current_full_text += final_obj["answer"]
+                                except Exception:
+                                    current_full_text += final_answer_raw
+                            else:
+                                current_full_text += str(final_answer_raw)
+                elif isinstance(raw_answer, str) and raw_answer.strip().startswith("{"):
+                    inner_data = json.loads(raw_answer)
+                    if "answer" in inner_data:
+                        current_full_text = inner_data["answer"]
+                else:
+                    current_full_text = raw_answer
+            except Exception:
+                current_full_text = raw_answer
+        elif "text" in data:
+            raw_text = data["text"]
+            try:
+                if isinstance(raw_text, str) and raw_text.strip().startswith("{"):
+                    inner_data = json.loads(raw_text)
+                    if "answer" in inner_data:
+                        current_full_text = inner_data["answer"]
+                    elif "chunks" in inner_data:
+                        current_full_text = "".join(inner_data["chunks"])
+                else:
+                    current_full_text = raw_text
+            except Exception:
+                current_full_text = raw_text
+
+        if current_full_text and len(current_full_text) > len(last_full_text):
+            out.append(current_full_text[len(last_full_text):])
+            last_full_text = current_full_text
+    return "".join(out)
+
+
+def new_decode(lines: List[str]) -> str:
+    decoder = AnswerStreamDecoder()
+    return "".join(decoder.feed(data) for data in _iter_events(lines))
+
+
+def _time(fn: Callable, lines, repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(lines)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    # 回放完整的 SSE 行：两种实现都包含 data 行的 json.loads，与线上路径一致
+    scenarios = {
+        "answer_steps": rs.answer_steps_events,
+        "text_chunks": rs.text_chunks_events,
+        "plain_answer": rs.plain_answer_events,
+    }
+    print(f"{'scenario':<14}{'chars':>8}{'events':>8}{'legacy ms':>12}{'decoder ms':>12}{'speedup':>9}")
+    for name, factory in scenarios.items():
+        for n in LENGTHS:
+            events = factory(n)
+            lines = rs.to_sse_lines(events)
+            assert legacy_decode(lines) == new_decode(lines), f"{name}/{n}: 输出不一致"
+            legacy = _time(legacy_decode, lines)
+            new = _time(new_decode, lines)
+            print(f"{name:<14}{n:>8}{len(events):>8}{legacy * 1000:>12.2f}{new * 1000:>12.2f}{legacy / new:>8.1f}x")
+
+    decoder = AnswerStreamDecoder()
+    for data in rs.rewrite_events(2_000):
+        decoder.feed(data)
+    print(f"rewrite stream: rewrites detected = {decoder.rewrites}")
+
+
+if __name__ == "__main__":
+    main()
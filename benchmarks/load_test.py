@@ -0,0 +1,229 @@
+"""
+端到端压测：按不同并发度驱动 /v1/chat/completions（流式），统计
+首 token 延迟 p50/p99、吞吐（token/s）以及每个流摊到的服务端 CPU 与内存。
+
+CPU / 内存从 /proc/<pid> 读取，因此只支持 Linux，且需要知道代理进程的 pid：
+--spawn 时由本脚本启动 mock 上游和代理（单 worker），自动取得 pid；
+连接已有代理时用 --server-pid 指定（多 worker 时只统计该进程）。
+
+用法（在项目根目录）:
+    python -m benchmarks.load_test --spawn --concurrency 1,8,32,64
+    python -m benchmarks.load_test --url http://127.0.0.1:8000 --server-pid 12345
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from app.utils.sse_utils import estimate_tokens
+
+CLK_TCK = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+def _cpu_seconds(pid: int) -> float:
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / CLK_TCK  # utime + stime
+
+
+def _rss_bytes(pid: int) -> int:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def _one_request(client: httpx.AsyncClient, model: str, query: str) -> Dict[str, Any]:
+    payload = {"model": model, "stream": True, "messages": [{"role": "user", "content": query}]}
+    start = time.perf_counter()
+    first_token = None
+    parts: List[str] = []
+    status = 0
+    try:
+        async with client.stream("POST", "/v1/chat/completions", json=payload) as response:
+            status = response.status_code
+            async for line in response.aiter_lines():
+                if not line.startswith("data: ") or line == "data: [DONE]":
+                    continue
+                delta = json.loads(line[6:])["choices"][0]["delta"].get("content")
+                if delta:
+                    if first_token is None:
+                        first_token = time.perf_counter()
+                    parts.append(delta)
+    except httpx.HTTPError as e:
+        return {"ok": False, "error": type(e).__name__}
+    end = time.perf_counter()
+    content = "".join(parts)
+    ok = status == 200 and first_token is not None and not content.startswith("[Error")
+    return {
+        "ok": ok,
+        "error": None if ok else f"status {status}",
+        "ttft": (first_token - start) if first_token else None,
+        "duration": end - start,
+        "tokens": estimate_tokens(content),
+    }
+
+
+async def _sample_rss(pid: int, peak: List[int], stop: asyncio.Event):
+    while not stop.is_set():
+        peak[0] = max(peak[0], _rss_bytes(pid))
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=0.05)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run_level(url: str, api_key: str, model: str, concurrency: int, requests_per_worker: int,
+                    pid: Optional[int]) -> Dict[str, Any]:
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    headers = {"Authorization": f"Bearer {api_key}"}
+    async with httpx.AsyncClient(base_url=url, headers=headers, limits=limits, timeout=300) as client:
+        async def worker(wid: int) -> List[Dict[str, Any]]:
+            results = []
+            for i in range(requests_per_worker):
+                # 每个请求的 query 都不同，避免被回答缓存 / 请求合并吸收
+                results.append(await _one_request(client, model, f"bench {wid}-{i} {uuid.uuid4().hex[:8]}"))
+            return results
+
+        cpu_before = _cpu_seconds(pid) if pid else 0.0
+        rss_before = _rss_bytes(pid) if pid else 0
+        peak, stop = [rss_before], asyncio.Event()
+        sampler = asyncio.create_task(_sample_rss(pid, peak, stop)) if pid else None
+
+        wall_start = time.perf_counter()
+        batches = await asyncio.gather(*(worker(w) for w in range(concurrency)))
+        wall = time.perf_counter() - wall_start
+
+        stop.set()
+        if sampler is not None:
+            await sampler
+        cpu = (_cpu_seconds(pid) - cpu_before) if pid else None
+
+    results = [r for batch in batches for r in batch]
+    ok = [r for r in results if r["ok"]]
+    ttfts = [r["ttft"] for r in ok]
+    tokens = sum(r["tokens"] for r in ok)
+    stream_rates = [r["tokens"] / (r["duration"] - r["ttft"]) for r in ok if r["duration"] > r["ttft"]]
+    return {
+        "concurrency": concurrency,
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        "ttft_p50": _percentile(ttfts, 50),
+        "ttft_p99": _percentile(ttfts, 99),
+        "tokens_per_s": tokens / wall if wall else 0.0,
+        "stream_tokens_per_s": statistics.mean(stream_rates) if stream_rates else 0.0,
+        "cpu_ms_per_stream": cpu * 1000 / len(results) if cpu is not None and results else None,
+        "mem_kb_per_stream": (peak[0] - rss_before) / 1024 / concurrency if pid else None,
+    }
+
+
+def _print_report(rows: List[Dict[str, Any]]):
+    header = f"{'conc':>5}{'reqs':>6}{'err':>5}{'ttft p50':>10}{'ttft p99':>10}{'tok/s':>10}{'tok/s/stream':>14}{'cpu ms/str':>12}{'mem KB/str':>12}"
+    print(header)
+    for r in rows:
+        cpu = f"{r['cpu_ms_per_stream']:.1f}" if r["cpu_ms_per_stream"] is not None else "-"
+        mem = f"{r['mem_kb_per_stream']:.0f}" if r["mem_kb_per_stream"] is not None else "-"
+        print(f"{r['concurrency']:>5}{r['requests']:>6}{r['errors']:>5}"
+              f"{r['ttft_p50'] * 1000:>8.0f}ms{r['ttft_p99'] * 1000:>8.0f}ms"
+              f"{r['tokens_per_s']:>10.0f}{r['stream_tokens_per_s']:>14.1f}{cpu:>12}{mem:>12}")
+
+
+def _wait_ready(url: str, timeout: float = 60.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(url, timeout=1).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.3)
+    raise RuntimeError(f"{url} 未在 {timeout:.0f}s 内就绪")
+
+
+def _spawn(args) -> List[subprocess.Popen]:
+    """启动 mock 上游和单 worker 代理，代理的上游与浏览器目标都指向 mock"""
+    mock_url = f"http://127.0.0.1:{args.mock_port}"
+    mock = subprocess.Popen([
+        sys.executable, "-m", "benchmarks.mock_upstream", "--port", str(args.mock_port),
+        "--token-rate", str(args.token_rate), "--chars", str(args.chars), "--format", args.format,
+    ])
+    max_conc = max(args.concurrency)
+    env = {
+        **os.environ,
+        "API_URL": f"{mock_url}/rest/sse/perplexity_ask",
+        "TARGET_URL": mock_url,
+        "PPLX_COOKIE": "pplx.visitor-id=bench",
+        "PPLX_ACCOUNTS_FILE": "",
+        "API_MASTER_KEY": args.api_key,
+        "CACHE_ENABLED": "false",
+        "LOG_LEVEL": "WARNING",
+        "ADMISSION_MAX_INFLIGHT": str(max_conc),
+        "ADMISSION_PER_KEY_LIMIT": "0",
+        "UPSTREAM_MAX_CONNECTIONS": str(max_conc),
+        "UPSTREAM_MAX_KEEPALIVE": str(max_conc),
+    }
+    port = args.url.rsplit(":", 1)[-1].strip("/")
+    proxy = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", port, "--workers", "1",
+         "--log-level", "warning", "--no-access-log"],
+        env=env,
+    )
+    _wait_ready(f"{mock_url}/mock/stats")
+    _wait_ready(f"{args.url}/v1/models")
+    return [mock, proxy]
+
+
+async def _main(args):
+    pid = args.server_pid
+    processes: List[subprocess.Popen] = []
+    if args.spawn:
+        processes = _spawn(args)
+        pid = processes[1].pid
+    try:
+        # 预热：建立上游连接、完成会话初始化
+        await run_level(args.url, args.api_key, args.model, 1, 1, None)
+        rows = []
+        for concurrency in args.concurrency:
+            rows.append(await run_level(args.url, args.api_key, args.model, concurrency, args.requests, pid))
+        _print_report(rows)
+    finally:
+        for p in reversed(processes):
+            p.terminate()
+            p.wait(timeout=10)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end load test for /v1/chat/completions")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--api-key", default="1")
+    parser.add_argument("--model", default="sonar-pro")
+    parser.add_argument("--concurrency", type=lambda s: [int(x) for x in s.split(",")], default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=4, help="每个并发 worker 依次发送的请求数")
+    parser.add_argument("--server-pid", type=int, default=None, help="代理进程 pid，用于统计 CPU / 内存")
+    parser.add_argument("--spawn", action="store_true", help="自动启动 mock 上游与代理")
+    parser.add_argument("--mock-port", type=int, default=8766)
+    parser.add_argument("--token-rate", type=float, default=60.0)
+    parser.add_argument("--chars", type=int, default=2000)
+    parser.add_argument("--format", default="answer")
+    asyncio.run(_main(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+本地 mock 上游：按可配置的 token 速率回放 perplexity_ask 录制流，用于在不访问
+perplexity.ai 的情况下压测代理。把代理的 API_URL / TARGET_URL 指向这里即可。
+
+query 中包含以下标记时模拟对应的异常：
+    [403]    直接返回 403（Cloudflare / 会话失效）
+    [500]    直接返回 500
+    [error]  流中途返回 status=FAILED 的错误事件后结束
+    [abort]  流中途直接断开连接
+也可以用 --forbidden-rate / --error-rate 按比例随机注入。
+
+GET / 返回一个设置 pplx.visitor-id 的页面，代理的浏览器刷新也能在本地完成。
+
+用法（在项目根目录）:
+    python -m benchmarks.mock_upstream --port 8766 --token-rate 60 --chars 2000 --format answer
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from typing import Any, Dict, List
+
+from fastapi import FastAPI, Request
+from fastapi.responses import HTMLResponse, Response, StreamingResponse
+
+from app.utils.sse_utils import estimate_tokens
+from benchmarks import recorded_streams as rs
+
+FORMATS = {
+    "answer": rs.answer_steps_events,
+    "text": rs.text_chunks_events,
+    "plain": rs.plain_answer_events,
+    "rewrite": rs.rewrite_events,
+}
+
+
+def _event_text(event: Dict[str, Any]) -> str:
+    """事件中携带的全文（只用于估算 token 数，不追求精确）"""
+    if "text" in event:
+        return "".join(json.loads(event["text"])["chunks"])
+    answer = event.get("answer", "")
+    if answer.startswith("["):
+        for step in json.loads(answer):
+            if step.get("step_type") == "FINAL":
+                return json.loads(step["content"]["answer"])["answer"]
+        return ""
+    return answer
+
+
+def _delays(events: List[Dict[str, Any]], token_rate: float) -> List[float]:
+    """按每个事件新增的 token 数换算出发送前的等待时间"""
+    if token_rate <= 0:
+        return [0.0] * len(events)
+    delays, previous = [], 0
+    for event in events:
+        tokens = estimate_tokens(_event_text(event))
+        delays.append(max(tokens - previous, 0) / token_rate)
+        previous = tokens
+    return delays
+
+
+def create_app(fmt: str = "answer", chars: int = 2000, chunk_chars: int = 24, token_rate: float = 60.0,
+               ttfb: float = 0.3, forbidden_rate: float = 0.0, error_rate: float = 0.0) -> FastAPI:
+    app = FastAPI(title="mock perplexity upstream")
+    stats = {"requests": 0, "forbidden": 0, "errors": 0, "completed": 0, "active": 0}
+
+    # 同一份流的事件结构与节奏每次都一样，预先编码好，压测时 mock 本身不成为瓶颈
+    template_events = FORMATS[fmt](chars, chunk_chars)
+    template_delays = _delays(template_events, token_rate)
+
+    @app.get("/", response_class=HTMLResponse)
+    async def home():
+        response = HTMLResponse("<html><head><title>Perplexity (mock)</title></head><body>ok</body></html>")
+        response.set_cookie("pplx.visitor-id", f"mock-{int(time.time())}")
+        return response
+
+    @app.get("/mock/stats")
+    async def mock_stats():
+        return stats
+
+    @app.post("/rest/sse/perplexity_ask")
+    async def ask(request: Request):
+        body = await request.json()
+        query = body.get("query_str", "")
+        stats["requests"] += 1
+
+        if "[403]" in query or random.random() < forbidden_rate:
+            stats["forbidden"] += 1
+            return Response("<html><title>Just a moment...</title></html>", status_code=403)
+        if "[500]" in query:
+            stats["errors"] += 1
+            return Response("internal error", status_code=500)
+
+        fail_at = None
+        if "[error]" in query or "[abort]" in query or random.random() < error_rate:
+            fail_at = len(template_events) // 2
+        abort = "[abort]" in query
+
+        async def generate():
+            stats["active"] += 1
+            try:
+                await asyncio.sleep(ttfb)
+                for i, (event, delay) in enumerate(zip(template_events, template_delays)):
+                    if fail_at is not None and i == fail_at:
+                        stats["errors"] += 1
+                        if abort:
+                            raise ConnectionResetError("mock upstream aborted the stream")
+                        failed = {"status": "FAILED", "error_code": "INTERNAL_ERROR", "text": "mock failure"}
+                        yield f"data: {json.dumps(failed)}\n\n".encode("utf-8")
+                        return
+                    if delay:
+                        await asyncio.sleep(delay)
+                    yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode("utf-8")
+                stats["completed"] += 1
+            finally:
+                stats["active"] -= 1
+
+        return StreamingResponse(generate(), media_type="text/event-stream")
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock Perplexity upstream")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--format", choices=sorted(FORMATS), default="answer")
+    parser.add_argument("--chars", type=int, default=2000, help="每个回答的字符数")
+    parser.add_argument("--chunk-chars", type=int, default=24, help="每个事件新增的字符数")
+    parser.add_argument("--token-rate", type=float, default=60.0, help="每个流的 token/s，0 表示不限速")
+    parser.add_argument("--ttfb", type=float, default=0.3, help="首个事件前的等待秒数")
+    parser.add_argument("--forbidden-rate", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    import uvicorn
+    app = create_app(args.format, args.chars, args.chunk_chars, args.token_rate,
+                     args.ttfb, args.forbidden_rate, args.error_rate)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+合成的 perplexity_ask SSE 录制流。
+
+事件结构与真实抓包一致（answer 为 step 数组的 JSON 字符串、text 为 chunks 对象等），
+文本内容为合成数据。基准测试和本地 mock 上游共用这里的数据。
+"""
+import json
+import uuid
+from typing import Dict, Any, List
+
+SAMPLE_TEXT = (
+    "Perplexity 会先联网搜索，再综合多个来源给出带引用的回答。"
+    "The answer keeps growing as the model streams tokens, and every event "
+    "re-sends the full answer so far. 这就是增量解码要解决的问题。\n\n"
+)
+
+
+def make_text(n_chars: int) -> str:
+    repeats = n_chars // len(SAMPLE_TEXT) + 1
+    return (SAMPLE_TEXT * repeats)[:n_chars]
+
+
+def _ids() -> Dict[str, str]:
+    return {
+        "backend_uuid": str(uuid.uuid4()),
+        "context_uuid": str(uuid.uuid4()),
+        "frontend_context_uuid": str(uuid.uuid4()),
+        "read_write_token": uuid.uuid4().hex,
+        "thread_url_slug": f"bench-{uuid.uuid4().hex[:8]}",
+    }
+
+
+def answer_steps_events(n_chars: int, chunk_chars: int = 24, query: str = "benchmark query") -> List[Dict[str, Any]]:
+    """answer 字段为 step 数组（SEARCH_WEB -> SEARCH_RESULTS -> FINAL），FINAL 逐步增长"""
+    text = make_text(n_chars)
+    ids = _ids()
+    search_web = {"step_type": "SEARCH_WEB", "content": {"queries": [{"query": query}]}}
+    search_results = {
+        "step_type": "SEARCH_RESULTS",
+        "content": {"web_results": [{"url": f"https://example.com/{i}", "name": f"source {i}"} for i in range(8)]},
+    }
+    events = [
+        {**ids, "status": "PENDING", "answer": json.dumps([search_web], ensure_ascii=False)},
+        {**ids, "status": "PENDING", "answer": json.dumps([search_web, search_results], ensure_ascii=False)},
+    ]
+    for end in range(chunk_chars, n_chars + chunk_chars, chunk_chars):
+        final = {
+            "step_type": "FINAL",
+            "content": {"answer": json.dumps({"answer": text[:end]}, ensure_ascii=False)},
+        }
+        events.append({
+            **ids,
+            "status": "PENDING",
+            "answer": json.dumps([search_web, search_results, final], ensure_ascii=False),
+        })
+    events[-1]["status"] = "COMPLETED"
+    return events
+
+
+def text_chunks_events(n_chars: int, chunk_chars: int = 24) -> List[Dict[str, Any]]:
+    """text 字段为 {"chunks": [...]}，chunks 逐步追加"""
+    text = make_text(n_chars)
+    ids = _ids()
+    chunks = [text[i:i + chunk_chars] for i in range(0, n_chars, chunk_chars)]
+    return [
+        {**ids, "status": "PENDING", "text": json.dumps({"chunks": chunks[:i + 1]}, ensure_ascii=False)}
+        for i in range(len(chunks))
+    ]
+
+
+def plain_answer_events(n_chars: int, chunk_chars: int = 24) -> List[Dict[str, Any]]:
+    """answer 字段直接是纯文本"""
+    text = make_text(n_chars)
+    ids = _ids()
+    return [
+        {**ids, "status": "PENDING", "answer": text[:end]}
+        for end in range(chunk_chars, n_chars + chunk_chars, chunk_chars)
+    ]
+
+
+def rewrite_events(n_chars: int, chunk_chars: int = 24) -> List[Dict[str, Any]]:
+    """中途改写前文的流：到一半时把已输出部分末尾的一个字替换掉"""
+    events = plain_answer_events(n_chars, chunk_chars)
+    half = len(events) // 2
+    pos = len(events[half - 1]["answer"]) - 5
+    for event in events[half:]:
+        event["answer"] = event["answer"][:pos] + "※" + event["answer"][pos + 1:]
+    return events
+
+
+def to_sse_lines(events: List[Dict[str, Any]]) -> List[str]:
+    """按上游格式编码为 SSE 行（不含换行符，与 aiter_lines 的产出一致）"""
+    lines = []
+    for event in events:
+        lines.append("data: " + json.dumps(event, ensure_ascii=False))
+        lines.append("")
+    return lines
+
+
+def to_sse_bytes(events: List[Dict[str, Any]]) -> bytes:
+    return "".join(line + "\n" for line in to_sse_lines(events)).encode("utf-8")
@@ -1,38 +1,125 @@
-import logging
-import sys
+import asyncio
+import time
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, Request, Depends, Header, HTTPException
-from fastapi.responses import JSONResponse, HTMLResponse
+from typing import Any, Dict, Optional
+from fastapi import FastAPI, Request, Depends, Header, HTTPException, UploadFile, File, Form
+from fastapi.responses import JSONResponse, HTMLResponse, PlainTextResponse, FileResponse
+from pydantic import BaseModel
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from loguru import logger
 
 from app.core.config import settings
+from app.core.logging import setup_logging
 from app.providers.perplexity_provider import PerplexityProvider
+from app.services.browser_manager import browser_manager
+from app.services.admission import AdmissionController, AdmissionMiddleware
+from app.services.keepalive import SessionKeepalive
+from app.services.batch_runner import BatchRunner
+from app.utils.metrics import REGISTRY
 
-# [修改] 设置日志级别为 DEBUG，格式包含文件名和行号
-logger.remove()
-logger.add(
-    sys.stdout, 
-    level="DEBUG", 
-    format="<green>{time:HH:mm:ss}</green> | <level>{level: <8}</level> | <cyan>{name}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>"
-)
+# 日志级别 / JSON / 队列输出由 LOG_* 配置控制，格式包含文件名和行号
+setup_logging()
 
 provider = PerplexityProvider()
+admission = AdmissionController(
+    max_inflight=settings.ADMISSION_MAX_INFLIGHT,
+    per_key_limit=settings.ADMISSION_PER_KEY_LIMIT,
+    max_queue=settings.ADMISSION_MAX_QUEUE,
+    queue_timeout=settings.ADMISSION_QUEUE_TIMEOUT,
+    background_headroom=settings.BATCH_ADMISSION_HEADROOM,
+)
+batches = BatchRunner(provider, admission, root=settings.BATCH_DIR, concurrency=settings.BATCH_CONCURRENCY)
+keepalive = SessionKeepalive(provider.pool) if settings.KEEPALIVE_ENABLED else None
+
+BREAKER_STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+def collect_runtime_metrics():
+    """把 /v1/stats 中的现有状态以 gauge/counter 形式导出给 /metrics"""
+    stats = provider.get_stats()
+    sessions = stats["sessions"]
+    yield ("pplx_session_in_flight", "gauge", "In-flight requests per pooled session",
+           [({"session": s["name"]}, s["in_flight"]) for s in sessions])
+    yield ("pplx_session_health", "gauge", "Health score per pooled session",
+           [({"session": s["name"]}, s["health"]) for s in sessions])
+    yield ("pplx_session_evicted", "gauge", "Whether a pooled session is evicted",
+           [({"session": s["name"]}, int(s["evicted"])) for s in sessions])
+
+    upstream = stats["upstream"]
+    yield ("pplx_upstream_requests_total", "counter", "Upstream requests sent", [({}, upstream["requests_total"])])
+    yield ("pplx_upstream_connections_opened_total", "counter", "New upstream connections opened",
+           [({}, upstream["connections_opened"])])
+
+    browser = stats["browser"]
+    yield ("pplx_browser_healthy", "gauge", "Whether the shared browser is connected", [({}, int(browser["healthy"]))])
+    yield ("pplx_browser_launches_total", "counter", "Browser launches", [({}, browser["launch_count"])])
+
+    if stats["cache"] is not None:
+        cache = stats["cache"]
+        yield ("pplx_cache_entries", "gauge", "Response cache entries", [({}, cache["entries"])])
+        yield ("pplx_cache_bytes", "gauge", "Response cache size in bytes", [({}, cache["bytes"])])
+        yield ("pplx_cache_lookups_total", "counter", "Response cache lookups by result",
+               [({"result": "hit"}, cache["hits"]), ({"result": "miss"}, cache["misses"])])
+    if stats["coalescer"] is not None:
+        coalescer = stats["coalescer"]
+        yield ("pplx_coalesced_inflight", "gauge", "Upstream streams shared by coalesced requests",
+               [({}, coalescer["inflight"])])
+        yield ("pplx_coalesced_joiners_total", "counter", "Requests that joined an in-flight stream",
+               [({}, coalescer["joiners"])])
+
+    breakers = stats["breakers"]
+    yield ("pplx_circuit_state", "gauge", "Circuit breaker state (0=closed, 1=half_open, 2=open)",
+           [({"breaker": name}, BREAKER_STATES[b["state"]]) for name, b in breakers.items()])
+    yield ("pplx_circuit_opened_total", "counter", "Times a circuit breaker opened",
+           [({"breaker": name}, b["opened_total"]) for name, b in breakers.items()])
+    yield ("pplx_circuit_rejected_total", "counter", "Calls rejected by an open circuit breaker",
+           [({"breaker": name}, b["rejected_total"]) for name, b in breakers.items()])
+
+    if keepalive is not None:
+        ka = keepalive.stats()
+        yield ("pplx_keepalive_interval_seconds", "gauge", "Current keepalive renewal interval per session",
+               [({"session": s["name"]}, s["interval"]) for s in ka["sessions"]])
+        yield ("pplx_keepalive_refreshes_total", "counter", "Keepalive renewals by result",
+               [({"result": "success"}, ka["refreshes"] - ka["failures"]), ({"result": "failure"}, ka["failures"])])
+
+    adm = admission.stats()
+    yield ("pplx_admission_active", "gauge", "Requests holding an admission slot", [({}, adm["active"])])
+    yield ("pplx_admission_queue_depth", "gauge", "Requests waiting for an admission slot", [({}, adm["queue_depth"])])
+    yield ("pplx_admission_rejected_total", "counter", "Requests rejected by admission control",
+           [({"reason": "queue_full"}, adm["rejected_queue_full"]), ({"reason": "timeout"}, adm["rejected_timeout"])])
+
+REGISTRY.register_collector(collect_runtime_metrics)
+
+STARTED_AT = time.time()
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    logger.info(f"启动 {settings.APP_NAME} v{settings.APP_VERSION} (Deep Debug Mode)...")
-    logger.info("正在初始化 Playwright 浏览器服务...")
+    logger.info(f"启动 {settings.APP_NAME} v{settings.APP_VERSION} (日志级别 {settings.LOG_LEVEL})...")
+    await provider.startup()
     try:
-        await provider.solver.initialize_session()
+        await provider.pool.initialize()
     except Exception as e:
         logger.error(f"初始化失败: {e}")
+    # 浏览器预热（启动 Playwright + 过盾）放到后台，端口立即可用；就绪状态见 /readyz
+    logger.info("正在后台预热浏览器会话...")
+    provider.pool.start_warmup()
+    browser_manager.start_monitor()
+    if keepalive is not None:
+        keepalive.start()
+    await batches.start()
     yield
+    await batches.close()
+    if keepalive is not None:
+        await keepalive.close()
+    await provider.shutdown()
+    await browser_manager.close()
     logger.info("服务关闭。")
+    await logger.complete()
 
 app = FastAPI(title=settings.APP_NAME, lifespan=lifespan)
 
+# 先添加的中间件在内层：CORS 在外层，429 响应也能带上跨域头
+app.add_middleware(AdmissionMiddleware, controller=admission)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -53,16 +140,104 @@ async def chat(request: Request):
     try:
         data = await request.json()
         # [新增] 打印客户端原始请求
-        logger.debug(f"收到客户端请求: {data}")
-        return await provider.chat_completion(data)
+        logger.debug("收到客户端请求: {}", data)
+        return await provider.chat_completion(data, request)
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Request Error: {e}")
+        logger.error("Request Error: {}", e)
         raise HTTPException(500, str(e))
 
 @app.get("/v1/models")
 async def models():
     return await provider.get_models()
 
+@app.get("/v1/stats")
+async def stats():
+    return {
+        **provider.get_stats(),
+        "admission": admission.stats(),
+        "keepalive": keepalive.stats() if keepalive is not None else None,
+        "batches": batches.stats(),
+        "warmup": provider.pool.warmup_stats(),
+    }
+
+class BatchCreate(BaseModel):
+    input_file_id: str
+    endpoint: str = "/v1/chat/completions"
+    completion_window: str = "24h"
+    metadata: Optional[Dict[str, Any]] = None
+
+@app.post("/v1/files", dependencies=[Depends(verify_key)])
+async def upload_file(file: UploadFile = File(...), purpose: str = Form("batch")):
+    data = await file.read(settings.BATCH_MAX_FILE_BYTES + 1)
+    if len(data) > settings.BATCH_MAX_FILE_BYTES:
+        raise HTTPException(413, f"File exceeds {settings.BATCH_MAX_FILE_BYTES} bytes")
+    return await asyncio.to_thread(batches.files.create, file.filename or "input.jsonl", purpose, data)
+
+@app.get("/v1/files/{file_id}", dependencies=[Depends(verify_key)])
+async def get_file(file_id: str):
+    meta = await asyncio.to_thread(batches.files.get, file_id)
+    if meta is None:
+        raise HTTPException(404, "File not found")
+    return meta
+
+@app.get("/v1/files/{file_id}/content", dependencies=[Depends(verify_key)])
+async def get_file_content(file_id: str):
+    # 批处理进行中也可以下载：内容为当前已完成的部分
+    if await asyncio.to_thread(batches.files.get, file_id) is None:
+        raise HTTPException(404, "File not found")
+    return FileResponse(batches.files.content_path(file_id), media_type="application/jsonl")
+
+@app.post("/v1/batches", dependencies=[Depends(verify_key)])
+async def create_batch(body: BatchCreate):
+    return await batches.create(body.input_file_id, body.endpoint, body.completion_window, body.metadata)
+
+@app.get("/v1/batches", dependencies=[Depends(verify_key)])
+async def list_batches(limit: int = 20):
+    return {"object": "list", "data": batches.list(limit)}
+
+@app.get("/v1/batches/{batch_id}", dependencies=[Depends(verify_key)])
+async def get_batch(batch_id: str):
+    state = batches.get(batch_id)
+    if state is None:
+        raise HTTPException(404, "Batch not found")
+    return state
+
+@app.post("/v1/batches/{batch_id}/cancel", dependencies=[Depends(verify_key)])
+async def cancel_batch(batch_id: str):
+    state = await batches.cancel(batch_id)
+    if state is None:
+        raise HTTPException(404, "Batch not found")
+    return state
+
+@app.get("/health")
+async def health():
+    """熔断器未打开时为 ok；任一熔断器打开时为 degraded（仍返回 200，可回放缓存）"""
+    breakers = {"upstream": provider.breaker.stats(), "refresh": provider.pool.refresh_breaker.stats()}
+    degraded = any(b["state"] == "open" for b in breakers.values())
+    return {
+        "status": "degraded" if degraded else "ok",
+        "breakers": breakers,
+        "browser": browser_manager.stats()["healthy"],
+    }
+
+@app.get("/livez")
+async def livez():
+    """存活探针：事件循环能响应即为存活，不依赖浏览器与上游"""
+    return {"status": "alive", "uptime": round(time.time() - STARTED_AT, 1)}
+
+@app.get("/readyz")
+async def readyz():
+    """就绪探针：有会话持有可用 Cookie（或启动预热已结束）即就绪，否则返回 503；预热进度作为附加信息"""
+    ready = provider.pool.is_ready()
+    body = {"status": "ready" if ready else "warming_up", "warmup": provider.pool.warmup_stats()}
+    return JSONResponse(body, status_code=200 if ready else 503)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/", response_class=HTMLResponse)
 async def ui():
     with open("static/index.html", "r", encoding="utf-8") as f: